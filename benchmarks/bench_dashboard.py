@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Render latency of /dashboard for one host and of /api/overview for every host as
+response_log grows, each size is
+populated into a fresh sqlite database at the latest schema and results are emitted
+as JSON
+
+PYTHONPATH=src/hostpoller ./benchmarks/bench_dashboard.py --rows 10000,1000000,10000000
+"""
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import tempfile
+from time import perf_counter, time
+from typing import Dict, List
+
+from flaskwrapper import FlaskWrapper
+from headerstore import HeaderStore
+from parseargs import ParseArgs
+from responselog import ResponseLog
+from rollup import Rollup
+
+HEADERS = [
+    ["cache-control", "max-age=0, private, must-revalidate"],
+    ["content-type", "text/html; charset=utf-8"],
+    ["server", "nginx"],
+]
+
+
+class DashboardBenchmark:
+    """
+    Populate response_log, hosts and rollups for one size and time dashboard renders
+    over each latency range with the render cache off
+    """
+
+    def __init__(self, bench_meta: dict) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.db_path = bench_meta["db_path"]
+        self.rows = bench_meta["rows"]
+        self.hosts = bench_meta["hosts"]
+        self.days = bench_meta["days"]
+        self.repeat = bench_meta["repeat"]
+        self.ranges = bench_meta["ranges"]
+        self.overview_windows = bench_meta["overview_windows"]
+        self.time_end = int(time())
+        self.time_start = self.time_end - self.days * 86400
+
+    def populate(self) -> float:
+        """
+        Create the schema through ResponseLog and fill it with synthetic rows in SQL
+        """
+        time_start = perf_counter()
+        response_log = ResponseLog("sqlite", self.db_path)
+        Rollup(response_log.engine)
+        response_log.engine.engine.dispose()
+        response_log.engine.reader_engine.dispose()
+
+        content = HeaderStore.normalize("headers", HEADERS)
+        digest = HeaderStore.digest("headers", content)
+        connection = sqlite3.connect(self.db_path)
+        connection.execute(
+            "INSERT INTO header_sets VALUES (?, 'headers', ?)", (digest, content)
+        )
+        connection.execute(
+            "WITH RECURSIVE seq(n) AS "
+            "(SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < :rows - 1) "
+            "INSERT INTO response_log (response_date, protocol, host, request_path, "
+            "response_code, response_reason, response_cookies, response_headers, "
+            "time_elapsed, time_dns, time_connect, time_tls, time_ttfb, time_transfer) "
+            "SELECT :start + n * :span / :rows, 'https', "
+            "'host-' || (n % :hosts) || '.example.com', '/', "
+            "CASE WHEN n % 97 = 0 THEN 1 WHEN n % 31 = 0 THEN 503 ELSE 200 END, "
+            "'OK', NULL, :digest, 1000 + (n * 7919) % 500000, "
+            "0, 0, 0, 900 + (n * 7919) % 500000, 100 FROM seq",
+            {
+                "rows": self.rows,
+                "hosts": self.hosts,
+                "start": self.time_start,
+                "span": self.time_end - self.time_start,
+                "digest": digest,
+            },
+        )
+        connection.execute(
+            "INSERT INTO hosts SELECT host, min(response_date), max(response_date), "
+            "200, count(*) FROM response_log GROUP BY host"
+        )
+        # Rollups the poller would have written, percentiles approximated
+        for resolution in Rollup.resolutions.values():
+            connection.execute(
+                "INSERT INTO response_rollup SELECT host, :size, "
+                "response_date - response_date % :size, count(*), min(time_elapsed), "
+                "max(time_elapsed), avg(time_elapsed), avg(time_elapsed), "
+                "max(time_elapsed), max(time_elapsed) FROM response_log "
+                "WHERE response_code >= 100 GROUP BY 1, 3",
+                {"size": resolution},
+            )
+        connection.commit()
+        connection.close()
+        return perf_counter() - time_start
+
+    def time_renders(self) -> Dict[str, Dict[str, float]]:
+        """
+        Request the dashboard for one host over each range and the overview of every
+        host over each window and return timings
+        """
+        response_log = ResponseLog("sqlite", self.db_path)
+        # Named like the poller's app so templates resolve from the working directory
+        flask_wrapper = FlaskWrapper(
+            {"name": "hostpoller", "listen_ip": "127.0.0.1", "listen_port": 0},
+            response_log,
+            Rollup(response_log.engine),
+        )
+        flask_wrapper.add_endpoint(
+            "dashboard", "/dashboard", flask_wrapper.dashboard_endpoint, ["GET"]
+        )
+        flask_wrapper.add_endpoint(
+            "overview_api",
+            "/api/overview",
+            flask_wrapper.overview_api_endpoint,
+            ["GET"],
+        )
+        client = flask_wrapper.flask_app.test_client()
+        requests = [
+            (
+                f"range_{time_range}",
+                "/dashboard",
+                {"host_selection": "host-1.example.com", "range": time_range},
+            )
+            for time_range in self.ranges
+        ] + [
+            (f"overview_{window}", "/api/overview", {"window": window})
+            for window in self.overview_windows
+        ]
+        results = {}
+        for name, path, query_string in requests:
+            timings: List[float] = []
+            for _ in range(self.repeat):
+                time_start = perf_counter()
+                response = client.get(path, query_string=query_string)
+                timings.append((perf_counter() - time_start) * 1000)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{path} returned {response.status_code}")
+            results[name] = {
+                "median_ms": statistics.median(timings),
+                "min_ms": min(timings),
+                "max_ms": max(timings),
+            }
+        return results
+
+    def run(self) -> Dict:
+        """
+        Populate and time renders for this size
+        """
+        self.logger.info("Populating %s rows in %s", self.rows, self.db_path)
+        results: Dict = {"rows": self.rows, "hosts": self.hosts}
+        results["populate_seconds"] = self.populate()
+        results["db_bytes"] = os.path.getsize(self.db_path)
+        self.logger.info("Timing dashboard renders at %s rows", self.rows)
+        results["renders"] = self.time_renders()
+        return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s:%(name)s:%(levelname)s]: %(message)s",
+    )
+    app_metadata = {
+        "name": "bench_dashboard",
+        "description": "Benchmark dashboard render latency as response_log grows.",
+    }
+    app_arguments = [
+        {
+            "switch": "--rows",
+            "default": "10000,1000000,10000000",
+            "help": "Comma separated response_log sizes to time, "
+            "default: 10000,1000000,10000000",
+            "type": str,
+        },
+        {
+            "switch": "--hosts",
+            "default": 100,
+            "help": "Distinct hosts to spread rows over, default: 100",
+            "type": int,
+        },
+        {
+            "switch": "--days",
+            "default": 7,
+            "help": "Days of response dates to spread rows over, default: 7",
+            "type": int,
+        },
+        {
+            "switch": "--ranges",
+            "default": "0,900,3600,86400,604800",
+            "help": "Comma separated latency ranges in seconds to render, "
+            "default: 0,900,3600,86400,604800",
+            "type": str,
+        },
+        {
+            "switch": "--overview-windows",
+            "default": "300,3600,21600",
+            "help": "Comma separated overview windows in seconds to render, "
+            "default: 300,3600,21600",
+            "type": str,
+        },
+        {
+            "switch": "--repeat",
+            "default": 5,
+            "help": "Renders per range, default: 5",
+            "type": int,
+        },
+    ]
+    args = ParseArgs(
+        app_metadata["name"], app_metadata["description"], app_arguments
+    ).args_parsed
+
+    all_results = []
+    for row_count in [int(rows) for rows in args.rows.split(",")]:
+        with tempfile.TemporaryDirectory() as bench_dir:
+            benchmark = DashboardBenchmark(
+                {
+                    "db_path": os.path.join(bench_dir, "bench_dashboard.db"),
+                    "rows": row_count,
+                    "hosts": args.hosts,
+                    "days": args.days,
+                    "repeat": args.repeat,
+                    "ranges": [int(seconds) for seconds in args.ranges.split(",")],
+                    "overview_windows": [
+                        int(seconds) for seconds in args.overview_windows.split(",")
+                    ],
+                }
+            )
+            all_results.append(benchmark.run())
+    print(json.dumps(all_results, indent=2))
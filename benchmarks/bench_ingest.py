@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Ingestion rate of the response log per storage backend, batches shaped like the
+poller's go through the header store and Squeal.insert_many, followed by single row
+Squeal.insert and the BatchWriter queue, throughput is emitted as JSON
+
+PostgreSQL runs in a scratch database created on the server given by --pg-url and
+dropped afterwards
+
+PYTHONPATH=src/hostpoller ./benchmarks/bench_ingest.py --rows 1000000 \
+    --pg-url postgresql://postgres@127.0.0.1/postgres
+"""
+import json
+import logging
+import os
+import statistics
+import tempfile
+from time import perf_counter, time
+from typing import Dict, List
+
+from parseargs import ParseArgs
+from responselog import ResponseLog
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from squeal import BatchWriter
+
+HEADERS = [
+    ("Server", "nginx"),
+    ("Content-Type", "text/html; charset=utf-8"),
+    ("Cache-Control", "max-age=0, private, must-revalidate"),
+    ("X-Frame-Options", "deny"),
+]
+
+
+class IngestBenchmark:
+    """
+    Write synthetic batches into one backend and time each transaction
+    """
+
+    def __init__(self, bench_meta: dict) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.engine_type = bench_meta["engine_type"]
+        self.db_path = bench_meta["db_path"]
+        self.rows = bench_meta["rows"]
+        self.hosts = bench_meta["hosts"]
+        self.batch_size = bench_meta["batch_size"]
+        self.days = bench_meta["days"]
+        self.single_rows = bench_meta["single_rows"]
+        self.time_start = int(time()) - self.days * 86400
+
+    def batch(self, offset: int) -> List[dict]:
+        """
+        Build batch of records starting at offset, dates spread over the given days
+        """
+        step = self.days * 86400 / self.rows
+        return [
+            {
+                "response_date": self.time_start + int(index * step),
+                "protocol": "https",
+                "host": f"host-{index % self.hosts}.example.com",
+                "request_path": "/",
+                "response_code": 503 if index % 31 == 0 else 200,
+                "response_reason": "OK",
+                "response_cookies": [],
+                "response_headers": HEADERS + [("Date", str(self.time_start + index))],
+                "time_elapsed": 1000 + (index * 7919) % 500000,
+            }
+            for index in range(offset, min(self.rows, offset + self.batch_size))
+        ]
+
+    def run(self) -> Dict:
+        """
+        Insert every row and return throughput with batch latency percentiles
+        """
+        response_log = ResponseLog(self.engine_type, self.db_path)
+        squeal = response_log.engine
+        batch_ms = []
+        self.logger.info("Ingesting %s rows into %s", self.rows, self.engine_type)
+        time_start = perf_counter()
+        for offset in range(0, self.rows, self.batch_size):
+            records = self.batch(offset)
+            batch_start = perf_counter()
+            response_log.header_store.prepare(records)
+            squeal.insert_many(response_log.response_log, records)
+            batch_ms.append((perf_counter() - batch_start) * 1000)
+        elapsed = perf_counter() - time_start
+        results = {
+            "engine": self.engine_type,
+            "rows": self.rows,
+            "batch_size": self.batch_size,
+            "seconds": elapsed,
+            "rows_per_second": self.rows / elapsed,
+            "batch_median_ms": statistics.median(batch_ms),
+            "batch_p99_ms": sorted(batch_ms)[
+                min(len(batch_ms) - 1, int(len(batch_ms) * 0.99))
+            ],
+        }
+        results.update(self.run_single(response_log))
+        results.update(self.run_writer(response_log))
+        squeal.engine.dispose()
+        squeal.reader_engine.dispose()
+        return results
+
+    def run_single(self, response_log: ResponseLog) -> Dict:
+        """
+        Insert rows one transaction each through Squeal.insert
+        """
+        records = [
+            record
+            for offset in range(0, self.single_rows, self.batch_size)
+            for record in self.batch(offset)
+        ][: self.single_rows]
+        self.logger.info("Inserting %s single rows", len(records))
+        time_start = perf_counter()
+        for record in records:
+            response_log.header_store.prepare([record])
+            response_log.engine.insert(response_log.response_log, record)
+        elapsed = perf_counter() - time_start
+        return {
+            "single_rows": len(records),
+            "single_rows_per_second": len(records) / elapsed,
+        }
+
+    def run_writer(self, response_log: ResponseLog) -> Dict:
+        """
+        Queue every row on a BatchWriter as the poller does and time until written
+        """
+        writer = BatchWriter(
+            response_log.engine,
+            response_log.response_log,
+            {"batch_size": self.batch_size, "max_age": 1.0, "queue_size": 10000},
+        )
+        writer.add_preparer(response_log.header_store.prepare)
+        self.logger.info("Queueing %s rows on the batch writer", self.rows)
+        time_start = perf_counter()
+        writer.start()
+        for offset in range(0, self.rows, self.batch_size):
+            for record in self.batch(offset):
+                writer.put(record)
+        writer.stop()
+        elapsed = perf_counter() - time_start
+        return {
+            "writer_rows_per_second": writer.stats["rows_written"] / elapsed,
+            "writer_blocked_puts": writer.stats["blocked_puts"],
+        }
+
+
+def run_postgres(bench_meta: dict, server_url: str) -> Dict:
+    """
+    Run benchmark in a scratch database on the given server and drop it afterwards
+    """
+    url = make_url(server_url)
+    scratch = f"bench_ingest_{os.getpid()}"
+    server = create_engine(url, isolation_level="AUTOCOMMIT")
+    with server.connect() as connection:
+        connection.execute(text(f"CREATE DATABASE {scratch}"))
+    try:
+        bench_meta["db_path"] = str(url.set(database=scratch))
+        return IngestBenchmark(bench_meta).run()
+    finally:
+        with server.connect() as connection:
+            connection.execute(text(f"DROP DATABASE {scratch}"))
+        server.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s:%(name)s:%(levelname)s]: %(message)s",
+    )
+    app_metadata = {
+        "name": "bench_ingest",
+        "description": "Benchmark response_log ingestion per storage backend.",
+    }
+    app_arguments = [
+        {
+            "switch": "--engine",
+            "action": "append",
+            "default": None,
+            "help": "Engine type to run, repeatable, default: sqlite, sqlite-wal and "
+            "postgresql when --pg-url is given",
+            "type": str,
+        },
+        {
+            "switch": "--pg-url",
+            "default": "",
+            "help": "PostgreSQL server URL to create the scratch database on",
+            "type": str,
+        },
+        {
+            "switch": "--rows",
+            "default": 1_000_000,
+            "help": "Rows to ingest, default: 1000000",
+            "type": int,
+        },
+        {
+            "switch": "--hosts",
+            "default": 100,
+            "help": "Distinct hosts to spread rows over, default: 100",
+            "type": int,
+        },
+        {
+            "switch": "--batch-size",
+            "default": 500,
+            "help": "Records per insert transaction, default: 500",
+            "type": int,
+        },
+        {
+            "switch": "--single-rows",
+            "default": 2000,
+            "help": "Rows inserted one transaction each, default: 2000",
+            "type": int,
+        },
+        {
+            "switch": "--days",
+            "default": 7,
+            "help": "Days of response dates to spread rows over, default: 7",
+            "type": int,
+        },
+    ]
+    args = ParseArgs(
+        app_metadata["name"], app_metadata["description"], app_arguments
+    ).args_parsed
+
+    engine_types = args.engine or ["sqlite", "sqlite-wal"] + (
+        ["postgresql"] if args.pg_url else []
+    )
+    all_results = []
+    for engine_type in engine_types:
+        engine_meta = {
+            "engine_type": engine_type,
+            "db_path": "",
+            "rows": args.rows,
+            "hosts": args.hosts,
+            "batch_size": args.batch_size,
+            "days": args.days,
+            "single_rows": args.single_rows,
+        }
+        if engine_type == "postgresql":
+            all_results.append(run_postgres(engine_meta, args.pg_url))
+            continue
+        with tempfile.TemporaryDirectory() as bench_dir:
+            engine_meta["db_path"] = os.path.join(bench_dir, "bench_ingest.db")
+            all_results.append(IngestBenchmark(engine_meta).run())
+    print(json.dumps(all_results, indent=2))
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Mixed read/write load against each sqlite engine configuration, a writer inserts
+batches on a fixed interval while reader threads run full dashboard aggregates, and
+insert latency is reported as JSON to show whether readers stall ingestion
+
+PYTHONPATH=src/hostpoller ./benchmarks/bench_mixed.py --rows 1000000 --readers 4
+"""
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import tempfile
+from threading import Event, Thread
+from time import perf_counter, sleep, time
+from typing import Dict, List
+
+from parseargs import ParseArgs
+from responselog import ResponseLog
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+STATUS_HISTOGRAM = (
+    "SELECT host, CASE WHEN response_code < 100 THEN 'Invocation Error' "
+    "WHEN response_code < 300 THEN '2xx' WHEN response_code < 500 THEN '4xx' "
+    "ELSE '5xx' END AS bucket, count(*), avg(time_elapsed) "
+    "FROM response_log GROUP BY host, bucket"
+)
+
+
+class MixedLoadBenchmark:
+    """
+    Run a writer and concurrent readers against one engine type and time both sides
+    """
+
+    def __init__(self, bench_meta: dict) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.engine_type = bench_meta["engine_type"]
+        self.db_path = bench_meta["db_path"]
+        self.rows = bench_meta["rows"]
+        self.hosts = bench_meta["hosts"]
+        self.readers = bench_meta["readers"]
+        self.duration = bench_meta["duration"]
+        self.batch_size = bench_meta["batch_size"]
+        self.write_interval = bench_meta["write_interval"]
+        self.response_log = ResponseLog(self.engine_type, self.db_path, self.readers)
+        self.stop = Event()
+        self.insert_ms: List[float] = []
+        self.insert_errors = 0
+        self.read_ms: List[float] = []
+        self.read_errors = 0
+
+    def populate(self) -> float:
+        """
+        Fill the typed response_log with synthetic rows so reads scan real data
+        """
+        time_start = perf_counter()
+        connection = sqlite3.connect(self.db_path, timeout=60)
+        connection.execute(
+            "WITH RECURSIVE seq(n) AS "
+            "(SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < :rows - 1) "
+            "INSERT INTO response_log (response_date, protocol, host, request_path, "
+            "response_code, response_reason, response_cookies, response_headers, "
+            "time_elapsed) "
+            "SELECT :start + n / :hosts, 'https', 'host-' || (n % :hosts) || "
+            "'.example.com', '/', "
+            "CASE WHEN n % 97 = 0 THEN 1 WHEN n % 31 = 0 THEN 503 ELSE 200 END, "
+            "'OK', '', '', 1000 + (n * 7919) % 500000 FROM seq",
+            {
+                "rows": self.rows,
+                "hosts": self.hosts,
+                "start": int(time()) - self.rows // self.hosts,
+            },
+        )
+        connection.commit()
+        connection.close()
+        return perf_counter() - time_start
+
+    def batch(self) -> List[dict]:
+        """
+        Build one batch of records shaped like the poller's
+        """
+        response_date = int(time())
+        return [
+            {
+                "response_date": response_date,
+                "protocol": "https",
+                "host": f"host-{index % self.hosts}.example.com",
+                "request_path": "/",
+                "response_code": 200,
+                "response_reason": "OK",
+                "response_cookies": "",
+                "response_headers": "",
+                "time_elapsed": 1000 + index,
+            }
+            for index in range(self.batch_size)
+        ]
+
+    def write_loop(self) -> None:
+        """
+        Insert a batch every write interval and time each transaction
+        """
+        squeal = self.response_log.engine
+        table = self.response_log.response_log
+        while not self.stop.is_set():
+            records = self.batch()
+            time_start = perf_counter()
+            try:
+                squeal.insert_many(table, records)
+            except OperationalError as err:
+                self.insert_errors += 1
+                self.logger.debug("Insert failed: %s", err)
+            self.insert_ms.append((perf_counter() - time_start) * 1000)
+            sleep(self.write_interval)
+
+    def read_loop(self) -> None:
+        """
+        Run the full status histogram back to back on a pooled reader connection
+        """
+        reader_engine = self.response_log.engine.reader_engine
+        while not self.stop.is_set():
+            time_start = perf_counter()
+            try:
+                with reader_engine.connect() as connection:
+                    connection.execute(text(STATUS_HISTOGRAM)).fetchall()
+            except OperationalError as err:
+                self.read_errors += 1
+                self.logger.debug("Read failed: %s", err)
+            self.read_ms.append((perf_counter() - time_start) * 1000)
+
+    @staticmethod
+    def summarize(timings: List[float]) -> Dict[str, float]:
+        """
+        Return count and latency percentiles in milliseconds
+        """
+        if not timings:
+            return {"count": 0}
+        ordered = sorted(timings)
+        return {
+            "count": len(ordered),
+            "median_ms": statistics.median(ordered),
+            "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+            "max_ms": ordered[-1],
+        }
+
+    def run(self) -> Dict:
+        """
+        Populate, run the mixed load for the configured duration and return results
+        """
+        results: Dict = {"engine": self.engine_type, "readers": self.readers}
+        self.logger.info("Populating %s rows for %s", self.rows, self.engine_type)
+        results["populate_seconds"] = self.populate()
+
+        threads = [Thread(target=self.write_loop, name="bench-writer")]
+        threads += [
+            Thread(target=self.read_loop, name=f"bench-reader-{index}")
+            for index in range(self.readers)
+        ]
+        for thread in threads:
+            thread.start()
+        sleep(self.duration)
+        self.stop.set()
+        for thread in threads:
+            thread.join()
+
+        results["insert"] = self.summarize(self.insert_ms)
+        results["insert"]["errors"] = self.insert_errors
+        results["read"] = self.summarize(self.read_ms)
+        results["read"]["errors"] = self.read_errors
+        return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s:%(name)s:%(levelname)s]: %(message)s",
+    )
+    app_metadata = {
+        "name": "bench_mixed",
+        "description": "Benchmark inserts under concurrent dashboard reads.",
+    }
+    app_arguments = [
+        {
+            "switch": "--engine",
+            "action": "append",
+            "default": None,
+            "help": "Engine type to run, repeatable, default: sqlite and sqlite-wal",
+            "type": str,
+        },
+        {
+            "switch": "--rows",
+            "default": 1_000_000,
+            "help": "Rows to generate before the load starts, default: 1000000",
+            "type": int,
+        },
+        {
+            "switch": "--hosts",
+            "default": 100,
+            "help": "Distinct hosts to spread rows over, default: 100",
+            "type": int,
+        },
+        {
+            "switch": "--readers",
+            "default": 4,
+            "help": "Concurrent reader threads, default: 4",
+            "type": int,
+        },
+        {
+            "switch": "--duration",
+            "default": 20.0,
+            "help": "Seconds to run the mixed load for, default: 20",
+            "type": float,
+        },
+        {
+            "switch": "--batch-size",
+            "default": 500,
+            "help": "Records per insert transaction, default: 500",
+            "type": int,
+        },
+        {
+            "switch": "--write-interval",
+            "default": 0.25,
+            "help": "Seconds between insert transactions, default: 0.25",
+            "type": float,
+        },
+    ]
+    args = ParseArgs(
+        app_metadata["name"], app_metadata["description"], app_arguments
+    ).args_parsed
+
+    all_results = []
+    for engine_type in args.engine or ["sqlite", "sqlite-wal"]:
+        with tempfile.TemporaryDirectory() as bench_dir:
+            benchmark = MixedLoadBenchmark(
+                {
+                    "engine_type": engine_type,
+                    "db_path": os.path.join(bench_dir, "bench_mixed.db"),
+                    "rows": args.rows,
+                    "hosts": args.hosts,
+                    "readers": args.readers,
+                    "duration": args.duration,
+                    "batch_size": args.batch_size,
+                    "write_interval": args.write_interval,
+                }
+            )
+            all_results.append(benchmark.run())
+    print(json.dumps(all_results, indent=2))
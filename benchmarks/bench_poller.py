@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Polling throughput and scheduling accuracy of the Poller against a local stand-in
+target, results emitted as JSON
+
+PYTHONPATH=src/hostpoller ./benchmarks/bench_poller.py --targets 1000 \
+    --polling-frequency 1 --duration 30 --latency-ms 20
+"""
+import json
+import logging
+import statistics
+from argparse import Namespace as ArgNamespace
+from threading import Lock
+from time import monotonic, perf_counter
+from typing import Dict, List
+
+from parseargs import ParseArgs
+from poller import Poller
+from standin import StandInServer, parse_standin_meta, standin_arguments
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Value at given fraction of sorted values, 0 when there are none
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class PollerBenchmark:
+    """
+    Poll many targets on one stand-in server for a fixed duration and measure how
+    many polls complete and how closely they keep to the polling period
+    """
+
+    def __init__(self, bench_meta: dict) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.targets = bench_meta["targets"]
+        self.polling_frequency = bench_meta["polling_frequency"]
+        self.polling_jitter = bench_meta["polling_jitter"]
+        self.duration = bench_meta["duration"]
+        self.connection_mode = bench_meta["connection_mode"]
+        self.max_concurrency = bench_meta["max_concurrency"]
+        self.standin_meta = bench_meta["standin"]
+        self.lock = Lock()
+        self.completions: Dict[str, List[float]] = {}
+        self.status_counts: Dict[int, int] = {}
+        self.elapsed_ms: List[float] = []
+
+    def sink(self, record: dict) -> None:
+        """
+        Poller sink recording when each result arrived instead of storing it
+        """
+        arrived = monotonic()
+        with self.lock:
+            self.completions.setdefault(record["request_path"], []).append(arrived)
+            code = record["response_code"]
+            self.status_counts[code] = self.status_counts.get(code, 0) + 1
+            self.elapsed_ms.append(record["time_elapsed"] / 1000)
+
+    def poller_args(self, base_url: str) -> ArgNamespace:
+        """
+        Poller configuration, every target is a distinct path on the stand-in
+        """
+        return ArgNamespace(
+            target=[f"{base_url}/target/{index}" for index in range(self.targets)],
+            targets_file="",
+            monitor_period=self.duration,
+            polling_frequency=self.polling_frequency,
+            polling_jitter=self.polling_jitter,
+            request_timeout=10,
+            max_concurrency=self.max_concurrency,
+            max_per_host=self.max_concurrency,
+            pool_size=self.max_concurrency,
+            pool_per_host=self.max_concurrency,
+            keepalive_timeout=30,
+            connection_mode=self.connection_mode,
+        )
+
+    def run(self) -> Dict:
+        """
+        Run the poller against the stand-in and return throughput and accuracy
+        """
+        stand_in = StandInServer(self.standin_meta)
+        stand_in.start_process()
+        try:
+            poller = Poller(self.poller_args(stand_in.url), None, self.sink)
+            poller.ssl_context = stand_in.client_context()
+            self.logger.info(
+                "Polling %s targets every %ss for %ss",
+                self.targets,
+                self.polling_frequency,
+                self.duration,
+            )
+            time_start = perf_counter()
+            poller.start()
+            elapsed = perf_counter() - time_start
+        finally:
+            stand_in.stop()
+
+        # Deviation of each interval between consecutive results from the period
+        interval_error_ms = [
+            abs(later - earlier - self.polling_frequency) * 1000
+            for arrivals in self.completions.values()
+            for earlier, later in zip(arrivals, arrivals[1:])
+        ]
+        polls = sum(self.status_counts.values())
+        expected = self.targets * self.duration / self.polling_frequency
+        return {
+            "targets": self.targets,
+            "polling_frequency": self.polling_frequency,
+            "polling_jitter": self.polling_jitter,
+            "connection_mode": self.connection_mode,
+            "standin": self.standin_meta,
+            "seconds": elapsed,
+            "polls": polls,
+            "polls_per_second": polls / elapsed,
+            "completion_ratio": polls / expected,
+            "status_counts": self.status_counts,
+            "interval_error_median_ms": percentile(interval_error_ms, 0.5),
+            "interval_error_p99_ms": percentile(interval_error_ms, 0.99),
+            "recorded_median_ms": statistics.median(self.elapsed_ms or [0]),
+            "recorded_p99_ms": percentile(self.elapsed_ms, 0.99),
+            "schedule": poller.schedule_stats(),
+        }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s:%(name)s:%(levelname)s]: %(message)s",
+    )
+    app_metadata = {
+        "name": "bench_poller",
+        "description": "Benchmark polling throughput against a local stand-in target.",
+    }
+    app_arguments = [
+        {
+            "switch": "--targets",
+            "default": 1000,
+            "help": "Targets to poll, each a path on the stand-in, default: 1000",
+            "type": int,
+        },
+        {
+            "switch": "--polling-frequency",
+            "default": 1.0,
+            "help": "Seconds between polls of each target, default: 1",
+            "type": float,
+        },
+        {
+            "switch": "--polling-jitter",
+            "default": 0.0,
+            "help": "Fraction of the period each poll is randomly moved by, jitter "
+            "counts towards the interval error, default: 0",
+            "type": float,
+        },
+        {
+            "switch": "--duration",
+            "default": 30,
+            "help": "Seconds to poll for, default: 30",
+            "type": int,
+        },
+        {
+            "switch": "--connection-mode",
+            "default": "warm",
+            "help": "warm or cold connections, default: warm",
+            "type": str,
+        },
+        {
+            "switch": "--max-concurrency",
+            "default": 256,
+            "help": "Requests in flight at once, default: 256",
+            "type": int,
+        },
+    ] + standin_arguments()
+    args = ParseArgs(
+        app_metadata["name"], app_metadata["description"], app_arguments
+    ).args_parsed
+
+    benchmark = PollerBenchmark(
+        {
+            "targets": args.targets,
+            "polling_frequency": args.polling_frequency,
+            "polling_jitter": args.polling_jitter,
+            "duration": args.duration,
+            "connection_mode": args.connection_mode,
+            "max_concurrency": args.max_concurrency,
+            "standin": parse_standin_meta(args),
+        }
+    )
+    print(json.dumps(benchmark.run(), indent=2))
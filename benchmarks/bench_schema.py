@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Benchmark dashboard queries against the untyped (version 1) response_log and again
+after upgrading it in place to the latest schema, results emitted as JSON
+
+PYTHONPATH=src/hostpoller ./benchmarks/bench_schema.py --rows 10000000
+"""
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import tempfile
+from time import perf_counter, time
+from typing import Callable, Dict, List
+
+from migrations import Migrator
+from parseargs import ParseArgs
+from squeal import Squeal
+
+HEADERS = str(
+    {
+        "Server": "nginx",
+        "Content-Type": "text/html; charset=utf-8",
+        "Cache-Control": "max-age=0, private, must-revalidate",
+        "Strict-Transport-Security": "max-age=31536000; includeSubdomains; preload",
+        "X-Frame-Options": "deny",
+        "X-Content-Type-Options": "nosniff",
+        "Content-Security-Policy": "default-src 'none'; base-uri 'self'",
+    }
+)
+
+STATUS_BUCKETS = (
+    "CASE WHEN response_code < 100 THEN 'Invocation Error' "
+    "WHEN response_code < 200 THEN '1xx' WHEN response_code < 300 THEN '2xx' "
+    "WHEN response_code < 400 THEN '3xx' WHEN response_code < 500 THEN '4xx' "
+    "WHEN response_code < 600 THEN '5xx' ELSE 'Unhandled' END"
+)
+
+
+class SchemaBenchmark:
+    """
+    Populate a version 1 database, time queries, upgrade it and time them again
+    """
+
+    def __init__(self, bench_meta: dict) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.db_path = bench_meta["db_path"]
+        self.rows = bench_meta["rows"]
+        self.hosts = bench_meta["hosts"]
+        self.repeat = bench_meta["repeat"]
+        self.time_end = int(time())
+        self.time_start = self.time_end - self.rows // self.hosts
+
+    def populate(self) -> float:
+        """
+        Create the original untyped response_log filled with synthetic rows
+        """
+        time_start = perf_counter()
+        connection = sqlite3.connect(self.db_path)
+        connection.execute(
+            "CREATE TABLE response_log (id INTEGER NOT NULL PRIMARY KEY, "
+            "response_date TEXT, protocol VARCHAR, host VARCHAR, request_path VARCHAR, "
+            "response_code INTEGER, response_reason VARCHAR, response_cookies VARCHAR, "
+            "response_headers VARCHAR, time_elapsed VARCHAR)"
+        )
+        connection.execute(
+            "WITH RECURSIVE seq(n) AS "
+            "(SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < :rows - 1) "
+            "INSERT INTO response_log (response_date, protocol, host, request_path, "
+            "response_code, response_reason, response_cookies, response_headers, "
+            "time_elapsed) "
+            "SELECT strftime('%Y-%m-%dT%H:%M:%S', :start + n / :hosts, 'unixepoch'), "
+            "'https', 'host-' || (n % :hosts) || '.example.com', '/', "
+            "CASE WHEN n % 97 = 0 THEN 1 WHEN n % 31 = 0 THEN 503 ELSE 200 END, "
+            "'OK', '<RequestsCookieJar[]>', "
+            # Headers carry a Date per second like the ones recorded by polling
+            "'{''Date'': ''' || strftime('%Y-%m-%d %H:%M:%S GMT', "
+            ":start + n / :hosts, 'unixepoch') || ''', ' || substr(:headers, 2), "
+            "CAST(1000 + (n * 7919) % 500000 AS TEXT) FROM seq",
+            {
+                "rows": self.rows,
+                "hosts": self.hosts,
+                "start": self.time_start,
+                "headers": HEADERS,
+            },
+        )
+        connection.commit()
+        connection.close()
+        return perf_counter() - time_start
+
+    def time_query(self, query: Callable) -> Dict[str, float]:
+        """
+        Run query repeatedly and return timings in milliseconds
+        """
+        timings = []
+        for _ in range(self.repeat):
+            time_start = perf_counter()
+            query()
+            timings.append((perf_counter() - time_start) * 1000)
+        return {
+            "median_ms": statistics.median(timings),
+            "min_ms": min(timings),
+            "max_ms": max(timings),
+        }
+
+    def run_queries(self, typed: bool) -> Dict[str, Dict[str, float]]:
+        """
+        Time the queries behind the dashboard for a single host
+        """
+        connection = sqlite3.connect(self.db_path)
+        host = "host-1.example.com"
+        window_start: object = self.time_end - 3600
+        if not typed:
+            window_start = connection.execute(
+                "SELECT strftime('%Y-%m-%dT%H:%M:%S', ?, 'unixepoch')", (window_start,)
+            ).fetchone()[0]
+
+        def status_histogram() -> List:
+            return connection.execute(
+                f"SELECT {STATUS_BUCKETS}, count(*) FROM response_log "
+                "WHERE host = ? GROUP BY 1",
+                (host,),
+            ).fetchall()
+
+        def status_histogram_last_hour() -> List:
+            return connection.execute(
+                f"SELECT {STATUS_BUCKETS}, count(*) FROM response_log "
+                "WHERE host = ? AND response_date >= ? GROUP BY 1",
+                (host, window_start),
+            ).fetchall()
+
+        def latency_last_hour() -> List:
+            rows = connection.execute(
+                "SELECT time_elapsed FROM response_log "
+                "WHERE host = ? AND response_date >= ?",
+                (host, window_start),
+            ).fetchall()
+            if typed:
+                return [row[0] // 1000 for row in rows]
+            return [int(int(row[0]) / 1000) for row in rows]
+
+        def mean_latency() -> List:
+            return connection.execute(
+                "SELECT avg(time_elapsed) FROM response_log WHERE host = ?",
+                (host,),
+            ).fetchall()
+
+        def error_scan() -> List:
+            return connection.execute(
+                "SELECT id, response_headers FROM response_log "
+                "WHERE response_code >= 500"
+            ).fetchall()
+
+        results = {
+            "status_histogram": self.time_query(status_histogram),
+            "status_histogram_last_hour": self.time_query(status_histogram_last_hour),
+            "latency_last_hour": self.time_query(latency_last_hour),
+            "mean_latency": self.time_query(mean_latency),
+            "error_scan": self.time_query(error_scan),
+        }
+        connection.close()
+        return results
+
+    def run(self) -> Dict:
+        """
+        Run the full benchmark and return results
+        """
+        results: Dict = {"rows": self.rows, "hosts": self.hosts}
+        self.logger.info("Populating %s rows in %s", self.rows, self.db_path)
+        results["populate_seconds"] = self.populate()
+        results["db_bytes_v1"] = os.path.getsize(self.db_path)
+        self.logger.info("Timing version 1 queries")
+        results["v1"] = self.run_queries(typed=False)
+
+        time_start = perf_counter()
+        Migrator(Squeal({"type": "sqlite", "file_path": self.db_path})).upgrade()
+        results["upgrade_seconds"] = perf_counter() - time_start
+        # Reclaim pages freed by dropping the version 1 table before measuring size
+        time_start = perf_counter()
+        connection = sqlite3.connect(self.db_path)
+        connection.execute("VACUUM")
+        connection.close()
+        results["vacuum_seconds"] = perf_counter() - time_start
+        results["db_bytes_v2"] = os.path.getsize(self.db_path)
+        self.logger.info("Timing upgraded queries")
+        results["v2"] = self.run_queries(typed=True)
+        return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s:%(name)s:%(levelname)s]: %(message)s",
+    )
+    app_metadata = {
+        "name": "bench_schema",
+        "description": "Benchmark response_log queries before and after upgrade.",
+    }
+    app_arguments = [
+        {
+            "switch": "--rows",
+            "default": 10_000_000,
+            "help": "Rows to generate, default: 10000000",
+            "type": int,
+        },
+        {
+            "switch": "--hosts",
+            "default": 100,
+            "help": "Distinct hosts to spread rows over, default: 100",
+            "type": int,
+        },
+        {
+            "switch": "--repeat",
+            "default": 5,
+            "help": "Times each query is run, default: 5",
+            "type": int,
+        },
+        {
+            "switch": "--db-path",
+            "default": "",
+            "help": "Database file to create, default: a temporary file",
+            "type": str,
+        },
+    ]
+    args = ParseArgs(
+        app_metadata["name"], app_metadata["description"], app_arguments
+    ).args_parsed
+
+    with tempfile.TemporaryDirectory() as bench_dir:
+        db_path = args.db_path or os.path.join(bench_dir, "bench_schema.db")
+        benchmark = SchemaBenchmark(
+            {
+                "db_path": db_path,
+                "rows": args.rows,
+                "hosts": args.hosts,
+                "repeat": args.repeat,
+            }
+        )
+        print(json.dumps(benchmark.run(), indent=2))
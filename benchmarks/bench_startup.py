@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Startup time and memory of the poller with and without the web stack, each mode is
+started against a local stand-in target and timed until its first record is
+written, results are emitted as JSON
+
+PYTHONPATH=src/hostpoller ./benchmarks/bench_startup.py --modes collector,production
+"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+from signal import SIGTERM
+from time import perf_counter, sleep
+from typing import Dict, List, Optional
+from urllib.request import urlopen
+
+from parseargs import ParseArgs
+from standin import StandInServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+POLLER = os.path.join(REPO_ROOT, "src", "hostpoller", "poller.py")
+
+
+def free_port() -> int:
+    """
+    Port nothing is listening on right now
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def rss_mb(pid: int) -> float:
+    """
+    Resident set size of a running process from /proc
+    """
+    with open(f"/proc/{pid}/status", encoding="utf-8") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+class StartupBenchmark:
+    """
+    Start the poller in one serving mode until it writes a record, render one
+    dashboard when a web server runs, then stop it and collect its peak memory
+    """
+
+    def __init__(self, bench_meta: dict) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.serving_mode = bench_meta["serving_mode"]
+        self.target = bench_meta["target"]
+        self.timeout = bench_meta["timeout"]
+
+    def first_record(self, db_path: str, time_start: float) -> Optional[float]:
+        """
+        Seconds from launch until response_log has a row, None on timeout
+        """
+        while perf_counter() - time_start < self.timeout:
+            try:
+                connection = sqlite3.connect(db_path, timeout=1)
+                try:
+                    if connection.execute(
+                        "SELECT 1 FROM response_log LIMIT 1"
+                    ).fetchone():
+                        return perf_counter() - time_start
+                finally:
+                    connection.close()
+            except sqlite3.OperationalError:
+                # Database or table not created yet
+                pass
+            sleep(0.005)
+        return None
+
+    def run(self) -> Dict:
+        """
+        Launch, time and stop one poller process
+        """
+        results: Dict = {"serving_mode": self.serving_mode}
+        listen_port = free_port()
+        with tempfile.TemporaryDirectory() as bench_dir:
+            db_path = os.path.join(bench_dir, "bench_startup.db")
+            time_start = perf_counter()
+            process = subprocess.Popen(  # pylint: disable=consider-using-with
+                [
+                    sys.executable,
+                    POLLER,
+                    "--target",
+                    self.target,
+                    "--monitor-period",
+                    "0",
+                    "--serving-mode",
+                    self.serving_mode,
+                    "--listen-port",
+                    str(listen_port),
+                    "--sql-db-path",
+                    db_path,
+                ],
+                cwd=REPO_ROOT,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            try:
+                results["first_record_seconds"] = self.first_record(db_path, time_start)
+                results["rss_mb_first_record"] = rss_mb(process.pid)
+                if self.serving_mode != "collector":
+                    host = self.target.split("/")[2]
+                    time_render = perf_counter()
+                    with urlopen(
+                        f"http://127.0.0.1:{listen_port}/dashboard"
+                        f"?host_selection={host}",
+                        timeout=self.timeout,
+                    ) as response:
+                        response.read()
+                    results["first_dashboard_seconds"] = perf_counter() - time_render
+                    results["rss_mb_after_dashboard"] = rss_mb(process.pid)
+            finally:
+                process.send_signal(SIGTERM)
+                _, _, usage = os.wait4(process.pid, 0)
+                process.returncode = 0
+        # Kilobytes on Linux
+        results["peak_rss_mb"] = usage.ru_maxrss / 1024
+        return results
+
+
+def summarize(runs: List[Dict]) -> Dict:
+    """
+    Median of each measurement over repeated runs of one mode
+    """
+    summary: Dict = {"serving_mode": runs[0]["serving_mode"], "runs": len(runs)}
+    for key in runs[0]:
+        values = [run[key] for run in runs if isinstance(run.get(key), float)]
+        if values:
+            summary[key] = statistics.median(values)
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s:%(name)s:%(levelname)s]: %(message)s",
+    )
+    app_metadata = {
+        "name": "bench_startup",
+        "description": "Benchmark poller startup time and memory per serving mode.",
+    }
+    app_arguments = [
+        {
+            "switch": "--modes",
+            "default": "collector,production",
+            "help": "Comma separated serving modes to start, "
+            "default: collector,production",
+            "type": str,
+        },
+        {
+            "switch": "--repeat",
+            "default": 5,
+            "help": "Starts per mode, default: 5",
+            "type": int,
+        },
+        {
+            "switch": "--timeout",
+            "default": 30.0,
+            "help": "Seconds to wait for the first record, default: 30",
+            "type": float,
+        },
+    ]
+    args = ParseArgs(
+        app_metadata["name"], app_metadata["description"], app_arguments
+    ).args_parsed
+
+    stand_in = StandInServer({})
+    stand_in.start_process()
+    all_results = []
+    try:
+        for mode in args.modes.split(","):
+            logging.getLogger(__name__).info("Starting %s mode", mode)
+            benchmark = StartupBenchmark(
+                {
+                    "serving_mode": mode,
+                    "target": f"{stand_in.url}/",
+                    "timeout": args.timeout,
+                }
+            )
+            all_results.append(summarize([benchmark.run() for _ in range(args.repeat)]))
+    finally:
+        stand_in.stop()
+    print(json.dumps(all_results, indent=2))
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Local stand-in HTTP target for benchmarks, with configurable latency, status code
+mix, injected connection errors and a slow TLS handshake, runs entirely offline
+
+PYTHONPATH=src/hostpoller ./benchmarks/standin.py --latency-ms 50 \
+    --status-mix 200:95,503:5 --error-rate 0.01 --scheme https --tls-delay-ms 200
+"""
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import ssl
+import struct
+import subprocess
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep
+from typing import Dict, Optional, Tuple
+
+from parseargs import ParseArgs
+
+
+def parse_status_mix(status_mix: str) -> Dict[int, float]:
+    """
+    Parse code:weight pairs, eg: 200:95,503:5
+    """
+    weights = {}
+    for pair in status_mix.split(","):
+        code, weight = pair.split(":", 1)
+        weights[int(code)] = float(weight)
+    return weights
+
+
+def self_signed(directory: str) -> Tuple[str, str]:
+    """
+    Create a certificate for 127.0.0.1 and localhost with the openssl command line,
+    returns certificate and key paths
+    """
+    cert_path = os.path.join(directory, "standin.pem")
+    key_path = os.path.join(directory, "standin.key")
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+            "-addext",
+            "subjectAltName=IP:127.0.0.1,DNS:localhost",
+            "-keyout",
+            key_path,
+            "-out",
+            cert_path,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert_path, key_path
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Answer every GET after the configured latency with a code drawn from the mix,
+    or reset the connection without answering
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """
+        Serve a response shaped by the server configuration
+        """
+        standin = self.server.standin  # type: ignore
+        if random.random() < standin.error_rate:
+            # Zero linger turns the close into a reset
+            self.connection.setsockopt(
+                socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0)
+            )
+            self.close_connection = True
+            return
+        sleep(
+            max(0.0, standin.latency + random.uniform(-standin.jitter, standin.jitter))
+        )
+        code = random.choices(standin.codes, standin.weights)[0]
+        self.send_response(code)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(standin.body)))
+        self.send_header("Cache-Control", "max-age=0, private, must-revalidate")
+        self.send_header("Set-Cookie", f"session={random.getrandbits(64):x}; Path=/")
+        self.end_headers()
+        self.wfile.write(standin.body)
+
+    def log_message(self, *_args: object) -> None:
+        """
+        Keep request logging out of benchmark output
+        """
+
+
+class StandInHTTPServer(ThreadingHTTPServer):
+    """
+    Threaded server doing the TLS handshake, after the configured delay, on the
+    connection's own thread
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, standin: "StandInServer") -> None:
+        self.standin = standin
+        super().__init__((standin.listen_ip, standin.listen_port), StandInHandler)
+
+    def process_request_thread(self, request: socket.socket, client_address) -> None:
+        if self.standin.ssl_context is not None:
+            sleep(self.standin.tls_delay)
+            try:
+                request = self.standin.ssl_context.wrap_socket(
+                    request, server_side=True
+                )
+            except (ssl.SSLError, OSError):
+                self.shutdown_request(request)
+                return
+        super().process_request_thread(request, client_address)
+
+
+class StandInServer:
+    """
+    Configurable stand-in target, serves from a thread of the calling process or
+    from a process of its own
+    """
+
+    def __init__(self, standin_meta: dict) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.standin_meta = standin_meta
+        self.listen_ip = standin_meta.get("listen_ip", "127.0.0.1")
+        self.listen_port = standin_meta.get("listen_port", 0)
+        self.latency = standin_meta.get("latency_ms", 0) / 1000
+        self.jitter = standin_meta.get("jitter_ms", 0) / 1000
+        status_mix = parse_status_mix(standin_meta.get("status_mix", "200:1"))
+        self.codes = list(status_mix)
+        self.weights = list(status_mix.values())
+        self.error_rate = standin_meta.get("error_rate", 0.0)
+        self.body = b"x" * standin_meta.get("body_bytes", 1024)
+        self.tls_delay = standin_meta.get("tls_delay_ms", 0) / 1000
+        self.cert_path: Optional[str] = None
+        self.ssl_context: Optional[ssl.SSLContext] = None
+        if standin_meta.get("tls"):
+            self.cert_path, key_path = self.certificate()
+            self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.ssl_context.load_cert_chain(self.cert_path, key_path)
+        self.httpd: Optional[StandInHTTPServer] = None
+        self.process: Optional[multiprocessing.Process] = None
+
+    def certificate(self) -> Tuple[str, str]:
+        """
+        Certificate and key given in the configuration or a new self signed pair
+        """
+        if self.standin_meta.get("cert_path"):
+            return self.standin_meta["cert_path"], self.standin_meta["key_path"]
+        directory = tempfile.mkdtemp(prefix="standin-")
+        cert_path, key_path = self_signed(directory)
+        # Passed on to a serving process so both sides use the same certificate
+        self.standin_meta = {
+            **self.standin_meta,
+            "cert_path": cert_path,
+            "key_path": key_path,
+        }
+        return cert_path, key_path
+
+    @property
+    def url(self) -> str:
+        """
+        Base URL of the running server
+        """
+        scheme = "https" if self.ssl_context is not None else "http"
+        return f"{scheme}://{self.listen_ip}:{self.listen_port}"
+
+    def client_context(self) -> Optional[ssl.SSLContext]:
+        """
+        Client context trusting the stand-in certificate, None without TLS
+        """
+        if self.cert_path is None:
+            return None
+        return ssl.create_default_context(cafile=self.cert_path)
+
+    def bind(self) -> None:
+        """
+        Bind listening socket, picking a free port when none is configured
+        """
+        self.httpd = StandInHTTPServer(self)
+        self.listen_port = self.httpd.server_address[1]
+
+    def start(self) -> None:
+        """
+        Serve from a background thread
+        """
+        self.bind()
+        Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.logger.info("Stand-in serving on %s", self.url)
+
+    def start_process(self) -> None:
+        """
+        Serve from a separate process so the server does not compete with the code
+        under test for the interpreter lock
+        """
+        context = multiprocessing.get_context("spawn")
+        receiver, sender = context.Pipe(duplex=False)
+        self.process = context.Process(
+            target=serve_process,
+            args=(self.standin_meta, sender),
+            name="standin",
+            daemon=True,
+        )
+        self.process.start()
+        self.listen_port = receiver.recv()
+        self.logger.info("Stand-in serving on %s in pid %s", self.url, self.process.pid)
+
+    def stop(self) -> None:
+        """
+        Stop serving
+        """
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+
+
+def serve_process(standin_meta: dict, sender) -> None:
+    """
+    Serving process entry point, reports the bound port before serving
+    """
+    server = StandInServer(standin_meta)
+    server.bind()
+    sender.send(server.listen_port)
+    server.httpd.serve_forever()
+
+
+def standin_arguments() -> list:
+    """
+    Command line switches configuring the stand-in, shared with the benchmarks
+    """
+    return [
+        {
+            "switch": "--latency-ms",
+            "default": 0.0,
+            "help": "Milliseconds before each response, default: 0",
+            "type": float,
+        },
+        {
+            "switch": "--jitter-ms",
+            "default": 0.0,
+            "help": "Uniform +/- variation of the latency, default: 0",
+            "type": float,
+        },
+        {
+            "switch": "--status-mix",
+            "default": "200:1",
+            "help": "Response codes with relative weights, eg: 200:95,503:5, "
+            "default: 200:1",
+            "type": str,
+        },
+        {
+            "switch": "--error-rate",
+            "default": 0.0,
+            "help": "Fraction of requests answered with a connection reset, "
+            "default: 0",
+            "type": float,
+        },
+        {
+            "switch": "--body-bytes",
+            "default": 1024,
+            "help": "Response body size, default: 1024",
+            "type": int,
+        },
+        {
+            "switch": "--scheme",
+            "default": "http",
+            "help": "http, or https with a self signed certificate made with openssl, "
+            "default: http",
+            "type": str,
+        },
+        {
+            "switch": "--tls-delay-ms",
+            "default": 0.0,
+            "help": "Milliseconds before each TLS handshake, default: 0",
+            "type": float,
+        },
+    ]
+
+
+def parse_standin_meta(parsed_args) -> dict:
+    """
+    Stand-in configuration from parsed standin_arguments
+    """
+    return {
+        "latency_ms": parsed_args.latency_ms,
+        "jitter_ms": parsed_args.jitter_ms,
+        "status_mix": parsed_args.status_mix,
+        "error_rate": parsed_args.error_rate,
+        "body_bytes": parsed_args.body_bytes,
+        "tls": parsed_args.scheme == "https",
+        "tls_delay_ms": parsed_args.tls_delay_ms,
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s:%(name)s:%(levelname)s]: %(message)s",
+    )
+    app_metadata = {
+        "name": "standin",
+        "description": "Serve a configurable stand-in target for benchmarks.",
+    }
+    app_arguments = [
+        {
+            "switch": "--listen-port",
+            "default": 8080,
+            "help": "Port to listen on, default: 8080",
+            "type": int,
+        },
+    ] + standin_arguments()
+    args = ParseArgs(
+        app_metadata["name"], app_metadata["description"], app_arguments
+    ).args_parsed
+    server_meta = parse_standin_meta(args)
+    server_meta["listen_port"] = args.listen_port
+    stand_in = StandInServer(server_meta)
+    stand_in.bind()
+    logging.getLogger(__name__).info("Stand-in serving on %s", stand_in.url)
+    try:
+        stand_in.httpd.serve_forever()
+    except KeyboardInterrupt:
+        stand_in.httpd.server_close()
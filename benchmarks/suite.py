@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Run the benchmark suite offline with a preset and emit one JSON document, tagged
+with the version and commit, to compare between releases
+
+PYTHONPATH=src/hostpoller ./benchmarks/suite.py --preset quick --output bench.json
+"""
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+from importlib import metadata
+from typing import Callable, Dict, Optional
+
+from bench_dashboard import DashboardBenchmark
+from bench_ingest import IngestBenchmark
+from bench_poller import PollerBenchmark
+from parseargs import ParseArgs
+
+PRESETS = {
+    "quick": {
+        "poller": [
+            {"targets": 200, "duration": 10, "standin": {"latency_ms": 20}},
+            {
+                "targets": 50,
+                "duration": 10,
+                "connection_mode": "cold",
+                "standin": {"latency_ms": 20, "tls": True, "tls_delay_ms": 50},
+            },
+        ],
+        "ingest": {"rows": 100_000, "single_rows": 500},
+        "dashboard": {"rows": [10_000, 100_000], "repeat": 3},
+    },
+    "full": {
+        "poller": [
+            {"targets": 2000, "duration": 30, "standin": {"latency_ms": 50}},
+            {
+                "targets": 2000,
+                "duration": 30,
+                "standin": {
+                    "latency_ms": 50,
+                    "jitter_ms": 40,
+                    "status_mix": "200:90,404:5,503:5",
+                    "error_rate": 0.01,
+                },
+            },
+            {
+                "targets": 500,
+                "duration": 30,
+                "connection_mode": "cold",
+                "standin": {"latency_ms": 50, "tls": True, "tls_delay_ms": 200},
+            },
+        ],
+        "ingest": {"rows": 1_000_000, "single_rows": 2000},
+        "dashboard": {"rows": [10_000, 1_000_000, 10_000_000], "repeat": 5},
+    },
+}
+
+
+def build_info() -> Dict[str, Optional[str]]:
+    """
+    Version, commit and platform the results were measured on
+    """
+    try:
+        version: Optional[str] = metadata.version("hostpoller")
+    except metadata.PackageNotFoundError:
+        # Running from a checkout, take the version from the project file
+        version = None
+        pyproject = os.path.join(os.path.dirname(__file__), "..", "pyproject.toml")
+        with open(pyproject, encoding="utf-8") as project_file:
+            for line in project_file:
+                if line.startswith("version"):
+                    version = line.split("=", 1)[1].strip().strip('"')
+                    break
+    try:
+        commit: Optional[str] = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "version": version,
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": str(os.cpu_count()),
+        "started": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def run_poller(preset: dict) -> list:
+    """
+    Poller throughput for each stand-in configuration
+    """
+    return [
+        PollerBenchmark(
+            {
+                "polling_frequency": 1.0,
+                "polling_jitter": 0.0,
+                "connection_mode": "warm",
+                "max_concurrency": 256,
+                **poller_meta,
+            }
+        ).run()
+        for poller_meta in preset["poller"]
+    ]
+
+
+def run_ingest(preset: dict) -> list:
+    """
+    Ingestion rate for each sqlite engine
+    """
+    results = []
+    for engine_type in ("sqlite", "sqlite-wal"):
+        with tempfile.TemporaryDirectory() as bench_dir:
+            results.append(
+                IngestBenchmark(
+                    {
+                        "engine_type": engine_type,
+                        "db_path": os.path.join(bench_dir, "bench_ingest.db"),
+                        "hosts": 100,
+                        "batch_size": 500,
+                        "days": 7,
+                        **preset["ingest"],
+                    }
+                ).run()
+            )
+    return results
+
+
+def run_dashboard(preset: dict) -> list:
+    """
+    Dashboard render latency for each response_log size
+    """
+    results = []
+    for rows in preset["dashboard"]["rows"]:
+        with tempfile.TemporaryDirectory() as bench_dir:
+            results.append(
+                DashboardBenchmark(
+                    {
+                        "db_path": os.path.join(bench_dir, "bench_dashboard.db"),
+                        "rows": rows,
+                        "hosts": 100,
+                        "days": 7,
+                        "repeat": preset["dashboard"]["repeat"],
+                        "ranges": [0, 900, 3600, 86400, 604800],
+                        "overview_windows": [300, 3600, 21600],
+                    }
+                ).run()
+            )
+    return results
+
+
+BENCHMARKS: Dict[str, Callable[[dict], list]] = {
+    "poller": run_poller,
+    "ingest": run_ingest,
+    "dashboard": run_dashboard,
+}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s:%(name)s:%(levelname)s]: %(message)s",
+    )
+    app_metadata = {
+        "name": "suite",
+        "description": "Run the offline benchmark suite and emit JSON results.",
+    }
+    app_arguments = [
+        {
+            "switch": "--preset",
+            "default": "quick",
+            "help": f"Benchmark sizes, one of {', '.join(PRESETS)}, default: quick",
+            "type": str,
+        },
+        {
+            "switch": "--only",
+            "default": ",".join(BENCHMARKS),
+            "help": "Comma separated benchmarks to run, "
+            f"default: {','.join(BENCHMARKS)}",
+            "type": str,
+        },
+        {
+            "switch": "--output",
+            "default": "",
+            "help": "File to write results to, default: stdout",
+            "type": str,
+        },
+    ]
+    args = ParseArgs(
+        app_metadata["name"], app_metadata["description"], app_arguments
+    ).args_parsed
+
+    suite_results: Dict = {"build": build_info(), "preset": args.preset}
+    for name in args.only.split(","):
+        logging.getLogger(__name__).info("Running %s benchmark", name)
+        suite_results[name] = BENCHMARKS[name](PRESETS[args.preset])
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(suite_results, output, indent=2)
+    else:
+        print(json.dumps(suite_results, indent=2))
@@ -0,0 +1,208 @@
+"""
+Storage backends creating the writer and reader engines and bulk loading records
+"""
+import csv
+import io
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import Table, create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import QueuePool
+
+
+class SqliteBackend:
+    """
+    Single file database, sqlite uses the rollback journal while sqlite-wal uses write
+    ahead logging with a single writer connection alongside a pool of readers that
+    never block it
+    """
+
+    # Applied to every sqlite-wal connection, engine_meta["pragmas"] overrides these
+    wal_pragmas = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": "5000",
+        "cache_size": "-65536",
+        "mmap_size": "268435456",
+    }
+    # Persistent or write side pragmas a read only connection must not set
+    writer_only_pragmas = {"journal_mode", "synchronous", "wal_autocheckpoint"}
+
+    def __init__(self, engine_meta: dict) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.engine_type = engine_meta["type"]
+        self.sqlite_filepath = engine_meta["file_path"]
+        self.reader_pool_size = engine_meta.get("reader_pool_size", 8)
+        self.pragmas: Dict[str, str] = {}
+        if self.engine_type == "sqlite-wal":
+            self.pragmas.update(self.wal_pragmas)
+        self.pragmas.update(engine_meta.get("pragmas") or {})
+
+    def create_engines(self) -> Tuple[Engine, Engine]:
+        """
+        Return writer and read only reader engines for the database file
+        """
+        writer_pool = {}
+        if self.engine_type == "sqlite-wal":
+            # Writes are serialized on one connection instead of the file lock
+            writer_pool = {"poolclass": QueuePool, "pool_size": 1, "max_overflow": 0}
+        engine = create_engine(
+            f"sqlite:///{self.sqlite_filepath}",
+            connect_args={"check_same_thread": False},
+            **writer_pool,
+        )
+        # Readers open the file read only and never share a connection with writes
+        reader_engine = create_engine(
+            f"sqlite:///file:{self.sqlite_filepath}?mode=ro&uri=true",
+            connect_args={"check_same_thread": False},
+            poolclass=QueuePool,
+            pool_size=self.reader_pool_size,
+            max_overflow=self.reader_pool_size,
+        )
+        self.apply_pragmas(engine, self.pragmas)
+        self.apply_pragmas(
+            reader_engine,
+            {
+                name: value
+                for name, value in self.pragmas.items()
+                if name not in self.writer_only_pragmas
+            },
+        )
+        return engine, reader_engine
+
+    def apply_pragmas(self, engine: Engine, pragmas: Dict[str, str]) -> None:
+        """
+        Run given pragmas on every new connection the engine opens
+        """
+        if not pragmas:
+            return
+        self.logger.info("SQLite pragmas for %s: %s", engine.url, pragmas)
+
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, _connection_record) -> None:
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+
+    def partition_by(self, _column: str) -> Dict[str, str]:
+        """
+        Table options partitioning by given column, sqlite tables are not partitioned
+        """
+        return {}
+
+    def bulk_insert(self, engine: Engine, table: Table, records: List[dict]) -> None:
+        """
+        Insert records with executemany in a single transaction
+        """
+        with engine.begin() as connection:
+            connection.execute(table.insert(), records)
+
+
+class PostgresBackend:
+    """
+    Shared PostgreSQL store for many poller nodes, batches are loaded with COPY and
+    partitioned tables get a range partition per period created as rows arrive
+    """
+
+    def __init__(self, engine_meta: dict) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.url = engine_meta["file_path"]
+        self.reader_pool_size = engine_meta.get("reader_pool_size", 8)
+        self.partition_seconds = engine_meta.get("partition_seconds", 86400)
+        self.partitions: Set[str] = set()
+
+    def create_engines(self) -> Tuple[Engine, Engine]:
+        """
+        Return writer and reader engines, reader transactions are read only
+        """
+        try:
+            engine = create_engine(self.url, pool_pre_ping=True)
+            reader_engine = create_engine(
+                self.url,
+                pool_pre_ping=True,
+                pool_size=self.reader_pool_size,
+                max_overflow=self.reader_pool_size,
+                connect_args={"options": "-c default_transaction_read_only=on"},
+            )
+        except ImportError as err:
+            self.logger.error(
+                "PostgreSQL engine requires psycopg2, install the postgresql extra"
+            )
+            raise SystemExit from err
+        return engine, reader_engine
+
+    def partition_by(self, column: str) -> Dict[str, str]:
+        """
+        Table options range partitioning by given integer epoch column
+        """
+        return {"postgresql_partition_by": f"RANGE ({column})"}
+
+    def partition_column(self, table: Table) -> Optional[str]:
+        """
+        Return the range partition column of a table, None if it is not partitioned
+        """
+        partition_by = table.dialect_options["postgresql"].get("partition_by")
+        if not partition_by:
+            return None
+        return partition_by.split("(", 1)[1].rstrip(") ")
+
+    def ensure_partitions(
+        self, engine: Engine, table: Table, column: str, records: List[dict]
+    ) -> None:
+        """
+        Create any partitions missing for the periods covered by records
+        """
+        starts = {
+            record[column] - record[column] % self.partition_seconds
+            for record in records
+        }
+        for start in sorted(starts):
+            period = datetime.fromtimestamp(start, timezone.utc)
+            name = f"{table.name}_p{period:%Y%m%d%H%M}"
+            if name in self.partitions:
+                continue
+            try:
+                with engine.begin() as connection:
+                    connection.execute(
+                        text(
+                            f"CREATE TABLE IF NOT EXISTS {name} "
+                            f"PARTITION OF {table.name} FOR VALUES "
+                            f"FROM ({start}) TO ({start + self.partition_seconds})"
+                        )
+                    )
+            except DBAPIError as err:
+                # Another node created it between the existence check and the create
+                self.logger.warning("Creating partition %s failed: %s", name, err)
+                continue
+            self.logger.info("Partition %s ready", name)
+            self.partitions.add(name)
+
+    def bulk_insert(self, engine: Engine, table: Table, records: List[dict]) -> None:
+        """
+        Load records with COPY in a single transaction
+        """
+        column = self.partition_column(table)
+        if column is not None:
+            self.ensure_partitions(engine, table, column, records)
+
+        columns = [name for name in table.columns.keys() if name in records[0]]
+        buffer = io.StringIO()
+        # None is written as the \N marker so empty strings stay distinct from NULL
+        writer = csv.writer(buffer)
+        for record in records:
+            writer.writerow(
+                [r"\N" if record[name] is None else record[name] for name in columns]
+            )
+        buffer.seek(0)
+        with engine.begin() as connection:
+            cursor = connection.connection.cursor()
+            cursor.copy_expert(
+                f"COPY {table.name} ({', '.join(columns)}) FROM STDIN "
+                r"WITH (FORMAT csv, NULL '\N')",
+                buffer,
+            )
+            cursor.close()
@@ -0,0 +1,93 @@
+"""
+Per host circuit breaker so hosts that stop answering are polled less often
+"""
+import logging
+from time import monotonic
+from typing import Callable, Dict
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Closed polls normally and opens after a number of consecutive failed requests,
+    open skips polls until its backoff runs out, then half open lets a single probe
+    through which closes it on success or opens it again for twice as long
+
+    A failed request is one that got no response, eg: timeout or connection refused,
+    an HTTP error status means the host is still answering
+    """
+
+    def __init__(
+        self, breaker_meta: dict, clock: Callable[[], float] = monotonic
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.name = breaker_meta["name"]
+        self.clock = clock
+        self.threshold = breaker_meta["threshold"]
+        self.base_backoff = breaker_meta["base_backoff"]
+        self.max_backoff = breaker_meta["max_backoff"]
+        self.state = CLOSED
+        self.failures = 0
+        # Times opened since the last success, each doubles the backoff
+        self.opens = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.stats: Dict[str, int] = {"opened": 0, "closed": 0, "short_circuited": 0}
+
+    def allow(self) -> bool:
+        """
+        Whether a poll may make its request, half opening once the backoff is over
+        """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if self.clock() < self.open_until:
+                self.stats["short_circuited"] += 1
+                return False
+            self.state = HALF_OPEN
+            self.probing = False
+        # Other targets on the host wait for the probe to finish
+        if self.probing:
+            self.stats["short_circuited"] += 1
+            return False
+        self.probing = True
+        return True
+
+    def record(self, failed: bool) -> bool:
+        """
+        Count the outcome of a request and return whether the host changed between
+        answering and failing, eg: its first failure or its recovery
+        """
+        previous_state = self.state
+        previous_failures = self.failures
+        self.probing = False
+        if not failed:
+            self.failures = 0
+            self.opens = 0
+            self.state = CLOSED
+            if previous_state != CLOSED:
+                self.stats["closed"] += 1
+                self.logger.info("%s answering again, breaker closed", self.name)
+            return previous_failures > 0
+
+        self.failures += 1
+        if previous_state == HALF_OPEN or self.failures >= self.threshold:
+            if previous_state == OPEN:
+                # A request allowed before opening finished late, keep the backoff
+                return False
+            backoff = min(self.max_backoff, self.base_backoff * 2**self.opens)
+            if backoff < self.max_backoff:
+                self.opens += 1
+            self.state = OPEN
+            self.open_until = self.clock() + backoff
+            self.stats["opened"] += 1
+            self.logger.info(
+                "%s failed %s times, breaker open for %ss",
+                self.name,
+                self.failures,
+                backoff,
+            )
+        return previous_failures == 0
@@ -0,0 +1,95 @@
+"""
+Bounded in-process cache for dashboard query results and rendered figures
+"""
+import logging
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, List, Set, Tuple
+
+
+class TTLCache:
+    """
+    Least recently used cache whose entries also expire after a time to live, keys
+    are tuples led by the host they describe so a host's entries can be invalidated
+    """
+
+    def __init__(
+        self, cache_meta: dict, clock: Callable[[], float] = monotonic
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.max_entries = cache_meta["max_entries"]
+        self.ttl = cache_meta["ttl"]
+        self.clock = clock
+        self.lock = Lock()
+        self.entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self.host_keys: Dict[Hashable, Set[Tuple]] = {}
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "expirations": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+
+    def get_or_compute(self, key: Tuple, compute: Callable[[], Any]) -> Any:
+        """
+        Return cached value for key, computing and storing it on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > self.clock():
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[1]
+                self.stats["expirations"] += 1
+                self.discard(key)
+            self.stats["misses"] += 1
+
+        # Computed outside the lock, concurrent misses on one key may both compute
+        value = compute()
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end(key)
+            self.host_keys.setdefault(key[0], set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self.stats["evictions"] += 1
+                self.discard(next(iter(self.entries)))
+        return value
+
+    def discard(self, key: Tuple) -> None:
+        """
+        Drop entry, caller holds the lock
+        """
+        self.entries.pop(key, None)
+        keys = self.host_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.host_keys[key[0]]
+
+    def invalidate(self, host: Hashable) -> None:
+        """
+        Drop every entry for given host
+        """
+        with self.lock:
+            for key in list(self.host_keys.get(host, ())):
+                self.stats["invalidations"] += 1
+                self.discard(key)
+
+    def invalidate_batch(self, records: List[dict]) -> None:
+        """
+        Writer listener, drop entries for every host in a committed batch
+        """
+        for host in {record["host"] for record in records}:
+            self.invalidate(host)
+
+    def counters(self) -> Dict[str, int]:
+        """
+        Return hit, miss and eviction counters with the current entry count
+        """
+        with self.lock:
+            counters = dict(self.stats)
+            counters["entries"] = len(self.entries)
+        return counters
@@ -3,28 +3,83 @@ Module to wrap and manage flask instance
 """
 import json
 import logging
-from typing import Callable, Generator, List, Tuple
-
-import pandas
-from flask import Flask, redirect, render_template, request, url_for
-from plotly import graph_objects
-from plotly import utils as plotly_utils
-from plotly.subplots import make_subplots
-from sqlalchemy import distinct, func
+from datetime import datetime
+from queue import Empty
+from time import time
+from typing import TYPE_CHECKING, Callable, Generator, List, Optional, Tuple, Union
+
+from cache import TTLCache
+from flask import (
+    Flask,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    stream_with_context,
+    url_for,
+)
+from livefeed import LiveFeed
+from metrics import REGISTRY
+from retention import Retention
+from rollup import Rollup
+from slo import SloTracker
+from sqlalchemy import case, func, select
 from werkzeug import Response
 
+if TYPE_CHECKING:
+    # Loads numpy, only imported by the poller when recent samples are kept
+    from recent import RecentStore
+
+DASHBOARD_SECONDS = REGISTRY.histogram(
+    "hostpoller_dashboard_seconds", "Time to render a dashboard page"
+)
+
 
 class FlaskWrapper:
     """
     Wrapper for flask service
     """
 
+    # Longest ranges in seconds drawn from raw samples and from minute rollups
+    raw_range_limit = 900
+    minute_range_limit = 43200
+    # Request phases stacked in the latency phase chart, in request order
+    latency_phases = ("dns", "connect", "tls", "ttfb", "transfer")
+
+    # Windows offered by the fleet overview, read raw for every host at once, capped
+    # at 6h which is about 0.5s on sqlite at 10M rows while 24h took 2.6s
+    overview_windows = {300: "5m", 900: "15m", 3600: "1h", 21600: "6h"}
+    overview_percentiles = (50, 95, 99)
+
+    # Response code ranges, lower bound inclusive, grouped for display
+    status_buckets = {
+        "Invocation Error": (0, 100),
+        "1xx": (100, 200),
+        "2xx": (200, 300),
+        "3xx": (300, 400),
+        "4xx": (400, 500),
+        "5xx": (500, 600),
+    }
+
     def __init__(
         self,
         app_meta: dict,
         table: object,
+        rollup: Optional[Rollup] = None,
+        cache: Optional[TTLCache] = None,
+        retention: Optional[Retention] = None,
+        live_feed: Optional[LiveFeed] = None,
+        slo: Optional[SloTracker] = None,
+        recent: Optional["RecentStore"] = None,
     ) -> None:
         self.table = table
+        self.rollup = rollup
+        self.retention = retention
+        self.live_feed = live_feed
+        self.slo = slo
+        self.recent = recent
+        # Without a cache every lookup is a miss and nothing is retained
+        self.cache = cache or TTLCache({"max_entries": 0, "ttl": 0})
         self.logger = logging.getLogger(__name__)
         self.flask_app = Flask(
             app_meta["name"],
@@ -33,9 +88,14 @@ class FlaskWrapper:
             template_folder="templates",
         )
         self.flask_app.config["JSON_SORT_KEYS"] = False
+        self.flask_app.teardown_appcontext(self.remove_session)
         self.requests: dict = {}
         self.listen_ip = app_meta["listen_ip"]
         self.listen_port = app_meta["listen_port"]
+        self.serving_mode = app_meta.get("serving_mode", "development")
+        self.threads = app_meta.get("threads", 8)
+        # Every open stream holds a request thread of its own
+        self.stream_threads = live_feed.max_subscribers if live_feed else 0
         self.logger.info("Initializing FlaskWrapper")
         self.endpoints = []
 
@@ -51,9 +111,35 @@ class FlaskWrapper:
                 endpoint["handler"],
                 endpoint["methods"],
             )
-        self.flask_app.run(debug=False, host=self.listen_ip, port=self.listen_port)
+        if self.serving_mode == "production":
+            try:
+                from waitress import serve  # pylint: disable=import-outside-toplevel
+            except ImportError as err:
+                self.logger.error("Production serving mode requires waitress")
+                raise SystemExit from err
+            self.logger.info(
+                "Serving with waitress on %s threads and %s stream threads",
+                self.threads,
+                self.stream_threads,
+            )
+            serve(
+                self.flask_app,
+                host=self.listen_ip,
+                port=self.listen_port,
+                threads=self.threads + self.stream_threads,
+            )
+        else:
+            self.flask_app.run(
+                debug=False, host=self.listen_ip, port=self.listen_port, threaded=True
+            )
         self.logger.info(dir(self.flask_app))
 
+    def remove_session(self, _exception: Optional[BaseException]) -> None:
+        """
+        Return the request thread's database session to the reader pool
+        """
+        self.table.engine.reader_session.remove()
+
     def add_endpoint(
         self, name: str, path: str, handler: Callable, methods: list
     ) -> None:
@@ -75,55 +161,225 @@ class FlaskWrapper:
 
     def dashboard_endpoint(self) -> Tuple:
         """Dashboard endpoint"""
-        host_selection = request.args.get("host_selection")
-        return_code = 200
+        with DASHBOARD_SECONDS.time():
+            host_selection = request.args.get("host_selection")
+            window = request.args.get("window", default=0, type=int)
+            time_range = request.args.get("range", default=0, type=int)
+            return_code = 200
 
-        host_list = []
-        if self.table.engine.session.is_active:
-            table_hosts = self.table.engine.session.query(
-                distinct(self.table.response_log.c.host)
+            host_list = self.table.host_registry.names()
+
+            if not host_selection:
+
+                return (
+                    render_template(
+                        "host_selection.html",
+                        title="Target host selector",
+                        post_action="/dashboard",
+                        host_list=host_list,
+                        host_overview=self.table.host_registry.overview(),
+                    ),
+                    return_code,
+                )
+
+            subplots = self.cache.get_or_compute(
+                (host_selection, "dashboard", window, time_range),
+                lambda: self.render_subplots(host_selection, window, time_range),
             )
-            for host in table_hosts:
-                host_list.append(host[0])
 
-        if not host_selection:
+            # Live rows extend the latency chart unless it is drawn from rollups
+            if not time_range:
+                live_latency = "index"
+            elif time_range <= self.raw_range_limit or self.rollup is None:
+                live_latency = "time"
+            else:
+                live_latency = ""
 
             return (
                 render_template(
-                    "host_selection.html",
-                    title="Target host selector",
-                    post_action="/dashboard",
+                    "dashboard.html",
+                    host=host_selection,
+                    live_latency=live_latency,
+                    live_feed=self.live_feed is not None,
+                    slo=self.slo.report(host_selection) if self.slo else None,
                     host_list=host_list,
+                    window=window,
+                    time_range=time_range,
+                    status_buckets=list(self.status_buckets),
+                    post_action="/dashboard",
+                    subplots=subplots,
                 ),
                 return_code,
             )
 
+    def overview_endpoint(self) -> Tuple:
+        """
+        Sortable table of every host over a window, cells shaded by their value
+        """
+        with DASHBOARD_SECONDS.time():
+            window = request.args.get("window", default=3600, type=int)
+            if window not in self.overview_windows:
+                window = 3600
+            fleet = self.cached_fleet(window)
+            return (
+                render_template(
+                    "overview.html",
+                    title="Fleet overview",
+                    window=window,
+                    windows=self.overview_windows,
+                    status_buckets=list(self.status_buckets),
+                    percentiles=self.overview_percentiles,
+                    fleet=fleet,
+                ),
+                200,
+            )
+
+    def overview_api_endpoint(self) -> Tuple:
+        """
+        JSON summary of every host over a window, sorted descending on any column
+        """
+        window = request.args.get("window", default=3600, type=int)
+        sort = request.args.get("sort", default="error_rate")
+        if window not in self.overview_windows:
+            return jsonify({"error": f"unknown window: {window}"}), 400
+        fleet = self.cached_fleet(window)
+        if fleet and sort not in fleet[0]:
+            return jsonify({"error": f"unknown sort column: {sort}"}), 400
+        hosts = sorted(
+            fleet,
+            key=lambda host_meta: (host_meta[sort] is not None, host_meta[sort]),
+            reverse=True,
+        )
+        return jsonify({"window": window, "hosts": hosts}), 200
+
+    def cached_fleet(self, window: int) -> List[dict]:
+        """
+        Fleet summary for window, kept for the cache TTL as writes to any host would
+        otherwise invalidate it on every batch
+        """
+        return self.cache.get_or_compute(
+            (None, "overview", window), lambda: self.evaluate_fleet(window)
+        )
+
+    def metrics_endpoint(self) -> Response:
+        """
+        Metrics of the poller itself in the Prometheus text exposition format
+        """
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+    def slo_endpoint(self) -> Tuple:
+        """
+        JSON availability, burn rate and error budget per window for one host, or
+        every host when none is given
+        """
+        if self.slo is None:
+            return jsonify({"error": "SLO tracking is disabled"}), 404
+        return jsonify(self.slo.report(request.args.get("host"))), 200
+
+    def recent_endpoint(self) -> Tuple:
+        """
+        JSON arrays of the latest samples of a host read from its ring, oldest first
+        """
+        host_selection = request.args.get("host")
+        limit = request.args.get("limit", default=200, type=int)
+        if not host_selection:
+            return jsonify({"error": "host is required"}), 400
+        if limit < 1:
+            return jsonify({"error": "limit must be at least 1"}), 400
+        if self.recent is None:
+            return jsonify({"error": "recent samples are disabled"}), 404
+        samples = self.recent.latest(host_selection, limit)
+        if samples is None:
+            return jsonify({"error": f"no recent samples for {host_selection}"}), 404
+        return (
+            jsonify(
+                {
+                    "host": host_selection,
+                    "response_date": samples["response_date"].tolist(),
+                    "response_code": samples["response_code"].tolist(),
+                    "time_ms": (samples["time_elapsed"] // 1000).tolist(),
+                }
+            ),
+            200,
+        )
+
+    def hosts_endpoint(self) -> Tuple:
+        """
+        JSON list of observed hosts with first and last seen, last status and row count
+        """
+        return jsonify({"hosts": self.table.host_registry.overview()}), 200
+
+    def stream_endpoint(self) -> Union[Response, Tuple]:
+        """
+        Server-Sent Events stream of coalesced deltas for a host, comments keep idle
+        connections alive and let a closed client be noticed
+        """
+        host_selection = request.args.get("host")
+        if not host_selection:
+            return jsonify({"error": "host is required"}), 400
+        live_feed = self.live_feed
+        if live_feed is None:
+            return jsonify({"error": "live feed disabled"}), 404
+        subscriber = live_feed.subscribe(host_selection)
+        if subscriber is None:
+            return jsonify({"error": "too many streams"}), 503
+
+        def stream() -> Generator:
+            try:
+                yield "retry: 5000\n\n"
+                while True:
+                    try:
+                        message = subscriber.get(timeout=15)
+                    except Empty:
+                        yield ": keepalive\n\n"
+                        continue
+                    if message is None:
+                        return
+                    yield message
+            finally:
+                live_feed.unsubscribe(host_selection, subscriber)
+
+        return Response(
+            stream_with_context(stream()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    def render_subplots(self, host_selection: str, window: int, time_range: int) -> str:
+        """
+        Build dashboard figure for host and serialize it to JSON
+        """
+        # Plotting is loaded on the first dashboard request, not at startup
+        # pylint: disable=import-outside-toplevel
+        from plotly import graph_objects
+        from plotly import utils as plotly_utils
+        from plotly.subplots import make_subplots
+
         # Set layout for subplots
+        if time_range:
+            latency = self.evaluate_latency_series(host_selection, time_range)
+            latency_title = f"Response Times ({latency['resolution']})"
+        else:
+            latency_title = "Last 200 Response Times"
+        phases = self.evaluate_phase_series(host_selection, time_range)
         fig = make_subplots(
             rows=3,
             cols=1,
             subplot_titles=[
                 "Response Codes",
-                "Last 200 Response Times",
-                "Response Log",
+                latency_title,
+                f"Latency Phases ({phases['resolution']})",
             ],
-            specs=[[{"type": "xy"}], [{"type": "scatter"}], [{"type": "table"}]],
+            specs=[[{"type": "xy"}], [{"type": "scatter"}], [{"type": "scatter"}]],
         )
 
         # Add plot for response codes
-        host_meta = self.evaluate_host_status(host_selection)
+        host_meta = self.evaluate_host_status(host_selection, window)
         fig.add_trace(
             graph_objects.Bar(
                 name="count",
-                x=["Invocation Error", "1xx", "2xx", "3xx", "4xx", "5xx"],
-                y=[
-                    host_meta["return_status"]["Invocation Error"],
-                    host_meta["return_status"]["1xx"],
-                    host_meta["return_status"]["2xx"],
-                    host_meta["return_status"]["3xx"],
-                    host_meta["return_status"]["4xx"],
-                    host_meta["return_status"]["5xx"],
-                ],
+                x=list(host_meta["return_status"]),
+                y=list(host_meta["return_status"].values()),
             ),
             row=1,
             col=1,
@@ -133,119 +389,447 @@ class FlaskWrapper:
         fig.update_xaxes(title_text="Response Series", row=1, col=1)
 
         # Add plot for response timing
-        timing_ms = self.evaluate_response_times(host_selection)
-        fig.add_trace(graph_objects.Scatter(y=timing_ms, name="ms"), row=2, col=1)
-        fig.update_xaxes(title_text="Invocation Count", row=2, col=1)
+        if time_range:
+            for name, values in latency["series"].items():
+                fig.add_trace(
+                    graph_objects.Scatter(x=latency["time"], y=values, name=name),
+                    row=2,
+                    col=1,
+                )
+            fig.update_xaxes(title_text="Time", row=2, col=1)
+        else:
+            timing_ms = self.evaluate_response_times(host_selection)
+            fig.add_trace(graph_objects.Scatter(y=timing_ms, name="ms"), row=2, col=1)
+            fig.update_xaxes(title_text="Invocation Count", row=2, col=1)
         fig.update_yaxes(title_text="Time(ms)", row=2, col=1)
 
-        # Add plot for response logs
-        log_query = self.table.engine.session.query(
-            self.table.response_log.c.response_date,
-            self.table.response_log.c.host,
-            self.table.response_log.c.request_path,
-            self.table.response_log.c.response_code,
-            self.table.response_log.c.response_reason,
-        ).filter(self.table.response_log.c.host == host_selection)
-
-        df_table = pandas.read_sql_query(
-            log_query.statement, self.table.engine.session.bind
-        )
-        fig.add_trace(
-            graph_objects.Table(
-                header=dict(
-                    values=[
-                        "Date",
-                        "Hostname",
-                        "Request Path",
-                        "Response Code",
-                        "Response Reason",
-                    ],
-                    font=dict(size=10),
-                    align="left",
-                ),
-                cells=dict(
-                    values=[df_table[k].tolist() for k in df_table.columns],
-                    align="left",
+        # Add stacked plot of where the time of each response went
+        for phase, values in phases["series"].items():
+            fig.add_trace(
+                graph_objects.Scatter(
+                    x=phases["time"],
+                    y=values,
+                    name=phase,
+                    stackgroup="phases",
+                    mode="lines",
                 ),
-            ),
-            row=3,
-            col=1,
-        )
+                row=3,
+                col=1,
+            )
+        if time_range:
+            fig.update_xaxes(title_text="Time", row=3, col=1)
+        else:
+            fig.update_xaxes(title_text="Invocation Count", row=3, col=1)
+        fig.update_yaxes(title_text="Time(ms)", row=3, col=1)
 
         # Update subplot layout
-        fig.update_layout(height=800, showlegend=False, hovermode="x")
+        fig.update_layout(height=900, showlegend=False, hovermode="x")
+
+        return json.dumps(fig, cls=plotly_utils.PlotlyJSONEncoder)
+
+    def response_log_endpoint(self) -> Tuple:
+        """
+        JSON page of the response log for a host, newest first, keyset paginated on
+        id so each page costs the same no matter how deep it is
+        """
+        host_selection = request.args.get("host")
+        before_id = request.args.get("before", type=int)
+        limit = min(request.args.get("limit", default=50, type=int), 500)
+        bucket = request.args.get("bucket")
+        since = request.args.get("since", type=int)
+        until = request.args.get("until", type=int)
+        if not host_selection:
+            return jsonify({"error": "host is required"}), 400
+        if limit < 1:
+            return jsonify({"error": "limit must be at least 1"}), 400
+        if bucket and bucket not in self.status_buckets:
+            return jsonify({"error": f"unknown bucket: {bucket}"}), 400
+
+        response_log = self.table.response_log
+        log_query = self.table.engine.reader_session.query(
+            response_log.c.id,
+            response_log.c.response_date,
+            response_log.c.request_path,
+            response_log.c.response_code,
+            response_log.c.response_reason,
+            response_log.c.time_elapsed,
+            response_log.c.breaker_state,
+        ).filter(response_log.c.host == host_selection)
+        if before_id is not None:
+            log_query = log_query.filter(response_log.c.id < before_id)
+        if bucket:
+            bucket_start, bucket_end = self.status_buckets[bucket]
+            log_query = log_query.filter(
+                response_log.c.response_code >= bucket_start,
+                response_log.c.response_code < bucket_end,
+            )
+        if since is not None:
+            log_query = log_query.filter(response_log.c.response_date >= since)
+        if until is not None:
+            log_query = log_query.filter(response_log.c.response_date < until)
+
+        log_rows = [
+            row._asdict()
+            for row in log_query.order_by(response_log.c.id.desc()).limit(limit)
+        ]
+        if len(log_rows) < limit and self.retention and self.retention.archive:
+            # Older pages continue into the archive, whose ids all precede live ones
+            archive_before = log_rows[-1]["id"] if log_rows else before_id
+            archive_filters = []
+            if archive_before is not None:
+                archive_filters.append(("id", "<", archive_before))
+            if bucket:
+                archive_filters.append(("response_code", ">=", bucket_start))
+                archive_filters.append(("response_code", "<", bucket_end))
+            if since is not None:
+                archive_filters.append(("response_date", ">=", since))
+            if until is not None:
+                archive_filters.append(("response_date", "<", until))
+            log_rows += self.retention.archive.page(
+                host_selection, limit - len(log_rows), archive_filters, since, until
+            )
+
+        rows = [
+            {
+                "id": int(row["id"]),
+                "response_date": datetime.utcfromtimestamp(
+                    row["response_date"]
+                ).isoformat(),
+                "request_path": row["request_path"],
+                "response_code": int(row["response_code"]),
+                "response_reason": row["response_reason"],
+                "time_ms": int(row["time_elapsed"]) // 1000,
+                # NULL in fixed polling mode and for rows archived before it was kept
+                "breaker_state": row.get("breaker_state"),
+            }
+            for row in log_rows
+        ]
+        next_cursor = rows[-1]["id"] if len(rows) == limit else None
+        return (
+            jsonify({"host": host_selection, "rows": rows, "next": next_cursor}),
+            200,
+        )
 
-        subplots = json.dumps(fig, cls=plotly_utils.PlotlyJSONEncoder)
+    def response_headers_endpoint(self) -> Tuple:
+        """
+        JSON headers and cookies of a single response reassembled from the header
+        store, host is needed to find rows that have been archived
+        """
+        row_id = request.args.get("id", type=int)
+        host_selection = request.args.get("host")
+        if row_id is None:
+            return jsonify({"error": "id is required"}), 400
+
+        response_log = self.table.response_log
+        row = (
+            self.table.engine.reader_session.query(
+                response_log.c.id,
+                response_log.c.host,
+                response_log.c.response_headers,
+                response_log.c.response_cookies,
+            )
+            .filter(response_log.c.id == row_id)
+            .one_or_none()
+        )
+        log_row = row._asdict() if row is not None else None
+        if log_row is None and host_selection and self.retention:
+            archive = self.retention.archive
+            archived = (
+                archive.page(host_selection, 1, [("id", "==", row_id)])
+                if archive
+                else []
+            )
+            log_row = archived[0] if archived else None
+        if log_row is None:
+            return jsonify({"error": f"unknown response: {row_id}"}), 404
 
+        header_sets = self.table.header_store.lookup(
+            [log_row["response_headers"], log_row["response_cookies"]]
+        )
         return (
-            render_template(
-                "dashboard.html",
-                host=host_selection,
-                host_list=host_list,
-                post_action="/dashboard",
-                subplots=subplots,
+            jsonify(
+                {
+                    "id": row_id,
+                    "host": log_row["host"],
+                    "headers": header_sets.get(log_row["response_headers"]),
+                    "cookies": header_sets.get(log_row["response_cookies"]),
+                }
             ),
-            return_code,
+            200,
         )
 
-    def evaluate_host_status(self, host_selection) -> dict:
+    def evaluate_host_status(self, host_selection: str, window: int = 0) -> dict:
         """
-        Collect response values for given host selection
+        Collect response values for given host selection over the last window seconds,
+        all history when window is 0, bucketed in a single grouped query
         """
-        host_meta = {}
-        host_meta["name"] = host_selection
-        host_meta["return_status"] = {
-            "Invocation Error": 0,
-            "1xx": 0,
-            "2xx": 0,
-            "3xx": 0,
-            "4xx": 0,
-            "5xx": 0,
-        }
-        for result in self.table.engine.session.query(
-            distinct(self.table.response_log.c.response_code)
-        ).filter(self.table.response_log.c.host == host_selection):
-            status_count = self.table.engine.session.query(
-                func.count(self.table.response_log.c.response_code)
-            ).filter(
-                self.table.response_log.c.host == host_selection,
-                self.table.response_log.c.response_code == result[0],
-            )
-            for count in status_count:
-                return_code = result[0]
-                if return_code < 100:
-                    host_meta["return_status"]["Invocation Error"] = count[0]
-                elif 100 <= return_code < 200:
-                    host_meta["return_status"]["1xx"] = count[0]
-                elif 200 <= return_code < 300:
-                    host_meta["return_status"]["2xx"] = count[0]
-                elif 300 <= return_code < 400:
-                    host_meta["return_status"]["3xx"] = count[0]
-                elif 400 <= return_code < 500:
-                    host_meta["return_status"]["4xx"] = count[0]
-                elif 500 <= return_code < 600:
-                    host_meta["return_status"]["5xx"] = count[0]
-                else:
-                    self.logger.error("Unhandled status: %s", result[0])
+        return_status = dict.fromkeys(self.status_buckets, 0)
+        host_meta = {"name": host_selection, "return_status": return_status}
+        response_code = self.table.response_log.c.response_code
+        status_bucket = case(
+            *(
+                (response_code < bucket_end, bucket)
+                for bucket, (_, bucket_end) in self.status_buckets.items()
+            ),
+            else_="Unhandled",
+        ).label("status_bucket")
+        status_query = self.table.engine.reader_session.query(
+            status_bucket, func.count()
+        ).filter(self.table.response_log.c.host == host_selection)
+        if window:
+            status_query = status_query.filter(
+                self.table.response_log.c.response_date >= int(time()) - window
+            )
+
+        status_counts = list(status_query.group_by(status_bucket))
+        if self.retention is not None:
+            # Expired rows are only kept as hourly counts per response code
+            status_counts += [
+                (self.status_bucket(response_code), count)
+                for response_code, count in self.retention.status_counts(
+                    host_selection, int(time()) - window if window else 0
+                )
+            ]
+        for bucket, count in status_counts:
+            if bucket in return_status:
+                return_status[bucket] += count
+            else:
+                self.logger.error("Unhandled status for %s responses", count)
         return host_meta
 
+    def evaluate_fleet(self, window: int) -> List[dict]:
+        """
+        Status bucket counts, error rate and latency percentiles of every host over
+        the last window seconds, read in a single query over the date index and
+        summarized with array operations instead of a query per host
+        """
+        # pylint: disable=import-outside-toplevel
+        import numpy
+        import pandas
+
+        response_log = self.table.response_log
+        fleet_query = select(
+            response_log.c.host,
+            response_log.c.response_code,
+            response_log.c.time_elapsed,
+        ).where(response_log.c.response_date >= int(time()) - window)
+        result = self.table.engine.reader_session.connection().execute(fleet_query)
+        # Driver tuples as is, building a result row each costs more than the summary
+        rows = result.cursor.fetchall()
+        result.close()
+        if not rows:
+            return []
+        # One structured array converts the tuples faster than a column at a time
+        columns = numpy.array(
+            rows,
+            dtype=[
+                ("host", object),
+                ("response_code", numpy.int64),
+                ("time_elapsed", numpy.int64),
+            ],
+        )
+        del rows
+        host_index, host_names = pandas.factorize(columns["host"])
+        response_codes = columns["response_code"]
+        times_ms = columns["time_elapsed"] / 1000
+        host_count = len(host_names)
+
+        # Codes fall in the first bucket whose end is above them, past the last
+        # bucket end they are unhandled and only counted in the request total
+        bucket_ends = [bucket_end for _, bucket_end in self.status_buckets.values()]
+        bucket_index = numpy.searchsorted(bucket_ends, response_codes, side="right")
+        bucket_counts = numpy.bincount(
+            host_index * (len(bucket_ends) + 1) + bucket_index,
+            minlength=host_count * (len(bucket_ends) + 1),
+        ).reshape(host_count, len(bucket_ends) + 1)
+        requests = bucket_counts.sum(axis=1)
+        # Errors as the SLO counts them, no response or a server error
+        good = (response_codes >= SloTracker.good_codes[0]) & (
+            response_codes < SloTracker.good_codes[1]
+        )
+        error_rate = 1 - numpy.bincount(host_index, good, host_count) / requests
+
+        # Nearest rank percentiles of answered requests, sorted by host then time
+        # so each host's latencies are a contiguous run, hosts without an answer
+        # point at a trailing NaN
+        answered = response_codes >= 100
+        answered_hosts = host_index[answered]
+        answered_ms = times_ms[answered]
+        sorted_ms = numpy.append(
+            answered_ms[numpy.lexsort((answered_ms, answered_hosts))], numpy.nan
+        )
+        answered_counts = numpy.bincount(answered_hosts, minlength=host_count)
+        run_starts = numpy.cumsum(answered_counts) - answered_counts
+        latency = {}
+        for percentile in self.overview_percentiles:
+            ranks = numpy.ceil(answered_counts * percentile / 100).astype(numpy.int64)
+            latency[f"p{percentile}_ms"] = numpy.where(
+                answered_counts > 0,
+                sorted_ms[run_starts + numpy.maximum(ranks - 1, 0)],
+                numpy.nan,
+            )
+
+        fleet = []
+        for index, host in enumerate(host_names):
+            host_meta = {
+                "host": host,
+                "requests": int(requests[index]),
+                "error_rate": round(float(error_rate[index]), 4),
+            }
+            for bucket_number, bucket in enumerate(self.status_buckets):
+                host_meta[bucket] = int(bucket_counts[index, bucket_number])
+            for name, values in latency.items():
+                host_meta[name] = (
+                    None
+                    if numpy.isnan(values[index])
+                    else round(float(values[index]), 1)
+                )
+            fleet.append(host_meta)
+        return fleet
+
+    @classmethod
+    def status_bucket(cls, response_code: int) -> str:
+        """
+        Name of the display bucket holding given response code
+        """
+        for bucket, (_, bucket_end) in cls.status_buckets.items():
+            if response_code < bucket_end:
+                return bucket
+        return "Unhandled"
+
     def evaluate_response_times(self, host_selection: str) -> List:
         """
-        Evaluate response times for given host selection
+        Evaluate the last 200 response times for given host selection, oldest first,
+        from the host's ring of recent samples when one is kept
         """
-        timing_ms = []
+        if self.recent is not None:
+            samples = self.recent.latest(host_selection, 200)
+            if samples is not None:
+                return (samples["time_elapsed"] / 1000).tolist()
+
+        import pandas  # pylint: disable=import-outside-toplevel
+
         timing_query = (
-            self.table.engine.session.query(self.table.response_log.c.time_elapsed)
+            self.table.engine.reader_session.query(
+                (self.table.response_log.c.time_elapsed / 1000).label("time_ms")
+            )
             .filter(self.table.response_log.c.host == host_selection)
+            .order_by(self.table.response_log.c.id.desc())
             .limit(200)
         )
 
         df_timing = pandas.read_sql_query(
-            timing_query.statement, self.table.engine.session.bind
+            timing_query.statement, self.table.engine.reader_session.connection()
+        )
+        return df_timing["time_ms"].tolist()[::-1]
+
+    def evaluate_phase_series(self, host_selection: str, time_range: int) -> dict:
+        """
+        Evaluate mean milliseconds per request phase, each of the last 200 responses
+        when no time_range is given, otherwise averaged into at most 200 buckets
+        """
+        import pandas  # pylint: disable=import-outside-toplevel
+
+        response_log = self.table.response_log
+        phase_columns = [
+            (response_log.c[f"time_{phase}"] / 1000).label(phase)
+            for phase in self.latency_phases
+        ]
+        filters = [
+            response_log.c.host == host_selection,
+            response_log.c.response_code >= 100,
+            response_log.c.time_ttfb.isnot(None),
+        ]
+        reader_session = self.table.engine.reader_session
+        if not time_range:
+            phase_query = (
+                reader_session.query(*phase_columns)
+                .filter(*filters)
+                .order_by(response_log.c.id.desc())
+                .limit(200)
+            )
+            df_phases = pandas.read_sql_query(
+                phase_query.statement, reader_session.connection()
+            )[::-1]
+            return {
+                "resolution": "last 200",
+                "time": None,
+                "series": {
+                    phase: df_phases[phase].tolist() for phase in self.latency_phases
+                },
+            }
+
+        bucket_seconds = max(1, time_range // 200)
+        bucket_start = (
+            response_log.c.response_date - response_log.c.response_date % bucket_seconds
+        ).label("bucket_start")
+        phase_query = (
+            reader_session.query(
+                bucket_start,
+                *(
+                    (func.avg(response_log.c[f"time_{phase}"]) / 1000).label(phase)
+                    for phase in self.latency_phases
+                ),
+            )
+            .filter(*filters, response_log.c.response_date >= int(time()) - time_range)
+            .group_by(bucket_start)
+            .order_by(bucket_start)
+        )
+        df_phases = pandas.read_sql_query(
+            phase_query.statement, reader_session.connection()
         )
-        timing = [df_timing[key].tolist() for key in df_timing.columns]
+        return {
+            "resolution": f"{bucket_seconds}s mean",
+            "time": pandas.to_datetime(df_phases["bucket_start"], unit="s"),
+            "series": {
+                phase: df_phases[phase].tolist() for phase in self.latency_phases
+            },
+        }
+
+    def evaluate_latency_series(self, host_selection: str, time_range: int) -> dict:
+        """
+        Evaluate latency over the last time_range seconds, raw samples for short
+        ranges and minute or hour rollups beyond that to keep the point count low
+        """
+        import pandas  # pylint: disable=import-outside-toplevel
 
-        for time in timing[0]:
-            timing_ms.append(int(int(time) / 1000))
+        since = int(time()) - time_range
+        if time_range <= self.raw_range_limit or self.rollup is None:
+            response_log = self.table.response_log
+            timing_query = (
+                self.table.engine.reader_session.query(
+                    response_log.c.response_date,
+                    (response_log.c.time_elapsed / 1000).label("time_ms"),
+                )
+                .filter(
+                    response_log.c.host == host_selection,
+                    response_log.c.response_date >= since,
+                    response_log.c.response_code >= 100,
+                )
+                .order_by(response_log.c.response_date)
+            )
+            df_timing = pandas.read_sql_query(
+                timing_query.statement, self.table.engine.reader_session.connection()
+            )
+            return {
+                "resolution": "raw",
+                "time": pandas.to_datetime(df_timing["response_date"], unit="s"),
+                "series": {"ms": df_timing["time_ms"].tolist()},
+            }
 
-        return timing_ms
+        if time_range <= self.minute_range_limit:
+            resolution = "minute"
+        else:
+            resolution = "hour"
+        df_rollup = pandas.DataFrame(
+            self.rollup.series(host_selection, resolution, since),
+            columns=["bucket_start", "mean_us", "p50_us", "p95_us", "p99_us"],
+        )
+        return {
+            "resolution": resolution,
+            "time": pandas.to_datetime(df_rollup["bucket_start"], unit="s"),
+            "series": {
+                name: (df_rollup[f"{name}_us"] / 1000).tolist()
+                for name in ("mean", "p50", "p95", "p99")
+            },
+        }
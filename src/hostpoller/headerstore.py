@@ -0,0 +1,229 @@
+"""
+Content addressed store of response header and cookie sets referenced from the
+response log
+"""
+import ast
+import hashlib
+import json
+import logging
+import re
+from collections import OrderedDict
+from http.cookies import CookieError, SimpleCookie
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import Column, String, Table, select
+from squeal import Squeal
+
+
+class HeaderStore:
+    """
+    Normalize header and cookie sets, strip the fields that change on every response
+    and store each distinct set once in header_sets keyed by its digest
+
+    Headers are kept as [name, value] pairs with lower case names sorted by name,
+    cookies as one dict of attributes per cookie sorted by name, without value and
+    expiry which are usually unique per response
+    """
+
+    volatile_headers = {
+        "date",
+        "expires",
+        "age",
+        "set-cookie",
+        "x-request-id",
+        "x-amzn-requestid",
+        "x-amz-request-id",
+        "x-amz-id-2",
+        "x-amz-cf-id",
+        "cf-ray",
+        "x-runtime",
+        "x-timer",
+        "x-served-by",
+        "server-timing",
+        "x-github-request-id",
+    }
+    cookie_fields = ("path", "domain", "max-age", "secure", "httponly", "samesite")
+
+    def __init__(self, squeal: Squeal, cache_entries: int = 4096) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.squeal = squeal
+        self.header_sets = Table(
+            "header_sets",
+            self.squeal.meta_data,
+            Column("digest", String, primary_key=True),
+            Column("kind", String),
+            Column("content", String),
+            extend_existing=True,
+        )
+        self.cache_entries = cache_entries
+        self.lock = Lock()
+        self.known: "OrderedDict[str, str]" = OrderedDict()
+        self.stats = {"sets_stored": 0, "refs_encoded": 0}
+
+    @classmethod
+    def normalize(cls, kind: str, value: Any) -> Optional[str]:
+        """
+        Canonical JSON for header pairs or cookie dicts, None when there is no value
+        """
+        if value is None:
+            return None
+        if isinstance(value, str):
+            # Kept verbatim when a legacy value could not be parsed
+            return json.dumps(value)
+        if kind == "headers":
+            pairs = sorted(
+                [str(name).lower(), str(header_value)]
+                for name, header_value in value
+                if str(name).lower() not in cls.volatile_headers
+            )
+            return json.dumps(pairs, separators=(",", ":"))
+        cookies = sorted(
+            [
+                {
+                    "name": cookie["name"],
+                    **{
+                        field: cookie[field]
+                        for field in cls.cookie_fields
+                        if cookie.get(field)
+                    },
+                }
+                for cookie in value
+            ],
+            key=lambda cookie: cookie["name"],
+        )
+        return json.dumps(cookies, separators=(",", ":"), sort_keys=True)
+
+    @staticmethod
+    def digest(kind: str, content: str) -> str:
+        """
+        Reference stored in the response log for normalized content
+        """
+        return hashlib.blake2b(
+            f"{kind}\0{content}".encode("utf-8"), digest_size=8
+        ).hexdigest()
+
+    @staticmethod
+    def cookie_list(cookies: SimpleCookie) -> List[Dict[str, Any]]:
+        """
+        Plain attribute dicts for each cookie of a parsed cookie jar
+        """
+        return [
+            {"name": name, **{field: value for field, value in morsel.items() if value}}
+            for name, morsel in cookies.items()
+        ]
+
+    @classmethod
+    def parse_legacy(cls, kind: str, legacy: Optional[str]) -> Any:
+        """
+        Parse a header or cookie set stored as the str() of a python object, covers
+        dict and CIMultiDictProxy headers and RequestsCookieJar and SimpleCookie
+        cookies, returns the text itself when it cannot be parsed
+        """
+        if legacy is None or legacy in ("", "None"):
+            return None
+        try:
+            if kind == "headers":
+                literals = [
+                    ast.literal_eval(literal)
+                    for literal in re.findall(
+                        r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"", legacy
+                    )
+                ]
+                if len(literals) % 2 or (
+                    not literals and legacy not in ("{}", "<CIMultiDictProxy()>")
+                ):
+                    return legacy
+                return list(zip(literals[::2], literals[1::2]))
+            if legacy.startswith("<RequestsCookieJar"):
+                return [
+                    {"name": name, "domain": domain, "path": path}
+                    for name, domain, path in re.findall(
+                        r"<Cookie ([^=\s]+)=.*? for ([^/\s]*)(/[^>\s]*)/?>", legacy
+                    )
+                ]
+            cookies: SimpleCookie = SimpleCookie()
+            for line in legacy.splitlines():
+                cookies.load(line.replace("Set-Cookie:", "", 1).strip())
+            return cls.cookie_list(cookies)
+        except (ValueError, SyntaxError, CookieError):
+            return legacy
+
+    def remember(self, digest: str, content: str) -> None:
+        """
+        Add set to the in memory cache, caller holds the lock
+        """
+        self.known[digest] = content
+        self.known.move_to_end(digest)
+        while len(self.known) > self.cache_entries:
+            self.known.popitem(last=False)
+
+    def prepare(self, records: List[dict]) -> None:
+        """
+        Writer preparer, replace header and cookie sets in records with references
+        and store unseen sets before the batch is written
+        """
+        new_sets: Dict[str, dict] = {}
+        with self.lock:
+            for record in records:
+                for kind, column in (
+                    ("headers", "response_headers"),
+                    ("cookies", "response_cookies"),
+                ):
+                    content = self.normalize(kind, record[column])
+                    if content is None:
+                        record[column] = None
+                        continue
+                    digest = self.digest(kind, content)
+                    record[column] = digest
+                    if digest in self.known:
+                        self.known.move_to_end(digest)
+                    else:
+                        new_sets[digest] = {
+                            "digest": digest,
+                            "kind": kind,
+                            "content": content,
+                        }
+            self.stats["refs_encoded"] += len(records)
+
+        if not new_sets:
+            return
+        statement = self.squeal.upsert(self.header_sets).on_conflict_do_nothing(
+            index_elements=["digest"]
+        )
+        with self.squeal.engine.begin() as connection:
+            connection.execute(statement, list(new_sets.values()))
+        with self.lock:
+            for digest, header_set in new_sets.items():
+                self.remember(digest, header_set["content"])
+            self.stats["sets_stored"] += len(new_sets)
+        self.logger.debug("Stored %s new header sets", len(new_sets))
+
+    def lookup(self, digests: Iterable[Optional[str]]) -> Dict[str, Any]:
+        """
+        Reassemble header and cookie sets for given references
+        """
+        contents: Dict[str, str] = {}
+        missing = []
+        with self.lock:
+            for digest in set(digests):
+                if digest is None:
+                    continue
+                if digest in self.known:
+                    contents[digest] = self.known[digest]
+                else:
+                    missing.append(digest)
+        if missing:
+            stored = self.header_sets.c
+            with self.squeal.reader_engine.connect() as connection:
+                for row in connection.execute(
+                    select(stored.digest, stored.content).where(
+                        stored.digest.in_(missing)
+                    )
+                ):
+                    contents[row.digest] = row.content
+            with self.lock:
+                for digest in missing:
+                    if digest in contents:
+                        self.remember(digest, contents[digest])
+        return {digest: json.loads(content) for digest, content in contents.items()}
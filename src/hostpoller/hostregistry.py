@@ -0,0 +1,121 @@
+"""
+Registry of observed hosts kept in memory and in the hosts table
+"""
+import logging
+from threading import Lock
+from typing import Dict, List
+
+from sqlalchemy import Column, Integer, String, Table, case, select
+from squeal import Squeal
+
+
+class HostRegistry:
+    """
+    Track first and last seen, last status and row count per host as batches are
+    written, so listing hosts never scans the response log
+    """
+
+    def __init__(self, squeal: Squeal) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.squeal = squeal
+        self.hosts_table = Table(
+            "hosts",
+            self.squeal.meta_data,
+            Column("host", String, primary_key=True),
+            Column("first_seen", Integer),
+            Column("last_seen", Integer),
+            Column("last_status", Integer),
+            Column("row_count", Integer),
+            extend_existing=True,
+        )
+        self.lock = Lock()
+        self.hosts: Dict[str, dict] = {}
+
+    def load(self) -> None:
+        """
+        Seed registry from the hosts table
+        """
+        with self.squeal.engine.connect() as connection:
+            rows = [
+                row._asdict() for row in connection.execute(select(self.hosts_table))
+            ]
+        with self.lock:
+            self.hosts = {row["host"]: row for row in rows}
+        self.logger.info("Loaded %s hosts", len(rows))
+
+    def add(self, records: List[dict]) -> None:
+        """
+        Writer listener, fold a committed batch into the registry and hosts table
+        """
+        batch_hosts: Dict[str, dict] = {}
+        for record in records:
+            host_meta = batch_hosts.get(record["host"])
+            if host_meta is None:
+                batch_hosts[record["host"]] = {
+                    "host": record["host"],
+                    "first_seen": record["response_date"],
+                    "last_seen": record["response_date"],
+                    "last_status": record["response_code"],
+                    "row_count": 1,
+                }
+                continue
+            host_meta["first_seen"] = min(
+                host_meta["first_seen"], record["response_date"]
+            )
+            if record["response_date"] >= host_meta["last_seen"]:
+                host_meta["last_seen"] = record["response_date"]
+                host_meta["last_status"] = record["response_code"]
+            host_meta["row_count"] += 1
+
+        statement = self.squeal.upsert(self.hosts_table)
+        stored = self.hosts_table.c
+        statement = statement.on_conflict_do_update(
+            index_elements=["host"],
+            set_={
+                "first_seen": self.squeal.least(
+                    stored.first_seen, statement.excluded.first_seen
+                ),
+                "last_seen": self.squeal.greatest(
+                    stored.last_seen, statement.excluded.last_seen
+                ),
+                # Batches from other nodes or retried late may be older than
+                # what is stored, their status is not the latest
+                "last_status": case(
+                    (
+                        statement.excluded.last_seen >= stored.last_seen,
+                        statement.excluded.last_status,
+                    ),
+                    else_=stored.last_status,
+                ),
+                "row_count": stored.row_count + statement.excluded.row_count,
+            },
+        )
+        with self.squeal.engine.begin() as connection:
+            connection.execute(statement, list(batch_hosts.values()))
+
+        with self.lock:
+            for host, host_meta in batch_hosts.items():
+                known = self.hosts.get(host)
+                if known is None:
+                    self.logger.info("New host observed: %s", host)
+                    self.hosts[host] = host_meta
+                    continue
+                known["first_seen"] = min(known["first_seen"], host_meta["first_seen"])
+                if host_meta["last_seen"] >= known["last_seen"]:
+                    known["last_seen"] = host_meta["last_seen"]
+                    known["last_status"] = host_meta["last_status"]
+                known["row_count"] += host_meta["row_count"]
+
+    def names(self) -> List[str]:
+        """
+        Return sorted host names
+        """
+        with self.lock:
+            return sorted(self.hosts)
+
+    def overview(self) -> List[dict]:
+        """
+        Return metadata for every host sorted by name
+        """
+        with self.lock:
+            return [dict(self.hosts[host]) for host in sorted(self.hosts)]
@@ -0,0 +1,184 @@
+"""
+Live feed of written responses for open dashboards, served as Server-Sent Events
+"""
+import json
+import logging
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, Optional, Set
+
+from probe import PhaseTimer
+
+
+class LiveFeed:
+    """
+    Coalesce committed records into one delta per host every interval, serialize it
+    once and fan it out to every subscriber of that host
+
+    A delta carries the new rows for the response log and latency chart and the
+    increments to the status histogram, subscribers that fall behind are closed and
+    reload on reconnect
+    """
+
+    def __init__(self, feed_meta: dict, classify: Callable[[int], str]) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.interval = feed_meta["interval"]
+        self.max_subscribers = feed_meta["max_subscribers"]
+        self.queue_size = feed_meta.get("queue_size", 64)
+        self.classify = classify
+        self.lock = Lock()
+        self.pending: Dict[str, List[dict]] = {}
+        self.subscribers: Dict[str, Set[Queue]] = {}
+        self.stop_event = Event()
+        self.stats = {
+            "deltas_sent": 0,
+            "messages_queued": 0,
+            "subscribers_dropped": 0,
+        }
+        self.thread = Thread(target=self.run, name="live-feed", daemon=True)
+
+    def start(self) -> None:
+        """
+        Start background fan-out thread
+        """
+        self.logger.info("Starting live feed, coalescing every %ss", self.interval)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop fan-out and end every open stream
+        """
+        if not self.thread.is_alive():
+            return
+        self.stop_event.set()
+        self.thread.join()
+        with self.lock:
+            subscribers = [
+                subscriber
+                for host_subscribers in self.subscribers.values()
+                for subscriber in host_subscribers
+            ]
+            self.subscribers.clear()
+        for subscriber in subscribers:
+            self.close(subscriber)
+
+    def publish(self, records: List[dict]) -> None:
+        """
+        Writer listener, hold committed records for hosts someone is watching
+        """
+        with self.lock:
+            for record in records:
+                if record["host"] in self.subscribers:
+                    self.pending.setdefault(record["host"], []).append(record)
+
+    def subscribe(self, host: str) -> Optional[Queue]:
+        """
+        Return message queue for a new stream of host, None when at capacity
+        """
+        with self.lock:
+            subscriber_count = sum(
+                len(host_subscribers) for host_subscribers in self.subscribers.values()
+            )
+            if subscriber_count >= self.max_subscribers:
+                return None
+            subscriber: Queue = Queue(maxsize=self.queue_size)
+            self.subscribers.setdefault(host, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, host: str, subscriber: Queue) -> None:
+        """
+        Forget stream once its client has gone
+        """
+        with self.lock:
+            host_subscribers = self.subscribers.get(host)
+            if host_subscribers is None:
+                return
+            host_subscribers.discard(subscriber)
+            if not host_subscribers:
+                del self.subscribers[host]
+                self.pending.pop(host, None)
+
+    def close(self, subscriber: Queue) -> None:
+        """
+        Replace whatever is queued with the end of stream marker
+        """
+        while True:
+            try:
+                subscriber.get_nowait()
+            except Empty:
+                break
+        subscriber.put_nowait(None)
+
+    def counters(self) -> Dict[str, int]:
+        """
+        Return fan-out counters with the current subscriber count
+        """
+        with self.lock:
+            counters = dict(self.stats)
+            counters["subscribers"] = sum(
+                len(host_subscribers) for host_subscribers in self.subscribers.values()
+            )
+        return counters
+
+    def run(self) -> None:
+        """
+        Send coalesced deltas every interval until stopped
+        """
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as err:  # pylint: disable=broad-except
+                self.logger.error("Live feed flush failed: %s", err)
+
+    def delta(self, host: str, records: List[dict]) -> str:
+        """
+        Serialize records for host as a single event stream message
+        """
+        status: Dict[str, int] = {}
+        rows = []
+        for record in sorted(records, key=lambda record: record["response_date"]):
+            bucket = self.classify(record["response_code"])
+            status[bucket] = status.get(bucket, 0) + 1
+            rows.append(
+                {
+                    "bucket": bucket,
+                    "response_date": record["response_date"],
+                    "request_path": record["request_path"],
+                    "response_code": record["response_code"],
+                    "response_reason": record["response_reason"],
+                    "time_ms": record["time_elapsed"] // 1000,
+                    "breaker_state": record.get("breaker_state"),
+                    "phases_ms": [
+                        None
+                        if record.get(f"time_{phase}") is None
+                        else record[f"time_{phase}"] / 1000
+                        for phase, _, _ in PhaseTimer.phases
+                    ],
+                }
+            )
+        data = json.dumps({"host": host, "rows": rows, "status": status})
+        return f"event: delta\ndata: {data}\n\n"
+
+    def flush(self) -> None:
+        """
+        Fan out one delta per host with pending records
+        """
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            fan_out = {host: list(self.subscribers.get(host, ())) for host in pending}
+
+        for host, records in pending.items():
+            message = self.delta(host, records)
+            self.stats["deltas_sent"] += 1
+            for subscriber in fan_out[host]:
+                try:
+                    subscriber.put_nowait(message)
+                    self.stats["messages_queued"] += 1
+                except Full:
+                    self.logger.info(
+                        "Dropping lagging live feed subscriber of %s", host
+                    )
+                    self.stats["subscribers_dropped"] += 1
+                    self.unsubscribe(host, subscriber)
+                    self.close(subscriber)
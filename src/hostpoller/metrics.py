@@ -0,0 +1,321 @@
+"""
+Counters, gauges and histograms describing the poller itself, rendered in the
+Prometheus text exposition format
+"""
+import bisect
+import logging
+from contextlib import contextmanager
+from threading import Lock, Thread, current_thread, local
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Seconds, from a fast local request up to a request timeout
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+def format_labels(label_names: Sequence[str], label_values: Tuple) -> str:
+    """
+    Render label pairs, escaped as the exposition format requires
+    """
+    if not label_names:
+        return ""
+    pairs = []
+    for name, value in zip(label_names, label_values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        value = value.replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+    """
+    Metric aggregated per thread, each thread updates a shard only it writes to so
+    updates take no lock, shards are summed when the metric is read
+    """
+
+    kind = ""
+
+    def __init__(
+        self, name: str, help_text: str, label_names: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.local = local()
+        self.lock = Lock()
+        self.shards: List[Tuple[Thread, Dict[Tuple, Any]]] = []
+        # Shards of threads that have exited, eg: per request server threads
+        self.retired: Dict[Tuple, Any] = {}
+
+    def shard(self) -> Dict[Tuple, Any]:
+        """
+        Shard of the calling thread, registered on its first update
+        """
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard: Dict[Tuple, Any] = {}
+            self.local.shard = shard
+            with self.lock:
+                self.retire()
+                self.shards.append((current_thread(), shard))
+            return shard
+
+    def retire(self) -> None:
+        """
+        Fold shards of exited threads into the retired totals, lock held by caller
+        """
+        live = []
+        for thread, shard in self.shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                for labels, value in shard.items():
+                    self.combine(self.retired, labels, value)
+        self.shards = live
+
+    def combine(self, totals: Dict[Tuple, Any], labels: Tuple, value: Any) -> None:
+        """
+        Add value for labels into totals
+        """
+        raise NotImplementedError
+
+    def snapshot(self) -> Dict[Tuple, Any]:
+        """
+        Values per label set summed over every thread
+        """
+        totals: Dict[Tuple, Any] = {}
+        with self.lock:
+            self.retire()
+            shards = [self.retired] + [shard for _, shard in self.shards]
+            for shard in shards:
+                # Owning threads may add label sets while this runs
+                for labels, value in list(shard.items()):
+                    self.combine(totals, labels, value)
+        return totals
+
+    def render(self, values: Dict[Tuple, Any]) -> List[str]:
+        """
+        Exposition lines for given values
+        """
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    Monotonic total, optionally split by labels
+    """
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, labels: Tuple = ()) -> None:
+        """
+        Add amount to the total for labels
+        """
+        shard = self.shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def combine(self, totals: Dict[Tuple, Any], labels: Tuple, value: Any) -> None:
+        totals[labels] = totals.get(labels, 0) + value
+
+    def render(self, values: Dict[Tuple, Any]) -> List[str]:
+        return [
+            f"{self.name}{format_labels(self.label_names, labels)} {value}"
+            for labels, value in sorted(values.items())
+        ]
+
+
+class Gauge(Counter):
+    """
+    Value that goes up and down, eg: requests in flight
+    """
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, labels: Tuple = ()) -> None:
+        """
+        Subtract amount from the value for labels
+        """
+        self.inc(-amount, labels)
+
+
+class Histogram(Metric):
+    """
+    Distribution of observations over fixed bucket bounds with their count and sum
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: Tuple = ()) -> None:
+        """
+        Count value in the first bucket whose bound it does not exceed
+        """
+        shard = self.shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # One slot per bound, one for +Inf, then the sum
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @contextmanager
+    def time(self, labels: Tuple = ()) -> Iterator[None]:
+        """
+        Observe seconds spent in the with block
+        """
+        time_start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - time_start, labels)
+
+    def combine(self, totals: Dict[Tuple, Any], labels: Tuple, value: Any) -> None:
+        total = totals.setdefault(labels, [0] * (len(self.buckets) + 2))
+        for index, count in enumerate(list(value)):
+            total[index] += count
+
+    def render(self, values: Dict[Tuple, Any]) -> List[str]:
+        lines = []
+        label_names = self.label_names + ("le",)
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket_labels = format_labels(label_names, labels + (bound,))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            series_labels = format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{series_labels} {counts[-1]}")
+            lines.append(f"{self.name}_count{series_labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Metrics of this process, snapshots merged in from poller worker processes and
+    gauges read from callbacks when rendered
+    """
+
+    def __init__(self) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.lock = Lock()
+        self.metrics: Dict[str, Metric] = {}
+        self.callbacks: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self.sources: Dict[str, Dict[str, Dict[Tuple, Any]]] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Add metric, returning the one already registered under its name
+        """
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(
+        self, name: str, help_text: str, label_names: Sequence[str] = ()
+    ) -> Counter:
+        """
+        Register a counter
+        """
+        return self.register(Counter(name, help_text, label_names))  # type: ignore
+
+    def gauge(
+        self, name: str, help_text: str, label_names: Sequence[str] = ()
+    ) -> Gauge:
+        """
+        Register a gauge
+        """
+        return self.register(Gauge(name, help_text, label_names))  # type: ignore
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """
+        Register a histogram
+        """
+        return self.register(  # type: ignore
+            Histogram(name, help_text, label_names, buckets)
+        )
+
+    def gauge_callback(
+        self, name: str, help_text: str, callback: Callable[[], float]
+    ) -> None:
+        """
+        Register a gauge read from callback each time metrics are rendered
+        """
+        with self.lock:
+            self.callbacks[name] = (help_text, callback)
+
+    def snapshot(self) -> Dict[str, Dict[Tuple, Any]]:
+        """
+        Values of every metric of this process, picklable to send between processes
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def merge(self, source: str, snapshot: Dict[str, Dict[Tuple, Any]]) -> None:
+        """
+        Replace the latest snapshot received from source, eg: a worker process
+        """
+        with self.lock:
+            self.sources[source] = snapshot
+
+    def render(self) -> str:
+        """
+        Every metric in the Prometheus text exposition format
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+            callbacks = dict(self.callbacks)
+            sources = list(self.sources.values())
+        lines = []
+        for metric in metrics:
+            values = metric.snapshot()
+            for snapshot in sources:
+                for labels, value in snapshot.get(metric.name, {}).items():
+                    metric.combine(values, labels, value)
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(values))
+        for name, (help_text, callback) in callbacks.items():
+            try:
+                value = callback()
+            except Exception as err:  # pylint: disable=broad-except
+                self.logger.error("Reading gauge %s failed: %s", name, err)
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared by every module of the process so instrumented code needs no wiring
+REGISTRY = Registry()
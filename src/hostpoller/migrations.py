@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations, upgrades existing databases in place
+"""
+import logging
+from typing import List, Tuple
+
+from headerstore import HeaderStore
+from parseargs import ParseArgs
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+from squeal import Squeal
+
+
+class Migrator:
+    """
+    Track schema version in the database and apply outstanding migrations in order
+    """
+
+    # Version 1 is the original untyped response_log
+    migrations: List[Tuple[int, str]] = [
+        (2, "upgrade_typed_response_log"),
+        (3, "upgrade_host_id_index"),
+        (4, "upgrade_hosts_table"),
+        (5, "upgrade_header_sets"),
+        (6, "upgrade_phase_timings"),
+        (7, "upgrade_breaker_state"),
+        (8, "upgrade_date_index"),
+    ]
+
+    def __init__(self, squeal: Squeal) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.squeal = squeal
+        self.latest = self.migrations[-1][0]
+
+    def current_version(self, connection: Connection) -> int:
+        """
+        Return schema version, 0 for a database without a response log
+        """
+        tables = inspect(connection).get_table_names()
+        if "schema_version" in tables:
+            return connection.execute(
+                text("SELECT version FROM schema_version")
+            ).scalar_one()
+        if "response_log" in tables:
+            return 1
+        return 0
+
+    def set_version(self, connection: Connection, version: int) -> None:
+        """
+        Record schema version
+        """
+        connection.execute(
+            text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        )
+        connection.execute(text("DELETE FROM schema_version"))
+        connection.execute(
+            text("INSERT INTO schema_version (version) VALUES (:version)"),
+            {"version": version},
+        )
+
+    def upgrade(self) -> int:
+        """
+        Apply outstanding migrations, each in its own transaction, and return the
+        resulting schema version
+        """
+        with self.squeal.engine.begin() as connection:
+            version = self.current_version(connection)
+            if version == 0:
+                # Fresh database, tables are created at the latest version
+                self.set_version(connection, self.latest)
+                return self.latest
+
+        for migration_version, migration in self.migrations:
+            if migration_version <= version:
+                continue
+            self.logger.info(
+                "Upgrading schema from version %s to %s", version, migration_version
+            )
+            with self.squeal.engine.begin() as connection:
+                getattr(self, migration)(connection)
+                self.set_version(connection, migration_version)
+            version = migration_version
+
+        self.squeal.reflect()
+        return version
+
+    def upgrade_typed_response_log(self, connection: Connection) -> None:
+        """
+        Version 2: integer epoch response_date, integer microsecond time_elapsed and a
+        composite (host, response_date) index
+        """
+        connection.execute(text("DROP TABLE IF EXISTS response_log_v2"))
+        connection.execute(
+            text(
+                "CREATE TABLE response_log_v2 ("
+                "id INTEGER NOT NULL PRIMARY KEY, "
+                "response_date INTEGER, "
+                "protocol VARCHAR, "
+                "host VARCHAR, "
+                "request_path VARCHAR, "
+                "response_code INTEGER, "
+                "response_reason VARCHAR, "
+                "response_cookies VARCHAR, "
+                "response_headers VARCHAR, "
+                "time_elapsed INTEGER)"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO response_log_v2 SELECT "
+                "id, "
+                "CAST(strftime('%s', response_date) AS INTEGER), "
+                "protocol, host, request_path, response_code, response_reason, "
+                "response_cookies, response_headers, "
+                "CAST(time_elapsed AS INTEGER) "
+                "FROM response_log"
+            )
+        )
+        connection.execute(text("DROP TABLE response_log"))
+        connection.execute(text("ALTER TABLE response_log_v2 RENAME TO response_log"))
+        connection.execute(
+            text(
+                "CREATE INDEX ix_response_log_host_date "
+                "ON response_log (host, response_date)"
+            )
+        )
+
+    def upgrade_host_id_index(self, connection: Connection) -> None:
+        """
+        Version 3: (host, id) index for keyset pagination of the response log
+        """
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_response_log_host_id "
+                "ON response_log (host, id)"
+            )
+        )
+
+    def upgrade_hosts_table(self, connection: Connection) -> None:
+        """
+        Version 4: hosts table with per host metadata, seeded from the response log
+        """
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS hosts ("
+                "host VARCHAR NOT NULL PRIMARY KEY, "
+                "first_seen INTEGER, "
+                "last_seen INTEGER, "
+                "last_status INTEGER, "
+                "row_count INTEGER)"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO hosts SELECT host, "
+                "min(response_date), max(response_date), "
+                "(SELECT latest.response_code FROM response_log AS latest "
+                "WHERE latest.host = response_log.host "
+                "ORDER BY latest.id DESC LIMIT 1), "
+                "count(*) FROM response_log GROUP BY host"
+            )
+        )
+
+    def upgrade_header_sets(self, connection: Connection) -> None:
+        """
+        Version 5: header and cookie sets stored once in header_sets, response_log
+        keeps references, legacy str() values are parsed and normalized in chunks
+        """
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS header_sets ("
+                "digest VARCHAR NOT NULL PRIMARY KEY, "
+                "kind VARCHAR, "
+                "content VARCHAR)"
+            )
+        )
+        for kind, column in (
+            ("headers", "response_headers"),
+            ("cookies", "response_cookies"),
+        ):
+            connection.execute(
+                text(
+                    "CREATE TEMPORARY TABLE header_map "
+                    "(legacy VARCHAR NOT NULL PRIMARY KEY, digest VARCHAR)"
+                )
+            )
+            legacy_values = connection.execution_options(stream_results=True).execute(
+                text(f"SELECT DISTINCT {column} FROM response_log")
+            )
+            while True:
+                chunk = legacy_values.fetchmany(10000)
+                if not chunk:
+                    break
+                mapping = []
+                header_sets = {}
+                for (legacy,) in chunk:
+                    if legacy is None:
+                        continue
+                    content = HeaderStore.normalize(
+                        kind, HeaderStore.parse_legacy(kind, legacy)
+                    )
+                    digest = None
+                    if content is not None:
+                        digest = HeaderStore.digest(kind, content)
+                        header_sets[digest] = {
+                            "digest": digest,
+                            "kind": kind,
+                            "content": content,
+                        }
+                    mapping.append({"legacy": legacy, "digest": digest})
+                if mapping:
+                    connection.execute(
+                        text("INSERT INTO header_map VALUES (:legacy, :digest)"),
+                        mapping,
+                    )
+                if header_sets:
+                    connection.execute(
+                        text(
+                            "INSERT INTO header_sets VALUES (:digest, :kind, :content) "
+                            "ON CONFLICT (digest) DO NOTHING"
+                        ),
+                        list(header_sets.values()),
+                    )
+            connection.execute(
+                text(
+                    f"UPDATE response_log SET {column} = "
+                    "(SELECT digest FROM header_map "
+                    f"WHERE header_map.legacy = response_log.{column}) "
+                    f"WHERE {column} IS NOT NULL"
+                )
+            )
+            connection.execute(text("DROP TABLE header_map"))
+
+    def upgrade_phase_timings(self, connection: Connection) -> None:
+        """
+        Version 6: microsecond timing columns per request phase, NULL for responses
+        recorded before phases were measured
+        """
+        for phase in ("dns", "connect", "tls", "ttfb", "transfer"):
+            connection.execute(
+                text(f"ALTER TABLE response_log ADD COLUMN time_{phase} INTEGER")
+            )
+
+    def upgrade_breaker_state(self, connection: Connection) -> None:
+        """
+        Version 7: circuit breaker state of the host after each response, NULL for
+        responses recorded in fixed polling mode
+        """
+        connection.execute(
+            text("ALTER TABLE response_log ADD COLUMN breaker_state VARCHAR")
+        )
+
+    def upgrade_date_index(self, connection: Connection) -> None:
+        """
+        Version 8: response_date index for windows read across every host, eg: the
+        fleet overview and retention
+        """
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_response_log_date "
+                "ON response_log (response_date)"
+            )
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s:%(name)s:%(levelname)s]: %(message)s",
+    )
+    app_metadata = {
+        "name": "hostpoller",
+        "description": "Upgrade an existing database to the latest schema in place.",
+    }
+    app_arguments = [
+        {
+            "switch": "--sql-engine",
+            "default": "sqlite",
+            "help": "SQL Engine, sqlite, sqlite-wal or postgresql, default: sqlite",
+            "type": str,
+        },
+        {
+            "switch": "--sql-db-path",
+            "default": f"{app_metadata['name']}.db",
+            "help": "SQLite database file or postgresql:// URL, "
+            f"default: {app_metadata['name']}.db",
+            "type": str,
+        },
+    ]
+    parser = ParseArgs(app_metadata["name"], app_metadata["description"], app_arguments)
+    args = parser.args_parsed
+    squeal_engine = {"type": args.sql_engine, "file_path": args.sql_db_path}
+    schema_version = Migrator(Squeal(squeal_engine)).upgrade()
+    logging.getLogger(__name__).info("Schema at version %s", schema_version)
@@ -21,6 +21,7 @@ class ParseArgs:  # pylint: disable=too-few-public-methods
         for argument in self.argument_map:
             self.parser.add_argument(
                 argument["switch"],
+                action=argument.get("action", "store"),
                 type=argument["type"],
                 default=argument["default"],
                 help=argument["help"],
@@ -1,23 +1,31 @@
 #!/usr/bin/env python3
 """
-Module to poll host for a given period and frequency and store results
+Module to poll hosts for a given period and frequency and store results
 """
 
+import asyncio
 import logging
+import ssl
 from argparse import Namespace as ArgNamespace
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
 from threading import Thread
 from time import sleep, time
-from typing import Any, Dict, Generator
+from typing import Any, Callable, Dict, List, Optional
 
-import requests
+import aiohttp
+from breaker import CircuitBreaker
 from dateutil import parser as date_parser
-from flaskwrapper import FlaskWrapper
+from headerstore import HeaderStore
+from metrics import REGISTRY
 from parseargs import ParseArgs
-from requests.exceptions import ConnectionError as RequestsConnectionError
-from requests.exceptions import ReadTimeout as RequestsReadTimeout
-from sqlalchemy import Column, Integer, String, Table, Text
-from squeal import Squeal
+from probe import PhaseTimer, ProbeConnector, trace_config
+from responselog import ResponseLog
+from retention import Retention
+from rollup import Rollup
+from scheduler import Scheduler
+from slo import SloTracker
+from squeal import BatchWriter
 from trapper import Trapper
 
 logger = logging.getLogger(__name__)
@@ -26,143 +34,385 @@ logging.basicConfig(
     format="[%(asctime)s:%(name)s:%(levelname)s]: %(message)s",
 )
 
-
-class ResponseLog:  # pylint: disable=too-few-public-methods
-    """
-    Initialize table and provide interface to SQLAlchemy wrapper
-    """
-
-    def __init__(self, engine_type: str, engine_uri: str) -> None:
-        squeal_engine = {
-            "type": f"{engine_type}",
-            "file_path": f"{engine_uri}?check_same_thread=False",
-        }
-        self.engine = Squeal(squeal_engine)
-        self.meta_data = self.engine.meta_data
-        self.response_log = Table(
-            "response_log",
-            self.meta_data,
-            Column("id", Integer, primary_key=True),
-            Column("response_date", Text),
-            Column("protocol", String),
-            Column("host", String),
-            Column("request_path", String),
-            Column("response_code", Integer),
-            Column("response_reason", String),
-            Column("response_cookies", String),
-            Column("response_headers", String),
-            Column("time_elapsed", String),
-            extend_existing=True,
-        )
-        self.access_log_meta = self.engine.meta_data.tables["response_log"]
-        self.meta_data.create_all(self.engine.engine)
+REQUESTS = REGISTRY.counter(
+    "hostpoller_requests_total", "Requests made to targets by outcome", ("outcome",)
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "hostpoller_request_seconds", "Time from acquiring a request slot to completion"
+)
+REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "hostpoller_requests_in_flight", "Requests holding a concurrency slot"
+)
+POLL_LAG_SECONDS = REGISTRY.histogram(
+    "hostpoller_poll_lag_seconds", "Delay of each poll past its scheduled deadline"
+)
+POLLS_SKIPPED = REGISTRY.counter(
+    "hostpoller_polls_skipped_total", "Polls skipped as the previous one overran"
+)
+POLLS_SHORT_CIRCUITED = REGISTRY.counter(
+    "hostpoller_polls_short_circuited_total", "Polls skipped by an open breaker"
+)
+BREAKER_TRANSITIONS = REGISTRY.counter(
+    "hostpoller_breaker_transitions_total", "Breakers opened or closed", ("state",)
+)
 
 
 class Poller:
     """
-    Interface to poll given target and record results
+    Interface to poll a collection of targets on a single event loop and record results
     """
 
-    def __init__(self, parsed_args: ArgNamespace, table: ResponseLog) -> None:
+    def __init__(
+        self,
+        parsed_args: ArgNamespace,
+        table: Optional[ResponseLog],
+        sink: Optional[Callable[[Dict], None]] = None,
+    ) -> None:
+        if table is None and sink is None:
+            logger.error("Polling needs a response log or a sink for its results")
+            raise SystemExit(1)
         self.table = table
-        if parsed_args.target.endswith("/"):
-            self.target = parsed_args.target
-        else:
-            self.target = parsed_args.target + "/"
-
-        self.target_meta = {
-            "protocol": self.target.split(":")[0],
-            "host": self.target.split("/")[2],
-            "path": "/" + self.target.split("/", 3)[3],
+        self.sink = sink or self.store
+        self.poll_meta = {
             "monitor_period": parsed_args.monitor_period,
             "polling_frequency": parsed_args.polling_frequency,
             "request_timeout": parsed_args.request_timeout,
+            "max_concurrency": parsed_args.max_concurrency,
+            "max_per_host": parsed_args.max_per_host,
+            "pool_size": parsed_args.pool_size,
+            "pool_per_host": parsed_args.pool_per_host,
+            "keepalive_timeout": parsed_args.keepalive_timeout,
+            "connection_mode": parsed_args.connection_mode,
+            "polling_jitter": parsed_args.polling_jitter,
+            "polling_mode": parsed_args.polling_mode,
+            "breaker_threshold": parsed_args.breaker_threshold,
+            "breaker_max_backoff": parsed_args.breaker_max_backoff,
+            "transition_polls": parsed_args.transition_polls,
+            "transition_frequency": parsed_args.transition_frequency,
+        }
+        if self.poll_meta["polling_mode"] not in ("fixed", "adaptive"):
+            logger.error("Unknown polling mode %s", self.poll_meta["polling_mode"])
+            raise SystemExit(1)
+        self.targets = []
+        for target in self.load_targets(parsed_args.target, parsed_args.targets_file):
+            self.targets.append(self.parse_target(target))
+
+        self.sink_executor = ThreadPoolExecutor(max_workers=1)
+        self.global_slots: asyncio.Semaphore
+        self.host_slots: Dict[str, asyncio.Semaphore] = {}
+        self.sessions: Dict[str, aiohttp.ClientSession] = {}
+        self.schedulers: Dict[str, Scheduler] = {}
+        # One per host in adaptive mode, shared by every target on the host
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.run_task: Optional[asyncio.Task] = None
+        self.stopping = False
+        # Certificates are verified against the system trust store unless replaced
+        self.ssl_context: Optional[ssl.SSLContext] = None
+
+    @staticmethod
+    def load_targets(target_args: Optional[List], targets_file: str) -> List:
+        """
+        Collect targets from repeated --target switches and an optional targets file
+        """
+        targets = list(target_args or [])
+        if targets_file:
+            with open(targets_file, encoding="utf-8") as targets_handle:
+                for line in targets_handle:
+                    line = line.split("#", 1)[0].strip()
+                    if line:
+                        targets.append(line)
+        if not targets:
+            targets.append("https://127.0.0.1/")
+
+        # Preserve order while dropping duplicates
+        return list(dict.fromkeys(targets))
+
+    def parse_target(self, target: str) -> Dict:
+        """
+        Split target url into the components recorded with each response, a target
+        may be followed by key=value options, eg: https://example.com/ connection=cold
+        """
+        target, *option_args = target.split()
+        target_options = {}
+        for option in option_args:
+            if "=" not in option:
+                logger.error("Target option %s for %s is not key=value", option, target)
+                raise SystemExit(1)
+            key, value = option.split("=", 1)
+            target_options[key] = value
+        if not target.endswith("/"):
+            target = target + "/"
+
+        connection = target_options.get("connection", self.poll_meta["connection_mode"])
+        if connection not in ("warm", "cold"):
+            logger.error("Unknown connection mode %s for %s", connection, target)
+            raise SystemExit(1)
+
+        return {
+            "url": target,
+            "protocol": target.split(":")[0],
+            "host": target.split("/")[2],
+            "path": "/" + target.split("/", 3)[3],
+            "connection": connection,
         }
 
     def start(self) -> None:
         """
-        Poll target and record results
+        Poll targets and record results
         """
-        responses = self.poll_target()
+        try:
+            asyncio.run(self.run())
+        except asyncio.CancelledError:
+            logger.info("Polling stopped")
+        finally:
+            self.sink_executor.shutdown(wait=True)
 
-        for response in responses:
-            squeal_record = {
-                "response_date": response["response_date"],
-                "protocol": self.target_meta["protocol"],
-                "host": self.target_meta["host"],
-                "request_path": self.target_meta["path"],
-                "response_code": response["status_code"],
-                "response_reason": str(response["status_reason"]),
-                "response_cookies": str(response["cookies"]),
-                "response_headers": str(response["headers"]),
-                "time_elapsed": str(response["time_elapsed"]),
-            }
+    def stop(self) -> None:
+        """
+        Cancel polling from another thread, responses already handed to the sink are
+        kept while requests in flight are abandoned
+        """
+        self.stopping = True
+        # Both are set once run starts, before that stopping alone ends it
+        if self.loop is not None and self.run_task is not None:
+            self.loop.call_soon_threadsafe(self.run_task.cancel)
+
+    async def run(self) -> None:
+        """
+        Open client sessions and poll every target concurrently
+        """
+        self.run_task = asyncio.current_task()
+        self.loop = asyncio.get_running_loop()
+        if self.stopping:
+            return
+        self.global_slots = asyncio.Semaphore(self.poll_meta["max_concurrency"])
+        for target_meta in self.targets:
+            self.host_slots.setdefault(
+                target_meta["host"], asyncio.Semaphore(self.poll_meta["max_per_host"])
+            )
+            if self.poll_meta["polling_mode"] == "adaptive":
+                self.breakers.setdefault(
+                    target_meta["host"],
+                    CircuitBreaker(
+                        {
+                            "name": target_meta["host"],
+                            "threshold": self.poll_meta["breaker_threshold"],
+                            "base_backoff": self.poll_meta["polling_frequency"],
+                            "max_backoff": self.poll_meta["breaker_max_backoff"],
+                        }
+                    ),
+                )
+
+        async with AsyncExitStack() as session_stack:
+            for connection in {
+                target_meta["connection"] for target_meta in self.targets
+            }:
+                self.sessions[connection] = await session_stack.enter_async_context(
+                    self.open_session(connection)
+                )
+            await asyncio.gather(
+                *(self.poll_target(target_meta) for target_meta in self.targets)
+            )
+
+    def open_session(self, connection: str) -> aiohttp.ClientSession:
+        """
+        Build client session for the given connection mode
 
-            self.table.engine.insert(self.table.response_log, squeal_record)
+        warm: keep-alive connections pooled per host, latency excludes connection setup
+        cold: a fresh DNS lookup, TCP connection and TLS handshake for every request
+        """
+        timeout = aiohttp.ClientTimeout(total=self.poll_meta["request_timeout"])
+        connector_options: Dict[str, Any] = {
+            "limit": self.poll_meta["pool_size"],
+            "limit_per_host": self.poll_meta["pool_per_host"],
+        }
+        if self.ssl_context is not None:
+            connector_options["ssl"] = self.ssl_context
+        if connection == "cold":
+            connector = ProbeConnector(
+                use_dns_cache=False, force_close=True, **connector_options
+            )
+        else:
+            connector = ProbeConnector(
+                keepalive_timeout=self.poll_meta["keepalive_timeout"],
+                **connector_options,
+            )
+        return aiohttp.ClientSession(
+            connector=connector, timeout=timeout, trace_configs=[trace_config()]
+        )
 
-    def poll_target(self) -> Generator:
+    async def poll_target(self, target_meta: Dict) -> None:
         """
-        Loop until timeout make request and yield responses
+        Loop until timeout making requests to target and storing responses
         """
-        time_start = int(time())
-        time_stop = time_start + self.target_meta["monitor_period"]
-        if self.target_meta["monitor_period"] == 0:
-            logger.info("Polling target indefinitely")
+        loop = asyncio.get_running_loop()
+        scheduler = Scheduler(
+            {
+                "name": target_meta["url"],
+                "polling_frequency": self.poll_meta["polling_frequency"],
+                "monitor_period": self.poll_meta["monitor_period"],
+                "jitter": self.poll_meta["polling_jitter"],
+            }
+        )
+        self.schedulers[target_meta["url"]] = scheduler
+        if self.poll_meta["monitor_period"] == 0:
+            logger.info("Polling %s indefinitely", target_meta["url"])
         else:
             logger.info(
-                "Polling target for %s seconds", self.target_meta["monitor_period"]
+                "Polling %s for %s seconds",
+                target_meta["url"],
+                self.poll_meta["monitor_period"],
             )
+        # Polls left at the transition frequency after the host changed state
+        transition_polls = 0
         while True:
-            request_response = self.make_request()
+            skipped = scheduler.stats["skipped"]
+            delay = scheduler.next_delay()
+            if scheduler.stats["skipped"] > skipped:
+                POLLS_SKIPPED.inc(scheduler.stats["skipped"] - skipped)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+            POLL_LAG_SECONDS.observe(scheduler.fired())
 
-            if self.target_meta["monitor_period"] == 0:
-                logger.debug("Running indefinitiely")
-            else:
-                if int(time()) >= time_stop:
-                    break
-            sleep(self.target_meta["polling_frequency"])
-            yield request_response
+            if transition_polls:
+                transition_polls -= 1
+                if not transition_polls:
+                    scheduler.retune(self.poll_meta["polling_frequency"])
+            breaker = self.breakers.get(target_meta["host"])
+            if breaker is not None and not breaker.allow():
+                POLLS_SHORT_CIRCUITED.inc()
+                continue
+            request_response = await self.make_request(target_meta)
+            breaker_state = None
+            if breaker is not None:
+                if (
+                    self.track_breaker(breaker, request_response)
+                    and self.poll_meta["transition_polls"]
+                ):
+                    # Capture the change at a higher resolution for a while
+                    scheduler.retune(self.poll_meta["transition_frequency"])
+                    transition_polls = self.poll_meta["transition_polls"]
+                breaker_state = breaker.state
+            squeal_record = {
+                "response_date": request_response["response_date"],
+                "protocol": target_meta["protocol"],
+                "host": target_meta["host"],
+                "request_path": target_meta["path"],
+                "response_code": request_response["status_code"],
+                "response_reason": str(request_response["status_reason"]),
+                "response_cookies": request_response["cookies"],
+                "response_headers": request_response["headers"],
+                "time_elapsed": request_response["time_elapsed"],
+                **request_response["phases"],
+                "breaker_state": breaker_state,
+            }
+            await loop.run_in_executor(self.sink_executor, self.sink, squeal_record)
+
+        logger.info("Finished polling %s: %s", target_meta["url"], scheduler.stats)
 
-    def make_request(self) -> Dict:
+    @staticmethod
+    def track_breaker(breaker: CircuitBreaker, request_response: Dict) -> bool:
         """
-        Make a single request for given host and protocol and store and return response
+        Count a response into the host breaker, returns whether the host started
+        failing or recovered
+        """
+        previous_state = breaker.state
+        changed = breaker.record(request_response["status_code"] < 100)
+        if breaker.state != previous_state:
+            BREAKER_TRANSITIONS.inc(labels=(breaker.state,))
+        return changed
+
+    def schedule_stats(self) -> Dict[str, float]:
+        """
+        Sum scheduling counters over all targets
+        """
+        totals = {"ticks": 0.0, "skipped": 0.0, "overruns": 0.0, "lag_seconds_max": 0.0}
+        for scheduler in list(self.schedulers.values()):
+            totals["ticks"] += scheduler.stats["ticks"]
+            totals["skipped"] += scheduler.stats["skipped"]
+            totals["overruns"] += scheduler.stats["overruns"]
+            totals["lag_seconds_max"] = max(
+                totals["lag_seconds_max"], scheduler.stats["lag_seconds_max"]
+            )
+        return totals
+
+    def store(self, squeal_record: Dict) -> None:
+        """
+        Write a single response record directly when no sink is given
+        """
+        if self.table is None:
+            return
+        self.table.header_store.prepare([squeal_record])
+        self.table.engine.insert(self.table.response_log, squeal_record)
+
+    async def make_request(self, target_meta: Dict) -> Dict:
+        """
+        Make a single request for given target and return response
         """
         response_meta = {}  # type: Dict[str, Any]
-        logger.debug("Making request to %s", self.target)
+        logger.debug("Making request to %s", target_meta["url"])
         response_meta["cookies"] = None
         response_meta["headers"] = None
         response_meta["status_code"] = 1
-        response_meta["time_elapsed"] = 0
+        timer = PhaseTimer()
+        timer_token = PhaseTimer.current.set(timer)
+        outcome = "response"
         try:
-            request_result = requests.get(
-                self.target,
-                timeout=self.target_meta["request_timeout"],
-            )
-        except RequestsConnectionError as err:
-            logger.debug("Connection error")
-            if err.args[0].reason.args:
-                response_meta["status_reason"] = err.args[0].reason.args[0]
-            else:
-                response_meta["status_reason"] = str(err)
-            response_meta["response_date"] = datetime.utcnow().isoformat()
-        except RequestsReadTimeout as err:
+            async with self.global_slots, self.host_slots[target_meta["host"]]:
+                timer.mark("start")
+                REQUESTS_IN_FLIGHT.inc()
+                try:
+                    session = self.sessions[target_meta["connection"]]
+                    async with session.get(
+                        target_meta["url"], trace_request_ctx=timer
+                    ) as request_result:
+                        await request_result.read()
+                finally:
+                    REQUESTS_IN_FLIGHT.dec()
+                timer.mark("done")
+        except asyncio.TimeoutError as err:
+            outcome = "timeout"
             logger.debug("Read Timeout: %s", err)
             response_meta[
                 "status_reason"
-            ] = f"Read Timeout after {self.target_meta['request_timeout']}s"
-            response_meta["response_date"] = datetime.utcnow().isoformat()
+            ] = f"Read Timeout after {self.poll_meta['request_timeout']}s"
+            response_meta["response_date"] = int(time())
+        except aiohttp.ClientConnectorError as err:
+            outcome = "connect_error"
+            logger.debug("Connection error")
+            response_meta["status_reason"] = str(err.os_error)
+            response_meta["response_date"] = int(time())
+        except aiohttp.ClientError as err:
+            outcome = "client_error"
+            logger.debug("Client error: %s", err)
+            response_meta["status_reason"] = str(err) or type(err).__name__
+            response_meta["response_date"] = int(time())
         except Exception as err:
             logger.error("Unhandled exception: %s", err)
             raise SystemExit from err
         else:
-            response_meta["status_code"] = request_result.status_code
+            response_meta["status_code"] = request_result.status
             response_meta["status_reason"] = request_result.reason
-            response_meta["cookies"] = request_result.cookies
-            response_meta["headers"] = request_result.headers
-            response_meta["response_date"] = date_parser.parse(
-                request_result.headers["date"]
-            ).isoformat()
-            response_meta["time_elapsed"] = request_result.elapsed.microseconds
+            response_meta["cookies"] = HeaderStore.cookie_list(request_result.cookies)
+            response_meta["headers"] = list(request_result.headers.items())
+            if "date" in request_result.headers:
+                response_meta["response_date"] = int(
+                    date_parser.parse(request_result.headers["date"]).timestamp()
+                )
+            else:
+                response_meta["response_date"] = int(time())
+        finally:
+            PhaseTimer.current.reset(timer_token)
+        # Failed requests keep the time spent and the phases they got through
+        response_meta["time_elapsed"] = timer.elapsed_us()
+        REQUESTS.inc(labels=(outcome,))
+        REQUEST_SECONDS.observe(response_meta["time_elapsed"] / 1_000_000)
+        response_meta["phases"] = {
+            f"time_{phase}": duration
+            for phase, duration in timer.durations_us().items()
+        }
         return response_meta
 
 
@@ -175,8 +425,17 @@ if __name__ == "__main__":
     app_arguments = [
         {
             "switch": "--target",
-            "default": "https://127.0.0.1/",
-            "help": "Host or ip to target and path, default: https://127.0.0.1/",
+            "action": "append",
+            "default": None,
+            "help": "Host or ip to target and path, may be repeated, "
+            "default: https://127.0.0.1/",
+            "type": str,
+        },
+        {
+            "switch": "--targets-file",
+            "default": "",
+            "help": "File with one target per line, combined with --target, "
+            "default: none",
             "type": str,
         },
         {
@@ -188,7 +447,52 @@ if __name__ == "__main__":
         {
             "switch": "--polling-frequency",
             "default": 1,
-            "help": "Time in seconds to poll given host over specified period, default: 1",
+            "help": "Time in seconds to poll given host over specified period, "
+            "default: 1",
+            "type": float,
+        },
+        {
+            "switch": "--polling-jitter",
+            "default": 0.0,
+            "help": "Fraction of the polling frequency to randomly offset each poll "
+            "by, spreads out targets polled together, default: 0",
+            "type": float,
+        },
+        {
+            "switch": "--polling-mode",
+            "default": "fixed",
+            "help": "fixed polls every target at the polling frequency, adaptive "
+            "backs off hosts that stop answering with a per host circuit breaker, "
+            "default: fixed",
+            "type": str,
+        },
+        {
+            "switch": "--breaker-threshold",
+            "default": 3,
+            "help": "Consecutive failed requests that open a host breaker in adaptive "
+            "mode, default: 3",
+            "type": int,
+        },
+        {
+            "switch": "--breaker-max-backoff",
+            "default": 300,
+            "help": "Longest seconds an open breaker waits before probing its host, "
+            "the wait starts at the polling frequency and doubles per failed probe, "
+            "default: 300",
+            "type": float,
+        },
+        {
+            "switch": "--transition-polls",
+            "default": 0,
+            "help": "Polls made at the transition frequency after a host starts "
+            "failing or recovers in adaptive mode, 0 disables, default: 0",
+            "type": int,
+        },
+        {
+            "switch": "--transition-frequency",
+            "default": 0.25,
+            "help": "Time in seconds between polls after a host changes state, "
+            "default: 0.25",
             "type": float,
         },
         {
@@ -197,6 +501,84 @@ if __name__ == "__main__":
             "help": "Timeout for requests to target, default: 10",
             "type": int,
         },
+        {
+            "switch": "--max-concurrency",
+            "default": 256,
+            "help": "Maximum requests in flight across all targets, default: 256",
+            "type": int,
+        },
+        {
+            "switch": "--max-per-host",
+            "default": 8,
+            "help": "Maximum requests in flight to a single host, default: 8",
+            "type": int,
+        },
+        {
+            "switch": "--pool-size",
+            "default": 256,
+            "help": "Connections pooled across all hosts, 0 for no limit, default: 256",
+            "type": int,
+        },
+        {
+            "switch": "--pool-per-host",
+            "default": 8,
+            "help": "Connections pooled per host, 0 for no limit, default: 8",
+            "type": int,
+        },
+        {
+            "switch": "--keepalive-timeout",
+            "default": 30,
+            "help": "Seconds an idle pooled connection is kept open, default: 30",
+            "type": float,
+        },
+        {
+            "switch": "--connection-mode",
+            "default": "warm",
+            "help": "Measure warm (pooled keep-alive) or cold (new connection) "
+            "latency, override per target with connection=warm|cold, default: warm",
+            "type": str,
+        },
+        {
+            "switch": "--workers",
+            "default": 0,
+            "help": "Poller processes to shard targets across by host, results are "
+            "sent back in batches of --write-batch-size or after --write-max-age, "
+            "0 polls in the main process, default: 0",
+            "type": int,
+        },
+        {
+            "switch": "--write-batch-size",
+            "default": 500,
+            "help": "Records written per transaction, default: 500",
+            "type": int,
+        },
+        {
+            "switch": "--write-max-age",
+            "default": 0.25,
+            "help": "Seconds a record may wait before its batch is flushed, "
+            "default: 0.25",
+            "type": float,
+        },
+        {
+            "switch": "--write-queue-size",
+            "default": 10000,
+            "help": "Records buffered before polling is held back, default: 10000",
+            "type": int,
+        },
+        {
+            "switch": "--write-retries",
+            "default": 5,
+            "help": "Times a batch is retried on a locked database or lost connection "
+            "before it is dropped, default: 5",
+            "type": int,
+        },
+        {
+            "switch": "--write-retry-backoff",
+            "default": 0.5,
+            "help": "Seconds before the first retry of a batch, doubled on each retry "
+            "up to 30, default: 0.5",
+            "type": float,
+        },
         {
             "switch": "--listen-ip",
             "default": "127.0.0.1",
@@ -209,16 +591,134 @@ if __name__ == "__main__":
             "help": "Web listener binding port, default: 9000",
             "type": int,
         },
+        {
+            "switch": "--serving-mode",
+            "default": "development",
+            "help": "Web server, development (werkzeug) or production (waitress), "
+            "or collector to only poll and write results without loading the web "
+            "stack, exits once polling is over, default: development",
+            "type": str,
+        },
+        {
+            "switch": "--web-threads",
+            "default": 8,
+            "help": "Request threads and read only database connections for the "
+            "production server, default: 8",
+            "type": int,
+        },
+        {
+            "switch": "--cache-ttl",
+            "default": 5,
+            "help": "Seconds a rendered dashboard is reused for, default: 5",
+            "type": float,
+        },
+        {
+            "switch": "--cache-entries",
+            "default": 256,
+            "help": "Rendered dashboards kept in memory, default: 256",
+            "type": int,
+        },
+        {
+            "switch": "--stream-interval",
+            "default": 1.0,
+            "help": "Seconds live dashboard updates are coalesced for, default: 1.0",
+            "type": float,
+        },
+        {
+            "switch": "--stream-clients",
+            "default": 128,
+            "help": "Open live dashboard streams allowed, 0 disables live updates, "
+            "default: 128",
+            "type": int,
+        },
+        {
+            "switch": "--slo-objective",
+            "default": 99.9,
+            "help": "Availability objective in percent, responses below 500 count as "
+            "available, default: 99.9",
+            "type": float,
+        },
+        {
+            "switch": "--slo-windows",
+            "default": "5m,1h,24h,30d",
+            "help": "Comma separated windows to report availability and burn rate "
+            "over, the error budget is kept over the longest, empty disables, "
+            "default: 5m,1h,24h,30d",
+            "type": str,
+        },
+        {
+            "switch": "--slo-buckets",
+            "default": 60,
+            "help": "Buckets per window, windows slide one bucket at a time, "
+            "default: 60",
+            "type": int,
+        },
+        {
+            "switch": "--slo-checkpoint-interval",
+            "default": 60,
+            "help": "Seconds between saves of the SLO windows to the database, "
+            "default: 60",
+            "type": float,
+        },
+        {
+            "switch": "--recent-dir",
+            "default": "",
+            "help": "Directory of memory mapped files holding the latest samples of "
+            "each host, read by the dashboard instead of querying, default: none",
+            "type": str,
+        },
+        {
+            "switch": "--recent-samples",
+            "default": 200,
+            "help": "Samples kept per host in --recent-dir, default: 200",
+            "type": int,
+        },
+        {
+            "switch": "--retention-days",
+            "default": 0,
+            "help": "Days raw responses are kept before being counted into hourly "
+            "status rollups and removed, 0 keeps them forever, default: 0",
+            "type": float,
+        },
+        {
+            "switch": "--archive-dir",
+            "default": "",
+            "help": "Directory expired responses are archived to as Parquet, "
+            "requires pyarrow, default: no archive",
+            "type": str,
+        },
+        {
+            "switch": "--retention-batch-size",
+            "default": 5000,
+            "help": "Rows expired per transaction, default: 5000",
+            "type": int,
+        },
+        {
+            "switch": "--retention-interval",
+            "default": 300,
+            "help": "Seconds between retention runs, default: 300",
+            "type": float,
+        },
         {
             "switch": "--sql-engine",
             "default": "sqlite",
-            "help": "SQL Engine, default: sqlite",
+            "help": "SQL Engine, sqlite, sqlite-wal for write ahead logging with "
+            "a single writer and non blocking readers, or postgresql, default: sqlite",
+            "type": str,
+        },
+        {
+            "switch": "--sql-pragma",
+            "action": "append",
+            "default": None,
+            "help": "SQLite pragma as name=value set on every connection, "
+            "repeatable, overrides the sqlite-wal defaults, eg: mmap_size=1073741824",
             "type": str,
         },
         {
             "switch": "--sql-db-path",
             "default": f"{app_metadata['name']}.db",
-            "help": f"SQL Engine, default: {app_metadata['name']}.db",
+            "help": "SQLite database file or postgresql:// URL, "
+            f"default: {app_metadata['name']}.db",
             "type": str,
         },
     ]
@@ -226,52 +726,282 @@ if __name__ == "__main__":
     parser = ParseArgs(app_metadata["name"], app_metadata["description"], app_arguments)
     args = parser.args_parsed
 
-    response_log = ResponseLog(args.sql_engine, args.sql_db_path)
-
-    logger.info(
-        "Targeting %s every %ss",
-        args.target,
-        args.polling_frequency,
+    sql_pragmas = dict(pragma.split("=", 1) for pragma in args.sql_pragma or [])
+    response_log = ResponseLog(
+        args.sql_engine, args.sql_db_path, args.web_threads, sql_pragmas
     )
 
-    poller = Poller(args, response_log)
+    writer_meta = {
+        "batch_size": args.write_batch_size,
+        "max_age": args.write_max_age,
+        "queue_size": args.write_queue_size,
+        "retries": args.write_retries,
+        "retry_backoff": args.write_retry_backoff,
+    }
+    writer = BatchWriter(response_log.engine, response_log.response_log, writer_meta)
+    writer.add_preparer(response_log.header_store.prepare)
+    writer.add_listener(response_log.host_registry.add)
+    rollup = Rollup(response_log.engine)
+    writer.add_listener(rollup.add)
+    recent = None
+    if args.recent_dir:
+        # Loads numpy, which collectors without recent samples never need
+        from recent import RecentStore  # pylint: disable=import-outside-toplevel
 
-    logger.info("Starting poller")
-    poller_thread = Thread(target=poller.start, daemon=True)
-    poller_thread.start()
+        recent = RecentStore(
+            response_log, {"path": args.recent_dir, "capacity": args.recent_samples}
+        )
+        # Ahead of the dashboard cache so renders after invalidation see the batch
+        writer.add_listener(recent.add)
+    serving = args.serving_mode != "collector"
+    dashboard_cache = None
+    live_feed = None
+    slo = None
+    if serving:
+        # The web stack is only loaded when there is something to serve
+        # pylint: disable=import-outside-toplevel
+        from cache import TTLCache
+        from flaskwrapper import FlaskWrapper
+        from livefeed import LiveFeed
 
-    flask_meta = {
-        "name": app_metadata["name"],
-        "listen_ip": args.listen_ip,
-        "listen_port": args.listen_port,
-    }
-    flask_app = FlaskWrapper(
-        flask_meta,
-        response_log,
-    )
+        dashboard_cache = TTLCache(
+            {"max_entries": args.cache_entries, "ttl": args.cache_ttl}
+        )
+        writer.add_listener(dashboard_cache.invalidate_batch)
+        if args.stream_clients:
+            live_feed = LiveFeed(
+                {
+                    "interval": args.stream_interval,
+                    "max_subscribers": args.stream_clients,
+                },
+                FlaskWrapper.status_bucket,
+            )
+            writer.add_listener(live_feed.publish)
+            live_feed.start()
+        if args.slo_windows:
+            slo_meta = {
+                "objective": args.slo_objective,
+                "windows": args.slo_windows.split(","),
+                "buckets": args.slo_buckets,
+                "checkpoint_interval": args.slo_checkpoint_interval,
+            }
+            slo = SloTracker(response_log, slo_meta)
+            slo.load()
+            writer.add_listener(slo.add)
+    supervisor = None
+    if args.workers:
+        # Imported here as the supervisor imports Poller from this module
+        from supervisor import Supervisor  # pylint: disable=import-outside-toplevel
 
-    flask_endpoints = [
-        {
-            "path": "/",
-            "name": "doc_root",
-            "handler": flask_app.doc_root,
-            "methods": ["GET"],
-        },
-        {
-            "path": "/dashboard",
-            "name": "dashboard",
-            "handler": flask_app.dashboard_endpoint,
-            "methods": ["GET", "POST"],
-        },
-    ]
+        supervisor_meta = {
+            "workers": args.workers,
+            "batch_size": args.write_batch_size,
+            "max_age": args.write_max_age,
+        }
+        supervisor = Supervisor(supervisor_meta, args, writer.put)
+        # Registered first so results of stopping workers are still written
+        trapper.add_handler(supervisor.stop)
+    writer.start()
+    trapper.add_handler(writer.stop)
+    trapper.add_handler(rollup.flush)
+    if slo is not None:
+        trapper.add_handler(slo.checkpoint)
+    if recent is not None:
+        trapper.add_handler(recent.close)
+    if live_feed is not None:
+        trapper.add_handler(live_feed.stop)
 
-    logger.info("Starting flask")
-    flask = Thread(target=flask_app.start, args=(flask_endpoints,))
-    flask.daemon = True
-    flask.start()
+    retention = None
+    if args.retention_days:
+        retention_meta = {
+            "raw_days": args.retention_days,
+            "archive_path": args.archive_dir,
+            "batch_size": args.retention_batch_size,
+            "interval": args.retention_interval,
+        }
+        retention = Retention(response_log, rollup, retention_meta)
+        retention.start()
+        trapper.add_handler(retention.stop)
 
-    while True:
-        if flask.is_alive():
-            sleep(1)
-        else:
-            break
+    if supervisor is not None:
+        logger.info("Starting %s poller workers", args.workers)
+        supervisor.start()
+    else:
+        poller = Poller(args, response_log, writer.put)
+
+        logger.info(
+            "Targeting %s targets every %ss",
+            len(poller.targets),
+            args.polling_frequency,
+        )
+
+        logger.info("Starting poller")
+        poller_thread = Thread(target=poller.start, daemon=True)
+        poller_thread.start()
+
+    if serving:
+        flask_meta = {
+            "name": app_metadata["name"],
+            "listen_ip": args.listen_ip,
+            "listen_port": args.listen_port,
+            "serving_mode": args.serving_mode,
+            "threads": args.web_threads,
+        }
+        flask_app = FlaskWrapper(
+            flask_meta,
+            response_log,
+            rollup,
+            dashboard_cache,
+            retention,
+            live_feed,
+            slo,
+            recent,
+        )
+
+        REGISTRY.gauge_callback(
+            "hostpoller_write_queue_depth",
+            "Records waiting for the batch writer",
+            writer.queue.qsize,
+        )
+        REGISTRY.gauge_callback(
+            "hostpoller_write_blocked_puts",
+            "Records that waited for space on a full write queue",
+            lambda: writer.stats["blocked_puts"],
+        )
+        REGISTRY.gauge_callback(
+            "hostpoller_write_rows_dropped",
+            "Records dropped with a batch that failed to write",
+            lambda: writer.stats["rows_dropped"],
+        )
+        if supervisor is not None:
+            supervisor_counters = supervisor.counters
+            REGISTRY.gauge_callback(
+                "hostpoller_workers_alive",
+                "Poller worker processes running",
+                lambda: supervisor_counters()["workers_alive"],
+            )
+        if dashboard_cache is not None:
+            cache_counters = dashboard_cache.counters
+            for counter, help_text in (
+                ("hits", "Dashboard lookups served from the cache"),
+                ("misses", "Dashboard lookups computed and stored in the cache"),
+                ("expirations", "Cache entries found past their time to live"),
+                ("evictions", "Cache entries evicted as least recently used"),
+                ("invalidations", "Cache entries dropped as their host was written"),
+                ("entries", "Entries held in the dashboard cache"),
+            ):
+                REGISTRY.gauge_callback(
+                    f"hostpoller_cache_{counter}",
+                    help_text,
+                    lambda counter=counter: cache_counters()[counter],
+                )
+        if live_feed is not None:
+            feed_counters = live_feed.counters
+            for counter, help_text in (
+                ("deltas_sent", "Coalesced live dashboard deltas sent"),
+                ("messages_queued", "Live dashboard messages queued to subscribers"),
+                ("subscribers_dropped", "Live dashboard streams dropped as too slow"),
+                ("subscribers", "Open live dashboard streams"),
+            ):
+                REGISTRY.gauge_callback(
+                    f"hostpoller_stream_{counter}",
+                    help_text,
+                    lambda counter=counter: feed_counters()[counter],
+                )
+
+        flask_endpoints = [
+            {
+                "path": "/",
+                "name": "doc_root",
+                "handler": flask_app.doc_root,
+                "methods": ["GET"],
+            },
+            {
+                "path": "/dashboard",
+                "name": "dashboard",
+                "handler": flask_app.dashboard_endpoint,
+                "methods": ["GET", "POST"],
+            },
+            {
+                "path": "/api/hosts",
+                "name": "hosts_api",
+                "handler": flask_app.hosts_endpoint,
+                "methods": ["GET"],
+            },
+            {
+                "path": "/api/response_log",
+                "name": "response_log_api",
+                "handler": flask_app.response_log_endpoint,
+                "methods": ["GET"],
+            },
+            {
+                "path": "/api/response_headers",
+                "name": "response_headers_api",
+                "handler": flask_app.response_headers_endpoint,
+                "methods": ["GET"],
+            },
+            {
+                "path": "/api/stream",
+                "name": "stream_api",
+                "handler": flask_app.stream_endpoint,
+                "methods": ["GET"],
+            },
+            {
+                "path": "/overview",
+                "name": "overview",
+                "handler": flask_app.overview_endpoint,
+                "methods": ["GET"],
+            },
+            {
+                "path": "/api/overview",
+                "name": "overview_api",
+                "handler": flask_app.overview_api_endpoint,
+                "methods": ["GET"],
+            },
+            {
+                "path": "/api/recent",
+                "name": "recent_api",
+                "handler": flask_app.recent_endpoint,
+                "methods": ["GET"],
+            },
+            {
+                "path": "/api/slo",
+                "name": "slo_api",
+                "handler": flask_app.slo_endpoint,
+                "methods": ["GET"],
+            },
+            {
+                "path": "/metrics",
+                "name": "metrics",
+                "handler": flask_app.metrics_endpoint,
+                "methods": ["GET"],
+            },
+        ]
+
+        logger.info("Starting flask")
+        flask = Thread(target=flask_app.start, args=(flask_endpoints,))
+        flask.daemon = True
+        flask.start()
+        running = flask.is_alive
+    elif supervisor is not None:
+        logger.info("Collecting without a web server until workers finish")
+        running = supervisor.running
+    else:
+        logger.info("Collecting without a web server until polling finishes")
+        running = poller_thread.is_alive
+
+    while running():
+        sleep(1)
+
+    if supervisor is not None:
+        supervisor.stop()
+    writer.stop()
+    rollup.flush()
+    if slo is not None:
+        slo.checkpoint()
+    if recent is not None:
+        recent.close()
+    if retention is not None:
+        retention.stop()
+    if live_feed is not None:
+        live_feed.stop()
@@ -0,0 +1,128 @@
+"""
+Per request timing of DNS lookup, TCP connect, TLS handshake, time to first byte and
+transfer from a monotonic nanosecond clock
+"""
+from contextvars import ContextVar
+from time import perf_counter_ns
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Optional
+
+import aiohttp
+
+
+class PhaseTimer:
+    """
+    Collect timestamps as a request passes each phase and derive phase durations
+
+    Marks in request order: start, dns_start, dns_end, connection_start, tcp_end,
+    connection_end, headers, done. A phase that was skipped, eg: connecting on a
+    reused connection, counts as 0 while one the request never reached is None
+    """
+
+    # Phase name, mark it starts from (falling back to the next one), mark it ends at
+    phases = (
+        ("dns", ("dns_start",), "dns_end"),
+        ("connect", ("dns_end", "connection_start"), "tcp_end"),
+        ("tls", ("tcp_end",), "connection_end"),
+        ("ttfb", ("connection_end", "start"), "headers"),
+        ("transfer", ("headers",), "done"),
+    )
+    # Set for the duration of a request, the connector has no request context
+    current: ContextVar[Optional["PhaseTimer"]] = ContextVar(
+        "phase_timer", default=None
+    )
+
+    def __init__(self, clock: Callable[[], int] = perf_counter_ns) -> None:
+        self.clock = clock
+        self.marks: Dict[str, int] = {}
+
+    def mark(self, name: str) -> None:
+        """
+        Record the time a request reached given mark, the first time only
+        """
+        self.marks.setdefault(name, self.clock())
+
+    def elapsed_us(self) -> int:
+        """
+        Microseconds from start to done, or to now for a request that failed
+        """
+        if "start" not in self.marks:
+            return 0
+        end = self.marks.get("done", self.clock())
+        return (end - self.marks["start"]) // 1000
+
+    def durations_us(self) -> Dict[str, Optional[int]]:
+        """
+        Return microseconds spent in each phase
+        """
+        end_marks = [end_mark for _, _, end_mark in self.phases]
+        durations: Dict[str, Optional[int]] = {}
+        for position, (phase, start_marks, end_mark) in enumerate(self.phases):
+            start_mark = next(
+                (mark for mark in start_marks if mark in self.marks), None
+            )
+            if start_mark is not None and end_mark in self.marks:
+                durations[phase] = (
+                    self.marks[end_mark] - self.marks[start_mark]
+                ) // 1000
+            elif any(mark in self.marks for mark in end_marks[position + 1 :]):
+                durations[phase] = 0
+            else:
+                durations[phase] = None
+        return durations
+
+
+class ProbeConnector(aiohttp.TCPConnector):
+    """
+    TCP connector marking when the TCP connection is up, client traces only report
+    the connection once any TLS handshake is done
+
+    The event loop calls the protocol factory once the socket is connected and
+    before it starts the handshake
+    """
+
+    async def _wrap_create_connection(self, *args: Any, **kwargs: Any) -> Any:
+        timer = PhaseTimer.current.get()
+        if timer is None or not args:
+            return await super()._wrap_create_connection(*args, **kwargs)
+        protocol_factory, *factory_args = args
+        secure = bool(kwargs.get("ssl"))
+
+        def timed_factory() -> Any:
+            timer.mark("tcp_end")
+            if not secure:
+                # Plain connections are ready here, there is no handshake to time
+                timer.mark("connection_end")
+            return protocol_factory()
+
+        return await super()._wrap_create_connection(
+            timed_factory, *factory_args, **kwargs
+        )
+
+
+def trace_config() -> aiohttp.TraceConfig:
+    """
+    Client trace hooks marking DNS, connection and response header phases on the
+    timer passed as trace_request_ctx
+    """
+
+    def marker(name: str) -> Callable:
+        async def on_signal(
+            _session: aiohttp.ClientSession,
+            trace_config_ctx: SimpleNamespace,
+            _params: Any,
+        ) -> None:
+            timer = trace_config_ctx.trace_request_ctx
+            if timer is not None:
+                timer.mark(name)
+
+        return on_signal
+
+    probe_trace = aiohttp.TraceConfig()
+    probe_trace.on_dns_resolvehost_start.append(marker("dns_start"))
+    probe_trace.on_dns_resolvehost_end.append(marker("dns_end"))
+    probe_trace.on_connection_create_start.append(marker("connection_start"))
+    probe_trace.on_connection_create_end.append(marker("connection_end"))
+    # Fired once the status line and headers have been read
+    probe_trace.on_request_end.append(marker("headers"))
+    return probe_trace
@@ -0,0 +1,209 @@
+"""
+Recent samples per host in memory mapped ring buffer files, so charts of the latest
+responses are read without a query and outlive restarts
+"""
+import logging
+import mmap
+import os
+import struct
+from threading import Lock
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+import numpy
+from responselog import ResponseLog
+from sqlalchemy import select
+
+# Epoch seconds, response code and microseconds elapsed, packed little endian
+SAMPLE_DTYPE = numpy.dtype(
+    [("response_date", "<i8"), ("response_code", "<i4"), ("time_elapsed", "<i4")]
+)
+# Magic and version, capacity, samples ever written, reserved
+HEADER = struct.Struct("<8sQQQ")
+MAGIC = b"HPRING01"
+ELAPSED_MAX = 2**31 - 1
+
+
+class SampleRing:
+    """
+    Fixed size ring of samples for one host mapped from a file, the header holds
+    the count of samples ever written so the newest is at count - 1 modulo slots
+
+    There is one writer, a sample is stored before the count is raised, readers
+    copy the slots they want out of the mapping and drop any the writer may have
+    overtaken while copying, a spare slot beyond capacity takes the sample being
+    written so a full ring can still be read whole
+    """
+
+    def __init__(self, path: str, capacity: int) -> None:
+        self.path = path
+        self.slots = capacity + 1
+        size = HEADER.size + self.slots * SAMPLE_DTYPE.itemsize
+        created = not os.path.exists(path) or os.path.getsize(path) != size
+        with open(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), "r+b") as ring_file:
+            if created:
+                # Also replaces a ring of another capacity or an unknown file
+                ring_file.truncate(0)
+                ring_file.truncate(size)
+                ring_file.seek(0)
+                ring_file.write(HEADER.pack(MAGIC, capacity, 0, 0))
+                ring_file.flush()
+            self.map = mmap.mmap(ring_file.fileno(), size)
+        magic, self.capacity, _, _ = HEADER.unpack_from(self.map)
+        if magic != MAGIC or self.capacity != capacity:
+            self.map.close()
+            raise ValueError(f"{path} is not a ring of {capacity} samples")
+        self.created = created
+        # Views onto the mapping, reads and writes go straight to the page cache
+        self.header = numpy.frombuffer(self.map, dtype="<u8", count=4)
+        self.samples = numpy.frombuffer(
+            self.map, dtype=SAMPLE_DTYPE, count=self.slots, offset=HEADER.size
+        )
+
+    def append(self, samples: List[tuple]) -> None:
+        """
+        Store (response_date, response_code, time_elapsed) samples oldest first
+        """
+        count = int(self.header[2])
+        for response_date, response_code, time_elapsed in samples:
+            self.samples[count % self.slots] = (
+                response_date,
+                response_code,
+                min(time_elapsed, ELAPSED_MAX),
+            )
+            count += 1
+            self.header[2] = count
+
+    def latest(self, limit: int) -> numpy.ndarray:
+        """
+        Up to limit newest samples, oldest first
+        """
+        count = int(self.header[2])
+        limit = max(0, min(limit, self.capacity))
+        first = max(0, count - limit)
+        start, end = first % self.slots, count % self.slots
+        if first == count:
+            samples = self.samples[:0].copy()
+        elif start < end:
+            samples = self.samples[start:end].copy()
+        else:
+            samples = numpy.concatenate((self.samples[start:], self.samples[:end]))
+        # Slots the writer reused while they were copied hold newer samples, the
+        # slot after the count may be mid write
+        overtaken = int(self.header[2]) + 1 - self.slots - first
+        return samples[max(0, overtaken) :]
+
+    def close(self) -> None:
+        """
+        Write the mapping back to its file and unmap it
+        """
+        self.map.flush()
+        del self.header, self.samples
+        self.map.close()
+
+
+class RecentStore:
+    """
+    Ring of the latest responses of each host in a directory of files, filled as
+    batches are written and seeded from the response log the first time a host's
+    ring is created
+    """
+
+    def __init__(self, table: ResponseLog, recent_meta: dict) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.response_log = table.response_log
+        self.squeal = table.engine
+        self.path = recent_meta["path"]
+        self.capacity = recent_meta["capacity"]
+        self.lock = Lock()
+        self.rings: Dict[str, SampleRing] = {}
+        os.makedirs(self.path, exist_ok=True)
+
+    def ring_path(self, host: str) -> str:
+        """
+        File of a host's ring, the name escaped so ports and addresses are safe
+        """
+        return os.path.join(self.path, f"{quote(host, safe='')}.ring")
+
+    def ring(self, host: str) -> Optional[SampleRing]:
+        """
+        Open ring of host, None when it has none
+        """
+        ring = self.rings.get(host)
+        if ring is not None or not os.path.exists(self.ring_path(host)):
+            return ring
+        return self.open_ring(host)
+
+    def open_ring(self, host: str) -> SampleRing:
+        """
+        Open ring of host, creating and seeding it when it has none
+        """
+        with self.lock:
+            ring = self.rings.get(host)
+            if ring is None:
+                ring = SampleRing(self.ring_path(host), self.capacity)
+                if ring.created:
+                    self.seed(host, ring)
+                self.rings[host] = ring
+        return ring
+
+    def seed(self, host: str, ring: SampleRing) -> None:
+        """
+        Fill a new ring with the latest rows of its host already written
+        """
+        response_log = self.response_log
+        seed_query = (
+            select(
+                response_log.c.response_date,
+                response_log.c.response_code,
+                response_log.c.time_elapsed,
+            )
+            .where(response_log.c.host == host)
+            .order_by(response_log.c.id.desc())
+            .limit(self.capacity)
+        )
+        with self.squeal.engine.connect() as connection:
+            rows = [tuple(row) for row in connection.execute(seed_query)]
+        ring.append(rows[::-1])
+        self.logger.info("Created recent samples of %s from %s rows", host, len(rows))
+
+    def add(self, records: List[dict]) -> None:
+        """
+        Writer listener, append a committed batch to the ring of each host
+        """
+        batch_hosts: Dict[str, List[tuple]] = {}
+        for record in records:
+            batch_hosts.setdefault(record["host"], []).append(
+                (
+                    record["response_date"],
+                    record["response_code"],
+                    record["time_elapsed"],
+                )
+            )
+        for host, samples in batch_hosts.items():
+            ring = self.rings.get(host)
+            if ring is None:
+                ring = self.open_ring(host)
+                if ring.created:
+                    # Seeded after the batch was committed, so it already holds it
+                    ring.created = False
+                    continue
+            ring.append(samples)
+
+    def latest(self, host: str, limit: int) -> Optional[numpy.ndarray]:
+        """
+        Up to limit newest samples of host oldest first, None without a ring
+        """
+        ring = self.ring(host)
+        if ring is None:
+            return None
+        return ring.latest(limit)
+
+    def close(self) -> None:
+        """
+        Flush and unmap every ring
+        """
+        with self.lock:
+            for ring in self.rings.values():
+                ring.close()
+            self.rings = {}
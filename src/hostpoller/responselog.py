@@ -0,0 +1,71 @@
+"""
+Module defining the response log schema on top of the SQLAlchemy wrapper
+"""
+from typing import Dict, Optional
+
+from headerstore import HeaderStore
+from hostregistry import HostRegistry
+from migrations import Migrator
+from sqlalchemy import Column, Index, Integer, String, Table
+from squeal import Squeal
+
+
+class ResponseLog:  # pylint: disable=too-few-public-methods
+    """
+    Initialize table and provide interface to SQLAlchemy wrapper
+
+    response_date is an integer unix epoch in seconds, time_elapsed and the time_*
+    phase columns integer counts of microseconds, NULL for phases a failed request
+    never reached, breaker_state the host circuit breaker after the response in
+    adaptive polling mode, response_headers and response_cookies reference sets in
+    the header store, on backends that partition the table response_date is the
+    partition key and so part of the primary key
+    """
+
+    def __init__(
+        self,
+        engine_type: str,
+        engine_uri: str,
+        reader_pool_size: int = 8,
+        pragmas: Optional[Dict[str, str]] = None,
+    ) -> None:
+        squeal_engine = {
+            "type": f"{engine_type}",
+            "file_path": engine_uri,
+            "reader_pool_size": reader_pool_size,
+            "pragmas": pragmas,
+        }
+        self.engine = Squeal(squeal_engine)
+        Migrator(self.engine).upgrade()
+        self.meta_data = self.engine.meta_data
+        partition_by = self.engine.backend.partition_by("response_date")
+        self.response_log = Table(
+            "response_log",
+            self.meta_data,
+            Column("id", Integer, primary_key=True, autoincrement=True),
+            Column("response_date", Integer, primary_key=bool(partition_by)),
+            Column("protocol", String),
+            Column("host", String),
+            Column("request_path", String),
+            Column("response_code", Integer),
+            Column("response_reason", String),
+            Column("response_cookies", String),
+            Column("response_headers", String),
+            Column("time_elapsed", Integer),
+            Column("time_dns", Integer),
+            Column("time_connect", Integer),
+            Column("time_tls", Integer),
+            Column("time_ttfb", Integer),
+            Column("time_transfer", Integer),
+            Column("breaker_state", String),
+            Index("ix_response_log_host_date", "host", "response_date"),
+            Index("ix_response_log_host_id", "host", "id"),
+            Index("ix_response_log_date", "response_date"),
+            extend_existing=True,
+            **partition_by,
+        )
+        self.access_log_meta = self.engine.meta_data.tables["response_log"]
+        self.host_registry = HostRegistry(self.engine)
+        self.header_store = HeaderStore(self.engine)
+        self.meta_data.create_all(self.engine.engine)
+        self.host_registry.load()
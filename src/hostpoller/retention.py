@@ -0,0 +1,420 @@
+"""
+Retention of the response log, expired rows are folded into aggregates, archived to
+Parquet and deleted in small batches on a background thread
+"""
+import importlib.util
+import logging
+import os
+from datetime import datetime
+from threading import Event, Thread
+from time import perf_counter, time
+from typing import Any, Dict, List, Optional, Tuple
+
+from responselog import ResponseLog
+from rollup import Rollup
+from sqlalchemy import Column, Integer, String, Table, delete, func, select
+
+
+class ResponseArchive:
+    """
+    Compressed columnar archive of expired response log rows, one directory of
+    Parquet files per UTC day so reads can walk days newest first
+    """
+
+    columns = [
+        "id",
+        "response_date",
+        "protocol",
+        "host",
+        "request_path",
+        "response_code",
+        "response_reason",
+        "response_cookies",
+        "response_headers",
+        "time_elapsed",
+    ]
+    # Written alongside columns, files archived before phases were measured lack them
+    phase_columns = [
+        "time_dns",
+        "time_connect",
+        "time_tls",
+        "time_ttfb",
+        "time_transfer",
+    ]
+    # Likewise for files archived before breaker state was recorded
+    state_columns = ["breaker_state"]
+
+    def __init__(self, archive_meta: dict) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.path = archive_meta["path"]
+        self.compression = archive_meta.get("compression", "zstd")
+        if importlib.util.find_spec("pyarrow") is None:
+            self.logger.error("Archiving requires pyarrow, install the archive extra")
+            raise SystemExit
+        os.makedirs(self.path, exist_ok=True)
+
+    def day_path(self, day_start: int) -> str:
+        """
+        Directory holding the archive for the day starting at given epoch
+        """
+        return os.path.join(
+            self.path, f"date={datetime.utcfromtimestamp(day_start):%Y-%m-%d}"
+        )
+
+    def days(self) -> List[int]:
+        """
+        Return start epoch of every archived day, newest first
+        """
+        days = []
+        for entry in os.scandir(self.path):
+            if entry.is_dir() and entry.name.startswith("date="):
+                day = datetime.strptime(entry.name[5:], "%Y-%m-%d")
+                days.append(int((day - datetime(1970, 1, 1)).total_seconds()))
+        return sorted(days, reverse=True)
+
+    def parts(self, day_start: int) -> List[str]:
+        """
+        Return names of the finished files of a day, lowest id first
+        """
+        directory = self.day_path(day_start)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(
+            entry.name
+            for entry in os.scandir(directory)
+            if entry.name.startswith("part-") and entry.name.endswith(".parquet")
+        )
+
+    def schema(self, day_start: int) -> Any:
+        """
+        Schema covering every file of a day, state columns missing from files
+        archived before they were recorded are read as NULL
+        """
+        # pylint: disable=import-outside-toplevel
+        import pyarrow
+        import pyarrow.parquet
+
+        directory = self.day_path(day_start)
+        schema = pyarrow.unify_schemas(
+            [
+                pyarrow.parquet.read_schema(os.path.join(directory, name))
+                for name in self.parts(day_start)
+            ]
+        )
+        for column in self.state_columns:
+            if column not in schema.names:
+                schema = schema.append(pyarrow.field(column, pyarrow.string()))
+        return schema
+
+    def store(self, day_start: int, frame: Any) -> str:
+        """
+        Write the rows of one day to a file named after its lowest id, returns the
+        file name
+        """
+        directory = self.day_path(day_start)
+        os.makedirs(directory, exist_ok=True)
+        # Nullable types so a batch of only NULLs keeps the same file schema
+        frame = frame.reindex(
+            columns=self.columns + self.phase_columns + self.state_columns
+        )
+        frame[self.phase_columns] = frame[self.phase_columns].astype("Int64")
+        frame[self.state_columns] = frame[self.state_columns].astype("string")
+        name = f"part-{frame['id'].min():012d}.parquet"
+        # Readers skip dot files, the rename makes the finished file visible
+        partial = os.path.join(directory, f".{name}.tmp")
+        frame.sort_values(["host", "id"]).to_parquet(
+            partial, engine="pyarrow", compression=self.compression, index=False
+        )
+        os.replace(partial, os.path.join(directory, name))
+        return name
+
+    def write(self, rows: List[dict]) -> int:
+        """
+        Write rows to one file per day named after its lowest id, so archiving the
+        same batch again after a crash replaces the file instead of duplicating it
+        """
+        import pandas  # pylint: disable=import-outside-toplevel
+
+        frame = pandas.DataFrame(
+            rows, columns=self.columns + self.phase_columns + self.state_columns
+        )
+        day_starts = frame["response_date"] - frame["response_date"] % 86400
+        files = 0
+        for day_start, day_frame in frame.groupby(day_starts):
+            self.store(int(day_start), day_frame)
+            files += 1
+        return files
+
+    def compact(self, day_start: int) -> int:
+        """
+        Merge the files of a day into one named after its lowest id, so a day that
+        is no longer written to is read from a single file, returns files removed
+        """
+        import pandas  # pylint: disable=import-outside-toplevel
+
+        parts = self.parts(day_start)
+        if len(parts) < 2:
+            return 0
+        directory = self.day_path(day_start)
+        frame = pandas.concat(
+            [
+                pandas.read_parquet(os.path.join(directory, name), engine="pyarrow")
+                for name in parts
+            ],
+            ignore_index=True,
+        )
+        # A crash after the merged file replaced the lowest one leaves the others
+        # behind, merging again drops the rows they share with it
+        frame = frame.drop_duplicates("id")
+        merged = self.store(day_start, frame)
+        for name in parts:
+            if name != merged:
+                os.remove(os.path.join(directory, name))
+        self.logger.info(
+            "Compacted %s archive files of %s", len(parts), os.path.basename(directory)
+        )
+        return len(parts) - 1
+
+    def page(
+        self,
+        host: str,
+        limit: int,
+        filters: List[Tuple],
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+    ) -> List[dict]:
+        """
+        Return up to limit archived rows for host matching filters, newest first,
+        reading one day at a time until the page is full
+        """
+        import pandas  # pylint: disable=import-outside-toplevel
+
+        rows: List[dict] = []
+        for day_start in self.days():
+            if until is not None and day_start >= until:
+                continue
+            if since is not None and day_start + 86400 <= since:
+                break
+            frame = pandas.read_parquet(
+                self.day_path(day_start),
+                engine="pyarrow",
+                columns=self.columns + self.state_columns,
+                filters=[("host", "==", host)] + filters,
+                schema=self.schema(day_start),
+            )
+            frame = frame.sort_values("id", ascending=False).head(limit - len(rows))
+            rows.extend(frame.to_dict("records"))
+            if len(rows) >= limit:
+                break
+        return rows
+
+
+class Retention:
+    """
+    Keep raw response log rows for a number of days, older rows are counted into
+    hourly status aggregates, archived when an archive is configured and deleted in
+    batches so no transaction holds the write lock for long
+    """
+
+    def __init__(
+        self,
+        table: ResponseLog,
+        rollup: Optional[Rollup],
+        retention_meta: dict,
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.table = table
+        self.squeal = table.engine
+        self.rollup = rollup
+        self.raw_seconds = int(retention_meta["raw_days"] * 86400)
+        self.batch_size = retention_meta["batch_size"]
+        self.interval = retention_meta["interval"]
+        self.archive: Optional[ResponseArchive] = None
+        if retention_meta.get("archive_path"):
+            self.archive = ResponseArchive({"path": retention_meta["archive_path"]})
+        self.status_rollup = Table(
+            "status_rollup",
+            self.squeal.meta_data,
+            Column("host", String, primary_key=True),
+            Column("bucket_start", Integer, primary_key=True),
+            Column("response_code", Integer, primary_key=True),
+            Column("count", Integer),
+            extend_existing=True,
+        )
+        self.squeal.meta_data.create_all(
+            self.squeal.engine, tables=[self.status_rollup]
+        )
+        self.stop_event = Event()
+        self.stats: Dict[str, float] = {
+            "runs": 0,
+            "rows_expired": 0,
+            "files_written": 0,
+            "files_compacted": 0,
+            "rollups_compacted": 0,
+            "batch_seconds_last": 0.0,
+            "batch_seconds_max": 0.0,
+        }
+        self.thread = Thread(target=self.run, name="retention", daemon=True)
+
+    def start(self) -> None:
+        """
+        Start background retention thread
+        """
+        self.logger.info(
+            "Starting retention, raw rows kept %ss, archive: %s",
+            self.raw_seconds,
+            self.archive.path if self.archive else None,
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop after the batch in progress and wait for the thread to exit
+        """
+        if not self.thread.is_alive():
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.logger.info("Retention stopped: %s", self.counters())
+
+    def counters(self) -> Dict[str, float]:
+        """
+        Return retention counters
+        """
+        return dict(self.stats)
+
+    def run(self) -> None:
+        """
+        Expire rows every interval until stopped
+        """
+        while True:
+            try:
+                self.expire(int(time()) - self.raw_seconds)
+            except Exception as err:  # pylint: disable=broad-except
+                self.logger.error("Retention run failed: %s", err)
+            if self.stop_event.wait(self.interval):
+                return
+
+    def expire(self, cutoff: int) -> int:
+        """
+        Expire every raw row older than cutoff one batch at a time, then compact minute
+        rollups that have aged out and the archive files of fully expired days,
+        returns rows expired
+        """
+        self.stats["runs"] += 1
+        expired = 0
+        while not self.stop_event.is_set():
+            time_start = perf_counter()
+            batch = self.expire_batch(cutoff)
+            if not batch:
+                break
+            expired += batch
+            batch_seconds = perf_counter() - time_start
+            self.stats["batch_seconds_last"] = batch_seconds
+            self.stats["batch_seconds_max"] = max(
+                self.stats["batch_seconds_max"], batch_seconds
+            )
+
+        if self.rollup is not None:
+            # Minute rollups back ranges up to a day, hour rollups are kept for good
+            minute_cutoff = min(cutoff, cutoff + self.raw_seconds - 86400)
+            stored = self.rollup.response_rollup.c
+            with self.squeal.engine.begin() as connection:
+                compacted = connection.execute(
+                    delete(self.rollup.response_rollup).where(
+                        stored.resolution == self.rollup.resolutions["minute"],
+                        stored.bucket_start < minute_cutoff,
+                    )
+                ).rowcount
+            self.stats["rollups_compacted"] += compacted
+        if self.archive is not None and not self.stop_event.is_set():
+            # Days that ended before the cutoff get no more rows
+            for day_start in self.archive.days():
+                if day_start + 86400 <= cutoff:
+                    self.stats["files_compacted"] += self.archive.compact(day_start)
+        if expired:
+            self.logger.info("Expired %s rows older than %s", expired, cutoff)
+        return expired
+
+    def expire_batch(self, cutoff: int) -> int:
+        """
+        Archive, aggregate and delete the oldest batch of expired rows, returns the
+        number of rows expired
+        """
+        response_log = self.table.response_log
+        with self.squeal.engine.connect() as connection:
+            rows = [
+                row._asdict()
+                for row in connection.execute(
+                    select(response_log)
+                    .where(response_log.c.response_date < cutoff)
+                    .order_by(response_log.c.id)
+                    .limit(self.batch_size)
+                )
+            ]
+        if not rows:
+            return 0
+
+        # Written before the delete commits, a crash in between archives it again
+        if self.archive is not None:
+            self.stats["files_written"] += self.archive.write(rows)
+
+        status_counts: Dict[Tuple[str, int, int], int] = {}
+        for row in rows:
+            key = (
+                row["host"],
+                row["response_date"] - row["response_date"] % 3600,
+                row["response_code"],
+            )
+            status_counts[key] = status_counts.get(key, 0) + 1
+        statement = self.squeal.upsert(self.status_rollup)
+        statement = statement.on_conflict_do_update(
+            index_elements=["host", "bucket_start", "response_code"],
+            set_={"count": self.status_rollup.c["count"] + statement.excluded["count"]},
+        )
+
+        # The oldest expired rows by id are exactly the expired rows up to the last id
+        with self.squeal.engine.begin() as connection:
+            connection.execute(
+                statement,
+                [
+                    {
+                        "host": host,
+                        "bucket_start": bucket_start,
+                        "response_code": response_code,
+                        "count": count,
+                    }
+                    for (
+                        host,
+                        bucket_start,
+                        response_code,
+                    ), count in status_counts.items()
+                ],
+            )
+            connection.execute(
+                delete(response_log).where(
+                    response_log.c.id <= rows[-1]["id"],
+                    response_log.c.response_date < cutoff,
+                )
+            )
+        self.stats["rows_expired"] += len(rows)
+        return len(rows)
+
+    def status_counts(self, host: str, since: int = 0) -> List[Tuple[int, int]]:
+        """
+        Return (response_code, count) of expired rows for host since given epoch, the
+        hour holding since is counted whole
+        """
+        stored = self.status_rollup.c
+        with self.squeal.reader_engine.connect() as connection:
+            return [
+                (response_code, count)
+                for response_code, count in connection.execute(
+                    select(stored.response_code, func.sum(stored["count"]))
+                    .where(
+                        stored.host == host,
+                        stored.bucket_start >= since - since % 3600,
+                    )
+                    .group_by(stored.response_code)
+                )
+            ]
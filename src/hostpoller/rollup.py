@@ -0,0 +1,245 @@
+"""
+Per host latency rollups at minute and hour resolution maintained as rows are written
+"""
+import logging
+import math
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Column, Integer, String, Table, case, select
+from squeal import Squeal
+
+
+class LatencyHistogram:
+    """
+    Log scale histogram of latencies in microseconds, percentiles are accurate to
+    within the bin precision and memory is bounded by the number of occupied bins
+    """
+
+    precision = 0.02
+
+    def __init__(self) -> None:
+        self.bins: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+
+    def add(self, value: int) -> None:
+        """
+        Count a single latency
+        """
+        value_bin = 0 if value < 1 else int(math.log(value, 1 + self.precision)) + 1
+        self.bins[value_bin] = self.bins.get(value_bin, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, fraction: float) -> Optional[int]:
+        """
+        Return latency at given fraction of samples, midpoint of the matching bin
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for value_bin in sorted(self.bins):
+            seen += self.bins[value_bin]
+            if seen < rank:
+                continue
+            if value_bin == 0:
+                return 0
+            bin_start = (1 + self.precision) ** (value_bin - 1)
+            midpoint = int(bin_start * (1 + self.precision / 2))
+            return max(self.min or 0, min(self.max or 0, midpoint))
+        return self.max
+
+    def summary(self) -> Dict[str, Optional[int]]:
+        """
+        Return count, min, max, mean and percentiles
+        """
+        return {
+            "count": self.count,
+            "min_us": self.min,
+            "max_us": self.max,
+            "mean_us": self.total // self.count if self.count else None,
+            "p50_us": self.percentile(0.50),
+            "p95_us": self.percentile(0.95),
+            "p99_us": self.percentile(0.99),
+        }
+
+
+class Rollup:
+    """
+    Maintain per host latency buckets as batches are written and persist each bucket
+    to the response_rollup table once it closes
+    """
+
+    resolutions = {"minute": 60, "hour": 3600}
+
+    def __init__(self, squeal: Squeal) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.squeal = squeal
+        self.response_rollup = Table(
+            "response_rollup",
+            self.squeal.meta_data,
+            Column("host", String, primary_key=True),
+            Column("resolution", Integer, primary_key=True),
+            Column("bucket_start", Integer, primary_key=True),
+            Column("count", Integer),
+            Column("min_us", Integer),
+            Column("max_us", Integer),
+            Column("mean_us", Integer),
+            Column("p50_us", Integer),
+            Column("p95_us", Integer),
+            Column("p99_us", Integer),
+            extend_existing=True,
+        )
+        self.squeal.meta_data.create_all(
+            self.squeal.engine, tables=[self.response_rollup]
+        )
+        self.lock = Lock()
+        self.open_buckets: Dict[Tuple[str, int, int], LatencyHistogram] = {}
+
+    def add(self, records: List[dict]) -> None:
+        """
+        Fold written records into open buckets, closing buckets that have ended
+        """
+        latest = 0
+        with self.lock:
+            for record in records:
+                latest = max(latest, record["response_date"])
+                if record["response_code"] < 100:
+                    # Invocation errors have no response latency
+                    continue
+                for size in self.resolutions.values():
+                    bucket_start = (
+                        record["response_date"] - record["response_date"] % size
+                    )
+                    key = (record["host"], size, bucket_start)
+                    if key not in self.open_buckets:
+                        self.open_buckets[key] = LatencyHistogram()
+                    self.open_buckets[key].add(record["time_elapsed"])
+
+            # A bucket is closed once a full bucket width has passed since it ended
+            closed = [key for key in self.open_buckets if key[2] + 2 * key[1] <= latest]
+            closed_rows = [
+                self.bucket_row(key, self.open_buckets.pop(key)) for key in closed
+            ]
+        self.persist(closed_rows)
+
+    def flush(self) -> None:
+        """
+        Persist every open bucket, used on shutdown
+        """
+        with self.lock:
+            closed_rows = [
+                self.bucket_row(key, histogram)
+                for key, histogram in self.open_buckets.items()
+            ]
+            self.open_buckets.clear()
+        self.persist(closed_rows)
+
+    def bucket_row(
+        self, key: Tuple[str, int, int], histogram: LatencyHistogram
+    ) -> dict:
+        """
+        Build response_rollup row for bucket
+        """
+        host, size, bucket_start = key
+        row = {"host": host, "resolution": size, "bucket_start": bucket_start}
+        row.update(histogram.summary())
+        return row
+
+    def persist(self, rows: List[dict]) -> None:
+        """
+        Upsert closed buckets, a bucket written again after a restart is merged with
+        the stored one keeping the percentiles of whichever holds more samples
+        """
+        if not rows:
+            return
+        statement = self.squeal.upsert(self.response_rollup)
+        stored = self.response_rollup.c
+        larger = statement.excluded["count"] > stored["count"]
+        statement = statement.on_conflict_do_update(
+            index_elements=["host", "resolution", "bucket_start"],
+            set_={
+                "count": stored["count"] + statement.excluded["count"],
+                "min_us": self.squeal.least(stored.min_us, statement.excluded.min_us),
+                "max_us": self.squeal.greatest(
+                    stored.max_us, statement.excluded.max_us
+                ),
+                "mean_us": (
+                    stored.mean_us * stored["count"]
+                    + statement.excluded.mean_us * statement.excluded["count"]
+                )
+                / (stored["count"] + statement.excluded["count"]),
+                "p50_us": case(
+                    (larger, statement.excluded.p50_us), else_=stored.p50_us
+                ),
+                "p95_us": case(
+                    (larger, statement.excluded.p95_us), else_=stored.p95_us
+                ),
+                "p99_us": case(
+                    (larger, statement.excluded.p99_us), else_=stored.p99_us
+                ),
+            },
+        )
+        with self.squeal.engine.begin() as connection:
+            connection.execute(statement, rows)
+        self.logger.debug("Persisted %s rollup buckets", len(rows))
+
+    def series(self, host: str, resolution: str, since: int) -> List[dict]:
+        """
+        Return buckets for host since given epoch, stored and still open, oldest first
+        """
+        size = self.resolutions[resolution]
+        stored = self.response_rollup.c
+        with self.squeal.reader_engine.connect() as connection:
+            rows = {
+                row.bucket_start: row._asdict()
+                for row in connection.execute(
+                    select(self.response_rollup)
+                    .where(
+                        stored.host == host,
+                        stored.resolution == size,
+                        stored.bucket_start >= since - since % size,
+                    )
+                    .order_by(stored.bucket_start)
+                )
+            }
+        with self.lock:
+            for (open_host, open_size, bucket_start), histogram in list(
+                self.open_buckets.items()
+            ):
+                if open_host == host and open_size == size and bucket_start >= since:
+                    row = self.bucket_row(
+                        (open_host, open_size, bucket_start), histogram
+                    )
+                    if bucket_start in rows:
+                        # Flushed on shutdown and reopened after a restart
+                        row = self.merge_rows(rows[bucket_start], row)
+                    rows[bucket_start] = row
+        return [rows[bucket_start] for bucket_start in sorted(rows)]
+
+    @staticmethod
+    def merge_rows(stored_row: dict, open_row: dict) -> dict:
+        """
+        Combine a stored and an open row of the same bucket the way persist does,
+        percentiles are taken from whichever holds more samples
+        """
+        if not stored_row["count"]:
+            return open_row
+        if not open_row["count"]:
+            return stored_row
+        count = stored_row["count"] + open_row["count"]
+        row = dict(open_row if open_row["count"] > stored_row["count"] else stored_row)
+        row["count"] = count
+        row["min_us"] = min(stored_row["min_us"], open_row["min_us"])
+        row["max_us"] = max(stored_row["max_us"], open_row["max_us"])
+        row["mean_us"] = (
+            stored_row["mean_us"] * stored_row["count"]
+            + open_row["mean_us"] * open_row["count"]
+        ) // count
+        return row
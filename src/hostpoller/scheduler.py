@@ -0,0 +1,89 @@
+"""
+Interface to schedule polling on fixed deadlines from a monotonic clock
+"""
+import logging
+import random
+from time import monotonic
+from typing import Callable, Dict, Optional
+
+
+class Scheduler:
+    """
+    Compute fixed polling deadlines for a target and account for missed ticks
+    """
+
+    def __init__(
+        self, schedule_meta: dict, clock: Callable[[], float] = monotonic
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.name = schedule_meta["name"]
+        self.clock = clock
+        self.period = schedule_meta["polling_frequency"]
+        self.jitter = schedule_meta["jitter"] * self.period
+        time_start = self.clock()
+        # Spread the first tick of each target over the jitter window
+        self.origin = time_start + random.uniform(0, self.jitter)
+        if schedule_meta["monitor_period"] == 0:
+            self.time_stop = None
+        else:
+            self.time_stop = time_start + schedule_meta["monitor_period"]
+        self.tick = 0
+        self.deadline = self.origin
+        self.stats: Dict[str, float] = {
+            "ticks": 0,
+            "skipped": 0,
+            "overruns": 0,
+            "lag_seconds_last": 0.0,
+            "lag_seconds_max": 0.0,
+        }
+
+    def grid(self, tick: int) -> float:
+        """
+        Deadline of given tick before jitter
+        """
+        return self.origin + tick * self.period
+
+    def next_delay(self) -> Optional[float]:
+        """
+        Advance to the next deadline and return seconds to wait for it, None once
+        the deadline falls outside the monitor period
+        """
+        now = self.clock()
+        if self.tick and now > self.grid(self.tick):
+            # Previous tick ran past this deadline, skip to the next one ahead
+            missed = int((now - self.grid(self.tick)) // self.period) + 1
+            self.stats["overruns"] += 1
+            self.stats["skipped"] += missed
+            self.tick += missed
+            self.logger.debug("%s overran, skipped %s ticks", self.name, missed)
+
+        self.deadline = self.grid(self.tick)
+        if self.tick and self.jitter:
+            self.deadline += random.uniform(-self.jitter / 2, self.jitter / 2)
+        if self.time_stop is not None and self.deadline >= self.time_stop:
+            return None
+
+        self.tick += 1
+        return max(0.0, self.deadline - now)
+
+    def retune(self, period: float) -> None:
+        """
+        Poll every period counting from the current deadline, eg: faster for a while
+        after a host changes state
+        """
+        if period == self.period:
+            return
+        self.jitter = self.jitter * period / self.period
+        self.period = period
+        self.origin = self.deadline
+        self.tick = 1
+
+    def fired(self) -> float:
+        """
+        Record and return how late the current tick fired against its deadline
+        """
+        lag = max(0.0, self.clock() - self.deadline)
+        self.stats["ticks"] += 1
+        self.stats["lag_seconds_last"] = lag
+        self.stats["lag_seconds_max"] = max(self.stats["lag_seconds_max"], lag)
+        return lag
@@ -0,0 +1,330 @@
+"""
+Sliding window availability and error budget per host, updated as batches are written
+and checkpointed to the database so a restart only replays rows written since
+"""
+import json
+import logging
+from threading import Lock
+from time import monotonic, time
+from typing import Dict, List, Optional, Tuple
+
+from responselog import ResponseLog
+from sqlalchemy import Column, Integer, String, Table, and_, case, func, select
+
+WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_window(window: str) -> int:
+    """
+    Seconds in a window written as a count and unit, eg: 5m, 24h, 30d
+    """
+    return int(window[:-1]) * WINDOW_UNITS[window[-1]]
+
+
+class SlidingWindow:
+    """
+    Request and good response counts over the last size buckets, a ring of per bucket
+    counts with running totals so updates and reads cost the same at any window size
+    """
+
+    __slots__ = ("bucket_seconds", "size", "head", "totals", "goods", "total", "good")
+
+    def __init__(self, bucket_seconds: int, size: int) -> None:
+        self.bucket_seconds = bucket_seconds
+        self.size = size
+        # Index of the newest bucket, epoch seconds // bucket_seconds
+        self.head = 0
+        self.totals = [0] * size
+        self.goods = [0] * size
+        self.total = 0
+        self.good = 0
+
+    def advance(self, index: int) -> None:
+        """
+        Move the newest bucket up to index, dropping buckets that slide out
+        """
+        for bucket in range(self.head + 1, min(index, self.head + self.size) + 1):
+            slot = bucket % self.size
+            self.total -= self.totals[slot]
+            self.good -= self.goods[slot]
+            self.totals[slot] = 0
+            self.goods[slot] = 0
+        self.head = max(self.head, index)
+
+    def add(self, index: int, total: int, good: int) -> None:
+        """
+        Count responses into the bucket at index, ignored once it has slid out
+        """
+        if index > self.head:
+            self.advance(index)
+        elif index <= self.head - self.size:
+            return
+        slot = index % self.size
+        self.totals[slot] += total
+        self.goods[slot] += good
+        self.total += total
+        self.good += good
+
+    def counts(self, now: float) -> Tuple[int, int]:
+        """
+        Requests and good responses in the window ending now
+        """
+        self.advance(int(now) // self.bucket_seconds)
+        return self.total, self.good
+
+    def state(self) -> dict:
+        """
+        Non empty buckets for a checkpoint
+        """
+        return {
+            "head": self.head,
+            "buckets": [
+                [
+                    bucket,
+                    self.totals[bucket % self.size],
+                    self.goods[bucket % self.size],
+                ]
+                for bucket in range(self.head - self.size + 1, self.head + 1)
+                if self.totals[bucket % self.size]
+            ],
+        }
+
+    def restore(self, state: dict) -> None:
+        """
+        Load buckets saved by state
+        """
+        self.head = state["head"]
+        for bucket, total, good in state["buckets"]:
+            self.add(bucket, total, good)
+
+
+class SloTracker:
+    """
+    Availability over several sliding windows per host against an objective, a
+    response is good when the host answered without a server error
+
+    Burn rate is the error rate of a window over the error budget, at 1 the budget
+    lasts exactly as long as the longest window
+    """
+
+    # Response codes counted as the host being available, lower bound inclusive
+    good_codes = (100, 500)
+
+    def __init__(self, table: ResponseLog, slo_meta: dict) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.response_log = table.response_log
+        self.squeal = table.engine
+        self.objective = slo_meta["objective"]
+        self.buckets = slo_meta["buckets"]
+        self.checkpoint_interval = slo_meta["checkpoint_interval"]
+        # Shortest first, the error budget is accounted over the longest
+        self.windows = sorted(
+            ((window, parse_window(window)) for window in slo_meta["windows"]),
+            key=lambda window: window[1],
+        )
+        self.lock = Lock()
+        self.hosts: Dict[str, Dict[str, SlidingWindow]] = {}
+        self.checkpoint_due = monotonic() + self.checkpoint_interval
+        self.slo_checkpoint = Table(
+            "slo_checkpoint",
+            self.squeal.meta_data,
+            Column("name", String, primary_key=True),
+            Column("last_id", Integer),
+            Column("saved_at", Integer),
+            Column("state", String),
+            extend_existing=True,
+        )
+        self.squeal.meta_data.create_all(
+            self.squeal.engine, tables=[self.slo_checkpoint]
+        )
+
+    def host_windows(self, host: str) -> Dict[str, SlidingWindow]:
+        """
+        Windows of a host, created on first sight, lock held by caller
+        """
+        windows = self.hosts.get(host)
+        if windows is None:
+            windows = self.hosts[host] = {
+                name: SlidingWindow(max(1, seconds // self.buckets), self.buckets)
+                for name, seconds in self.windows
+            }
+        return windows
+
+    def is_good(self, response_code: int) -> bool:
+        """
+        Whether a response counts towards availability
+        """
+        return self.good_codes[0] <= response_code < self.good_codes[1]
+
+    def add(self, records: List[dict]) -> None:
+        """
+        Writer listener, count a committed batch into every window of its hosts
+        """
+        with self.lock:
+            for record in records:
+                good = int(self.is_good(record["response_code"]))
+                for window in self.host_windows(record["host"]).values():
+                    window.add(
+                        record["response_date"] // window.bucket_seconds, 1, good
+                    )
+        # On the writer thread every committed row has been counted
+        if monotonic() >= self.checkpoint_due:
+            self.checkpoint()
+
+    def load(self) -> None:
+        """
+        Restore the last checkpoint and count rows written after it, without one
+        every window is rebuilt from the response log
+        """
+        with self.squeal.engine.connect() as connection:
+            saved = connection.execute(
+                select(self.slo_checkpoint).where(
+                    self.slo_checkpoint.c.name == "response_log"
+                )
+            ).first()
+        last_id = 0
+        restored = set()
+        if saved is not None:
+            state = json.loads(saved.state)
+            last_id = saved.last_id
+            with self.lock:
+                for host, windows in state["hosts"].items():
+                    for name, window in self.host_windows(host).items():
+                        saved_window = windows.get(name)
+                        # Windows resized since the checkpoint are rebuilt
+                        if saved_window and saved_window["bucket_seconds"] == (
+                            window.bucket_seconds
+                        ):
+                            window.restore(saved_window)
+                            restored.add(name)
+        for name, seconds in self.windows:
+            self.replay(name, seconds, last_id if name in restored else 0)
+        self.logger.info(
+            "Loaded SLO windows for %s hosts, replayed rows after id %s",
+            len(self.hosts),
+            last_id,
+        )
+
+    def replay(self, name: str, seconds: int, after_id: int) -> None:
+        """
+        Count response log rows after an id into one window with a grouped query
+        """
+        response_log = self.response_log
+        bucket_seconds = max(1, seconds // self.buckets)
+        bucket_start = (
+            response_log.c.response_date - response_log.c.response_date % bucket_seconds
+        ).label("bucket_start")
+        good = case(
+            (
+                and_(
+                    response_log.c.response_code >= self.good_codes[0],
+                    response_log.c.response_code < self.good_codes[1],
+                ),
+                1,
+            ),
+            else_=0,
+        )
+        query = (
+            select(
+                response_log.c.host,
+                bucket_start,
+                func.count().label("total"),
+                func.sum(good).label("good"),
+            )
+            .where(
+                response_log.c.id > after_id,
+                response_log.c.response_date >= int(time()) - seconds,
+            )
+            .group_by(response_log.c.host, bucket_start)
+        )
+        with self.squeal.reader_engine.connect() as connection:
+            rows = connection.execute(query).all()
+        with self.lock:
+            for row in rows:
+                self.host_windows(row.host)[name].add(
+                    row.bucket_start // bucket_seconds, row.total, row.good
+                )
+
+    def checkpoint(self) -> None:
+        """
+        Save every window with the newest response log id they include
+        """
+        response_log = self.response_log
+        with self.squeal.engine.connect() as connection:
+            last_id = connection.execute(select(func.max(response_log.c.id))).scalar()
+        with self.lock:
+            state = {
+                "hosts": {
+                    host: {
+                        name: {
+                            "bucket_seconds": window.bucket_seconds,
+                            **window.state(),
+                        }
+                        for name, window in windows.items()
+                    }
+                    for host, windows in self.hosts.items()
+                }
+            }
+            self.checkpoint_due = monotonic() + self.checkpoint_interval
+        row = {
+            "name": "response_log",
+            "last_id": last_id or 0,
+            "saved_at": int(time()),
+            "state": json.dumps(state, separators=(",", ":")),
+        }
+        statement = self.squeal.upsert(self.slo_checkpoint)
+        statement = statement.on_conflict_do_update(
+            index_elements=["name"],
+            set_={
+                "last_id": statement.excluded.last_id,
+                "saved_at": statement.excluded.saved_at,
+                "state": statement.excluded.state,
+            },
+        )
+        with self.squeal.engine.begin() as connection:
+            connection.execute(statement, row)
+        self.logger.debug("Saved SLO checkpoint at id %s", row["last_id"])
+
+    def report(self, host: Optional[str] = None) -> dict:
+        """
+        Availability and burn rate per window for one host or every host
+        """
+        now = time()
+        budget = 1 - self.objective / 100
+        with self.lock:
+            hosts = [host] if host else sorted(self.hosts)
+            counts = {
+                name: {
+                    window_name: window.counts(now)
+                    for window_name, window in self.hosts[name].items()
+                }
+                for name in hosts
+                if name in self.hosts
+            }
+        report = {}
+        for name, windows in counts.items():
+            host_report: Dict = {"windows": {}}
+            for window_name, (total, good) in windows.items():
+                availability = good / total if total else None
+                host_report["windows"][window_name] = {
+                    "requests": total,
+                    "good": good,
+                    "availability": availability,
+                    # Rounded, objectives like 99.9 are inexact in binary
+                    "burn_rate": round((1 - availability) / budget, 4)
+                    if availability is not None and budget
+                    else None,
+                }
+            # Budget left over the longest window, negative once overspent
+            longest = host_report["windows"][self.windows[-1][0]]
+            host_report["budget_remaining"] = (
+                round(1 - longest["burn_rate"], 4)
+                if longest["burn_rate"] is not None
+                else None
+            )
+            report[name] = host_report
+        return {
+            "objective": self.objective,
+            "windows": [name for name, _ in self.windows],
+            "hosts": report,
+        }
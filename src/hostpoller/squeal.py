@@ -2,38 +2,123 @@
 Interface to SQLAlchemy for creating tables, inserting records and running queries
 """
 import logging
-from typing import List
+from queue import Empty, Full, Queue
+from threading import Thread
+from time import monotonic, perf_counter, sleep
+from typing import Callable, Dict, List, Optional, Type, Union
 
-from sqlalchemy import MetaData, Table, create_engine, inspect
-from sqlalchemy.orm import Session
+from backends import PostgresBackend, SqliteBackend
+from metrics import REGISTRY
+from sqlalchemy import MetaData, Table, func, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.sql.elements import ColumnElement
 from sqlalchemy.sql.expression import Insert
 
+INSERT_SECONDS = REGISTRY.histogram(
+    "hostpoller_insert_seconds", "Time to insert a batch of records", ("table",)
+)
+INSERTED_ROWS = REGISTRY.counter(
+    "hostpoller_inserted_rows_total", "Records inserted", ("table",)
+)
+INSERT_ERRORS = REGISTRY.counter(
+    "hostpoller_insert_errors_total", "Batches that failed to insert", ("table",)
+)
+
 
 class Squeal:
     """
-    Main interface to SQLAlchemy to initialize the engine
+    Main interface to SQLAlchemy to initialize the engine through a storage backend
+
+    Engine types:
+        sqlite: rollback journal, readers and the writer share the database lock
+        sqlite-wal: write ahead log, a single writer connection alongside a pool of
+            readers that never block it
+        postgresql: file_path is a postgresql:// URL, batches are loaded with COPY
+            and the response log is partitioned by time
     """
 
+    backends: Dict[str, Union[Type[SqliteBackend], Type[PostgresBackend]]] = {
+        "sqlite": SqliteBackend,
+        "sqlite-wal": SqliteBackend,
+        "postgresql": PostgresBackend,
+    }
+
     def __init__(self, engine_meta: dict) -> None:
         self.logger = logging.getLogger(__name__)
 
-        if engine_meta["type"] == "sqlite":
-            self.sqlite_filepath = engine_meta["file_path"]
-            self.engine = create_engine(f"sqlite:///{self.sqlite_filepath}")
+        backend = self.backends.get(engine_meta["type"])
+        if backend is None:
+            self.logger.error(
+                "Unsupported SQL engine %s, expected one of: %s",
+                engine_meta["type"],
+                ", ".join(self.backends),
+            )
+            raise SystemExit
+        self.backend = backend(engine_meta)
+        self.engine, self.reader_engine = self.backend.create_engines()
 
         self.session = Session(self.engine, future=True)
+        # One session per thread for request handlers, removed at request teardown
+        self.reader_session = scoped_session(
+            sessionmaker(bind=self.reader_engine, future=True)
+        )
         self.meta_data = MetaData(bind=self.engine)
         MetaData.reflect(self.meta_data)
         self.inspector = inspect(self.engine)
 
+    def reflect(self) -> None:
+        """
+        Reload table metadata after the schema has been changed underneath it
+        """
+        self.meta_data.clear()
+        MetaData.reflect(self.meta_data)
+        self.inspector = inspect(self.engine)
+
+    def upsert(self, table: Table) -> Insert:
+        """
+        Dialect insert supporting on_conflict_do_update for given table
+        """
+        if self.engine.dialect.name == "postgresql":
+            return postgresql.insert(table)
+        return sqlite.insert(table)
+
+    def greatest(self, *clauses: ColumnElement) -> ColumnElement:
+        """
+        Largest of the given values within a row
+        """
+        if self.engine.dialect.name == "postgresql":
+            return func.greatest(*clauses)
+        return func.max(*clauses)
+
+    def least(self, *clauses: ColumnElement) -> ColumnElement:
+        """
+        Smallest of the given values within a row
+        """
+        if self.engine.dialect.name == "postgresql":
+            return func.least(*clauses)
+        return func.min(*clauses)
+
     def insert(self, table: Table, record: dict) -> bool:
         """
         Function to manage inserting records
         """
-        statement = Insert(table, values=record)
-        self.logger.debug("Executing: %s", statement)
+        return self.insert_many(table, [record])
 
-        self.engine.execute(statement)
+    def insert_many(self, table: Table, records: List[dict]) -> bool:
+        """
+        Insert a batch of records in a single transaction with the backend's bulk load
+        """
+        self.logger.debug("Executing batch of %s into %s", len(records), table.name)
+        time_start = perf_counter()
+        try:
+            self.backend.bulk_insert(self.engine, table, records)
+        except Exception:
+            INSERT_ERRORS.inc(labels=(table.name,))
+            raise
+        INSERT_SECONDS.observe(perf_counter() - time_start, (table.name,))
+        INSERTED_ROWS.inc(len(records), (table.name,))
         self.logger.debug("Executed")
         return True
 
@@ -52,3 +137,198 @@ class Squeal:
         Describe given table
         """
         print(table)
+
+
+class BatchWriter:
+    """
+    Background stage buffering records on a bounded queue and flushing them in batches
+
+    A batch that fails to insert on a locked database or a lost connection is kept
+    and retried with a doubling backoff while the full queue holds polling back, it
+    is dropped once retries run out or the database rejects the records themselves
+    """
+
+    stop_marker = object()
+    # DB-API and SQLAlchemy errors a retry may get past, matched on class names so
+    # the raw driver errors raised during COPY are covered as well
+    transient_errors = ("OperationalError", "InterfaceError")
+    max_retry_backoff = 30.0
+
+    def __init__(self, squeal: Squeal, table: Table, writer_meta: dict) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.squeal = squeal
+        self.table = table
+        self.batch_size = writer_meta["batch_size"]
+        self.max_age = writer_meta["max_age"]
+        self.queue: Queue = Queue(maxsize=writer_meta["queue_size"])
+        self.retries = writer_meta.get("retries", 5)
+        self.retry_backoff = writer_meta.get("retry_backoff", 0.5)
+        self.stats: Dict[str, float] = {
+            "rows_written": 0,
+            "rows_dropped": 0,
+            "flushes": 0,
+            "flush_retries": 0,
+            "blocked_puts": 0,
+            "flush_seconds_last": 0.0,
+            "flush_seconds_max": 0.0,
+            "flush_seconds_total": 0.0,
+        }
+        self.preparers: List[Callable[[List[dict]], None]] = []
+        self.listeners: List[Callable[[List[dict]], None]] = []
+        self.thread = Thread(target=self.run, name="batch-writer", daemon=True)
+
+    def add_preparer(self, preparer: Callable[[List[dict]], None]) -> None:
+        """
+        Register callback run on the writer thread to rewrite each batch in place
+        before it is written
+        """
+        self.preparers.append(preparer)
+
+    def add_listener(self, listener: Callable[[List[dict]], None]) -> None:
+        """
+        Register callback run on the writer thread with each committed batch
+        """
+        self.listeners.append(listener)
+
+    def start(self) -> None:
+        """
+        Start background writer thread
+        """
+        self.logger.info(
+            "Starting batch writer, batch size: %s max age: %ss",
+            self.batch_size,
+            self.max_age,
+        )
+        self.thread.start()
+
+    def stop(self, timeout: float = 60.0) -> None:
+        """
+        Flush anything buffered and wait for the writer thread to exit
+        """
+        if not self.thread.is_alive():
+            return
+        try:
+            self.queue.put(self.stop_marker, timeout=timeout)
+        except Full:
+            self.logger.error("Write queue still full after %ss, not stopped", timeout)
+            return
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            self.logger.error(
+                "Batch writer did not stop in %ss: %s", timeout, self.counters()
+            )
+            return
+        self.logger.info("Batch writer stopped: %s", self.counters())
+
+    def put(self, record: dict, timeout: Optional[float] = None) -> None:
+        """
+        Queue record for writing, blocks while the queue is full to apply backpressure
+        """
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.stats["blocked_puts"] += 1
+            self.logger.debug("Write queue full, waiting on writer")
+            self.queue.put(record, timeout=timeout)
+
+    def counters(self) -> Dict[str, float]:
+        """
+        Return writer counters including current queue depth
+        """
+        counters = dict(self.stats)
+        counters["queue_depth"] = self.queue.qsize()
+        return counters
+
+    def run(self) -> None:
+        """
+        Collect records until the batch is full or old enough, then flush
+        """
+        batch: List[dict] = []
+        batch_deadline = 0.0
+        while True:
+            timeout = max(0.0, batch_deadline - monotonic()) if batch else None
+            try:
+                record = self.queue.get(timeout=timeout)
+            except Empty:
+                record = None
+
+            if record is self.stop_marker:
+                self.flush(batch)
+                return
+            if record is not None:
+                if not batch:
+                    batch_deadline = monotonic() + self.max_age
+                batch.append(record)
+                if len(batch) < self.batch_size and monotonic() < batch_deadline:
+                    continue
+
+            self.flush(batch)
+            batch = []
+
+    @classmethod
+    def transient(cls, err: Exception) -> bool:
+        """
+        Whether a failed insert may succeed when retried, eg: database locked or
+        connection lost, rather than failing on the records themselves
+        """
+        if isinstance(err, DBAPIError) and err.connection_invalidated:
+            return True
+        if isinstance(err, OSError):
+            return True
+        return any(kind.__name__ in cls.transient_errors for kind in type(err).__mro__)
+
+    def flush(self, batch: List[dict]) -> None:
+        """
+        Write batch in one transaction and record flush latency, retrying transient
+        failures before dropping it
+        """
+        if not batch:
+            return
+        time_start = perf_counter()
+        attempt = 0
+        while True:
+            # Preparers rewrite records in place, each attempt starts from a copy
+            prepared = [dict(record) for record in batch]
+            try:
+                for preparer in self.preparers:
+                    preparer(prepared)
+                self.squeal.insert_many(self.table, prepared)
+                break
+            except Exception as err:  # pylint: disable=broad-except
+                if attempt >= self.retries or not self.transient(err):
+                    self.stats["rows_dropped"] += len(batch)
+                    self.logger.error(
+                        "Dropped batch of %s records after %s attempts: %s",
+                        len(batch),
+                        attempt + 1,
+                        err,
+                    )
+                    return
+                backoff = min(self.max_retry_backoff, self.retry_backoff * 2**attempt)
+                attempt += 1
+                self.stats["flush_retries"] += 1
+                self.logger.warning(
+                    "Batch of %s records failed, retry %s of %s in %ss: %s",
+                    len(batch),
+                    attempt,
+                    self.retries,
+                    backoff,
+                    err,
+                )
+                sleep(backoff)
+        batch = prepared
+        flush_seconds = perf_counter() - time_start
+        self.stats["rows_written"] += len(batch)
+        self.stats["flushes"] += 1
+        self.stats["flush_seconds_last"] = flush_seconds
+        self.stats["flush_seconds_total"] += flush_seconds
+        self.stats["flush_seconds_max"] = max(
+            self.stats["flush_seconds_max"], flush_seconds
+        )
+        self.logger.debug("Flushed %s records in %.4fs", len(batch), flush_seconds)
+
+        for listener in self.listeners:
+            try:
+                listener(batch)
+            except Exception as err:  # pylint: disable=broad-except
+                self.logger.error("Batch listener %s failed: %s", listener, err)
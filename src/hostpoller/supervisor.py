@@ -0,0 +1,411 @@
+"""
+Supervisor sharding targets across poller worker processes by consistent hashing on
+host, worker results are sent back in batches to the single writer
+"""
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import multiprocessing.process
+import multiprocessing.synchronize
+import os
+from argparse import Namespace as ArgNamespace
+from queue import Empty
+from signal import SIG_IGN, SIGHUP, SIGINT, signal
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+from poller import Poller
+
+# Record fields in the order rows are sent from workers
+RESULT_FIELDS = (
+    "response_date",
+    "protocol",
+    "host",
+    "request_path",
+    "response_code",
+    "response_reason",
+    "response_cookies",
+    "response_headers",
+    "time_elapsed",
+    "time_dns",
+    "time_connect",
+    "time_tls",
+    "time_ttfb",
+    "time_transfer",
+    "breaker_state",
+)
+
+
+class HashRing:
+    """
+    Consistent hash ring of worker slots, each slot placed at many points so hosts
+    spread evenly and adding targets never moves existing hosts between workers
+    """
+
+    def __init__(self, nodes: int, replicas: int = 64) -> None:
+        self.points: List[Tuple[int, int]] = sorted(
+            (self.position(f"worker-{node}-{replica}"), node)
+            for node in range(nodes)
+            for replica in range(replicas)
+        )
+        self.positions = [position for position, _ in self.points]
+
+    @staticmethod
+    def position(key: str) -> int:
+        """
+        Position of key on the ring
+        """
+        return int.from_bytes(
+            hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big"
+        )
+
+    def node(self, key: str) -> int:
+        """
+        Worker slot owning key, the first point clockwise from its position
+        """
+        index = bisect.bisect(self.positions, self.position(key)) % len(self.points)
+        return self.points[index][1]
+
+
+class ResultBatcher:
+    """
+    Buffer records in a worker and send them to the supervisor as lists of tuples,
+    once a batch is full or max_age seconds after its first record, the worker's
+    metrics are sent alongside as a dict every metrics_interval seconds
+    """
+
+    metrics_interval = 5.0
+
+    def __init__(self, results: multiprocessing.Queue, batch_meta: dict) -> None:
+        self.results = results
+        self.source = f"worker-{batch_meta['slot']}"
+        self.batch_size = batch_meta["batch_size"]
+        self.max_age = batch_meta["max_age"]
+        self.lock = Lock()
+        self.batch: List[tuple] = []
+        self.batch_deadline = 0.0
+        self.stop_event = Event()
+        self.thread = Thread(target=self.run, name="result-batcher", daemon=True)
+        self.thread.start()
+
+    def put(self, record: dict) -> None:
+        """
+        Poller sink, add record to the open batch
+        """
+        # Host and path strings are shared per target, pickling stores each once
+        row = tuple(record.get(field) for field in RESULT_FIELDS)
+        with self.lock:
+            if not self.batch:
+                self.batch_deadline = monotonic() + self.max_age
+            self.batch.append(row)
+            if len(self.batch) < self.batch_size:
+                return
+            batch, self.batch = self.batch, []
+        self.results.put(batch)
+
+    def flush(self) -> None:
+        """
+        Send the open batch
+        """
+        with self.lock:
+            batch, self.batch = self.batch, []
+        if batch:
+            self.results.put(batch)
+
+    def run(self) -> None:
+        """
+        Send batches that have reached max_age
+        """
+        metrics_deadline = monotonic() + self.metrics_interval
+        while not self.stop_event.wait(self.max_age / 4):
+            with self.lock:
+                due = self.batch and monotonic() >= self.batch_deadline
+            if due:
+                self.flush()
+            if monotonic() >= metrics_deadline:
+                self.send_metrics()
+                metrics_deadline = monotonic() + self.metrics_interval
+
+    def send_metrics(self) -> None:
+        """
+        Send a snapshot of this worker's metrics
+        """
+        self.results.put({"source": self.source, "metrics": REGISTRY.snapshot()})
+
+    def close(self) -> None:
+        """
+        Stop the age check and send whatever is left
+        """
+        self.stop_event.set()
+        self.thread.join()
+        self.flush()
+        self.send_metrics()
+
+
+def run_worker(
+    worker_meta: dict,
+    parsed_args: ArgNamespace,
+    results: multiprocessing.Queue,
+    stop_event: multiprocessing.synchronize.Event,
+) -> None:
+    """
+    Worker process entry point, poll a shard of targets until stopped by the
+    supervisor or the monitor period ends
+    """
+    # Terminal signals reach the whole process group, only the supervisor acts on them
+    signal(SIGINT, SIG_IGN)
+    signal(SIGHUP, SIG_IGN)
+    logger = logging.getLogger(__name__)
+    shard_args = ArgNamespace(**vars(parsed_args))
+    shard_args.target = worker_meta["targets"]
+    shard_args.targets_file = ""
+    batcher = ResultBatcher(results, worker_meta)
+    poller = Poller(shard_args, None, batcher.put)
+    parent = multiprocessing.parent_process()
+    polling_done = Event()
+
+    def watch() -> None:
+        # Polled rather than waited on, a process exiting while waiting on a shared
+        # event leaves it counting a sleeper and the supervisor's set() blocks
+        while not polling_done.wait(1):
+            if stop_event.is_set():
+                break
+            if parent is not None and not parent.is_alive():
+                logger.error("Supervisor is gone, stopping worker")
+                break
+        else:
+            # Polling finished on its own and its loop is closed
+            return
+        poller.stop()
+
+    watcher = Thread(target=watch, name="worker-stop", daemon=True)
+    watcher.start()
+    logger.info(
+        "Worker %s polling %s targets in pid %s",
+        worker_meta["slot"],
+        len(worker_meta["targets"]),
+        os.getpid(),
+    )
+    try:
+        poller.start()
+    finally:
+        # Nothing touches the shared event once the watcher has exited
+        polling_done.set()
+        watcher.join()
+        batcher.close()
+        results.close()
+        results.join_thread()
+
+
+class Supervisor:
+    """
+    Shard targets across worker processes by host, collect their result batches into
+    the sink, restart workers that crash and reshard when the targets file changes
+    """
+
+    def __init__(
+        self,
+        supervisor_meta: dict,
+        parsed_args: ArgNamespace,
+        sink: Callable[[Dict], None],
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.workers = supervisor_meta["workers"]
+        self.batch_meta = {
+            "batch_size": supervisor_meta["batch_size"],
+            "max_age": supervisor_meta["max_age"],
+        }
+        self.restart_delay = supervisor_meta.get("restart_delay", 5.0)
+        self.parsed_args = parsed_args
+        self.sink = sink
+        self.ring = HashRing(self.workers)
+        # Spawned workers do not inherit the writer, web server or database threads
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue(maxsize=4 * self.workers)
+        self.processes: Dict[int, multiprocessing.process.BaseProcess] = {}
+        self.stop_events: Dict[int, multiprocessing.synchronize.Event] = {}
+        self.shards: Dict[int, List[str]] = {}
+        self.started: Dict[int, float] = {}
+        self.targets_mtime: Optional[float] = None
+        self.resharding = False
+        self.stop_event = Event()
+        self.stats = {
+            "restarts": 0,
+            "reshards": 0,
+            "batches_received": 0,
+            "rows_received": 0,
+        }
+        self.monitor = Thread(target=self.run, name="supervisor", daemon=True)
+        self.collector = Thread(target=self.collect, name="collector", daemon=True)
+
+    def load_shards(self) -> Dict[int, List[str]]:
+        """
+        Read targets and split them into one shard per worker slot by host
+        """
+        if self.parsed_args.targets_file:
+            self.targets_mtime = os.stat(self.parsed_args.targets_file).st_mtime
+        targets = Poller.load_targets(
+            self.parsed_args.target, self.parsed_args.targets_file
+        )
+        shards: Dict[int, List[str]] = {slot: [] for slot in range(self.workers)}
+        for target in targets:
+            # Host as split out by Poller.parse_target
+            host = target.split()[0].split("/")[2]
+            shards[self.ring.node(host)].append(target)
+        return shards
+
+    def start(self) -> None:
+        """
+        Start a worker per non empty shard, the collector and the monitor
+        """
+        self.shards = self.load_shards()
+        self.logger.info(
+            "Sharding %s targets across %s workers: %s",
+            sum(len(shard) for shard in self.shards.values()),
+            self.workers,
+            [len(shard) for shard in self.shards.values()],
+        )
+        self.collector.start()
+        for slot, shard in self.shards.items():
+            if shard:
+                self.start_worker(slot)
+        self.monitor.start()
+
+    def start_worker(self, slot: int) -> None:
+        """
+        Spawn the worker process for a slot with its current shard
+        """
+        stop_event = self.context.Event()
+        process = self.context.Process(
+            target=run_worker,
+            name=f"poller-worker-{slot}",
+            args=(
+                {"slot": slot, "targets": self.shards[slot], **self.batch_meta},
+                self.parsed_args,
+                self.results,
+                stop_event,
+            ),
+            daemon=True,
+        )
+        process.start()
+        self.processes[slot] = process
+        self.stop_events[slot] = stop_event
+        self.started[slot] = monotonic()
+
+    def stop_worker(self, slot: int, timeout: float = 10.0) -> None:
+        """
+        Ask the worker of a slot to stop and wait for it, killing it if it hangs
+        """
+        process = self.processes.pop(slot, None)
+        if process is None:
+            return
+        # Held until the worker exits, a worker still starting up rebuilds it
+        stop_event = self.stop_events.pop(slot)
+        stop_event.set()
+        process.join(timeout)
+        if process.is_alive():
+            self.logger.warning("Worker %s did not stop, terminating", slot)
+            process.terminate()
+            process.join()
+
+    def run(self) -> None:
+        """
+        Restart crashed workers and reshard on target changes until stopped
+        """
+        while not self.stop_event.wait(1):
+            for slot, process in list(self.processes.items()):
+                if process.is_alive() or process.exitcode is None:
+                    continue
+                if process.exitcode == 0:
+                    # Monitor period is over
+                    self.processes.pop(slot)
+                    continue
+                if monotonic() - self.started[slot] < self.restart_delay:
+                    continue
+                self.logger.error(
+                    "Worker %s exited with %s, restarting", slot, process.exitcode
+                )
+                self.stats["restarts"] += 1
+                self.start_worker(slot)
+            try:
+                self.check_targets()
+            except OSError as err:
+                self.logger.error("Reading targets failed: %s", err)
+
+    def check_targets(self) -> None:
+        """
+        Restart only the workers whose shard changed after the targets file changed
+        """
+        if not self.parsed_args.targets_file:
+            return
+        if os.stat(self.parsed_args.targets_file).st_mtime == self.targets_mtime:
+            return
+        shards = self.load_shards()
+        changed = [slot for slot in shards if shards[slot] != self.shards[slot]]
+        if not changed:
+            return
+        self.logger.info("Targets changed, resharding workers %s", changed)
+        self.stats["reshards"] += 1
+        self.shards = shards
+        # Workers are briefly all stopped when every changed shard is restarted
+        self.resharding = True
+        for slot in changed:
+            self.stop_worker(slot)
+            if shards[slot] and not self.stop_event.is_set():
+                self.start_worker(slot)
+        self.resharding = False
+
+    def collect(self) -> None:
+        """
+        Pass rows received from workers to the sink until stopped and drained
+        """
+        while True:
+            try:
+                batch = self.results.get(timeout=1)
+            except Empty:
+                if self.stop_event.is_set() and not self.processes:
+                    return
+                continue
+            if isinstance(batch, dict):
+                REGISTRY.merge(batch["source"], batch["metrics"])
+                continue
+            self.stats["batches_received"] += 1
+            self.stats["rows_received"] += len(batch)
+            for row in batch:
+                self.sink(dict(zip(RESULT_FIELDS, row)))
+
+    def stop(self) -> None:
+        """
+        Stop every worker, then deliver the results they sent before exiting
+        """
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        if self.monitor.is_alive():
+            self.monitor.join()
+        # Every worker is signalled before waiting on any so they wind down together
+        for stop_event in self.stop_events.values():
+            stop_event.set()
+        for slot in list(self.processes):
+            self.stop_worker(slot)
+        self.collector.join()
+        self.logger.info("Supervisor stopped: %s", self.counters())
+
+    def running(self) -> bool:
+        """
+        Whether any worker has yet to finish its monitor period
+        """
+        return bool(self.processes) or self.resharding
+
+    def counters(self) -> Dict[str, int]:
+        """
+        Return supervisor counters with the number of live workers
+        """
+        counters = dict(self.stats)
+        counters["workers_alive"] = sum(
+            process.is_alive() for process in list(self.processes.values())
+        )
+        return counters
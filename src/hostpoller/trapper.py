@@ -3,6 +3,7 @@ Interface to signal for handling common signals
 """
 import logging
 from signal import SIGHUP, SIGINT, SIGQUIT, SIGTERM, signal
+from typing import Callable, List
 
 
 class Trapper:  # pylint: disable=too-few-public-methods
@@ -13,15 +14,29 @@ class Trapper:  # pylint: disable=too-few-public-methods
     def __init__(self) -> None:
         self.logger = logging.getLogger(__name__)
         self.signal = signal
+        self.handlers: List[Callable] = []
+        self.shutting_down = False
         self.signal(SIGINT, self.trap_handler)
         self.signal(SIGQUIT, self.trap_handler)
         self.signal(SIGTERM, self.trap_handler)
         self.signal(SIGHUP, self.trap_handler)
 
+    def add_handler(self, handler: Callable) -> None:
+        """
+        Register cleanup handler to run on shutdown, in order of registration
+        """
+        self.handlers.append(handler)
+
     def trap_handler(self, signal_code: int, frame: object) -> None:
         """
         Function to trap kill signals and cleanup on exit
         """
+        if self.shutting_down:
+            # Handlers are already running further up this stack, running them
+            # again would wait on stages they are stopping
+            self.logger.info("Signal %s caught while shutting down", signal_code)
+            return
+        self.shutting_down = True
         if signal_code == 2:
             print()
             self.logger.info("Signal interrupt caught")
@@ -29,4 +44,10 @@ class Trapper:  # pylint: disable=too-few-public-methods
             self.logger.info("Unhandled signal: %s caught", signal_code)
             self.logger.info("Frame: %s", frame)
 
+        for handler in self.handlers:
+            try:
+                handler()
+            except Exception as err:  # pylint: disable=broad-except
+                self.logger.error("Shutdown handler %s failed: %s", handler, err)
+
         raise SystemExit